@@ -0,0 +1,102 @@
+"""
+Micro-benchmark of the ways rows of a books listing can be turned into dicts.
+
+Runs against an in-memory sqlite database, so it only measures the python side of a read: fetching rows from the
+driver and mapping them, not the query itself.
+
+    python -m benchmarks.row_mapping [rows] [repeat]
+"""
+import logging
+import sys
+import timeit
+
+from sqlalchemy import Column, Float, Integer, String, create_engine, insert, select
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+import orm
+from orm import books
+
+Base = declarative_base()
+
+
+class BenchBooks(Base):
+    """
+    Same columns as orm.books.Books, without the postgres specific parts
+    """
+    __tablename__ = 'books'
+
+    book_id = Column(Integer, primary_key=True)
+    title = Column(String, nullable=False)
+    year_published = Column(Integer, nullable=False)
+    author = Column(String, nullable=False)
+    price = Column(Float, nullable=False)
+    category_id = Column(Integer)
+    stock = Column(Integer, nullable=False)
+
+
+def entity_getattr(session):
+    """
+    Previous read path: select whole entities, then one getattr per column per row
+    """
+    return [
+        orm.BaseTable._transform_select_row_into_dict(r, books.BOOKS_COLUMNS)
+        for r in session.execute(select(BenchBooks))
+    ]
+
+
+def columns_mapping_lookup(session):
+    """
+    Select columns, then one lookup in the row mapping per column per row
+    """
+    columns = [BenchBooks.__table__.c[c] for c in books.BOOKS_COLUMNS]
+    return [
+        orm.BaseTable._transform_returning_row_into_dict(r, books.BOOKS_COLUMNS)
+        for r in session.execute(select(*columns))
+    ]
+
+
+def columns_asdict(session):
+    columns = [BenchBooks.__table__.c[c] for c in books.BOOKS_COLUMNS]
+    return [r._asdict() for r in session.execute(select(*columns))]
+
+
+def columns_row_mapper(session):
+    """
+    Current read path: select columns, then a precomputed mapper zipping column names with row values
+    """
+    columns = [BenchBooks.__table__.c[c] for c in books.BOOKS_COLUMNS]
+    to_dict = orm.BaseTable._row_mapper(books.BOOKS_COLUMNS)
+    return [to_dict(r) for r in session.execute(select(*columns))]
+
+
+CANDIDATES = [entity_getattr, columns_mapping_lookup, columns_asdict, columns_row_mapper]
+
+
+def main(rows: int = 10000, repeat: int = 5):
+    logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)     # orm logs every statement
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as session:
+        session.execute(insert(BenchBooks), [
+            {
+                'title': f'title {i}',
+                'year_published': 1900 + i % 120,
+                'author': f'author {i % 500}',
+                'price': 5 + i % 40,
+                'category_id': i % 12,
+                'stock': i % 7
+            } for i in range(rows)
+        ])
+        session.commit()
+
+    with session_factory() as session:
+        expected = entity_getattr(session)
+        for candidate in CANDIDATES:
+            assert candidate(session) == expected, candidate.__name__
+            best = min(timeit.repeat(lambda: candidate(session), number=1, repeat=repeat))
+            print(f'{candidate.__name__:<26} {best * 1000:8.2f} ms for {rows} rows ({best / rows * 1e6:.2f} us/row)')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -4,16 +4,21 @@ service logic for admins
 from functools import wraps
 from typing import List, Dict, Tuple, Optional, Literal
 
-from flask_jwt_extended import get_jwt_identity
-from orm import users, categories, books
+from flask_jwt_extended import get_jwt, get_jwt_identity
+
+from core import authentication, cache, metrics, pagination
+from orm import categories, books, stock_shards
 
 
 def is_admin(func):
+    """
+    Refuses users whose token was not issued to an admin, without any query. The role of the others is checked again
+    through the roles cache, so that a demotion is effective within `ROLES_CACHE_TTL_SECONDS`, not at token expiry.
+    Tokens issued without the role claim only go through the second check.
+    """
     @wraps(func)
     def wrapper(*args, **kwargs):
-        email = get_jwt_identity()
-        users_table = users.Users()
-        if not users_table.read(identifier=email)[0][users.UsersColumns.IS_ADMIN]:
+        if get_jwt().get(authentication.ADMIN_CLAIM) is False or not authentication.read_is_admin(get_jwt_identity()):
             return {'message': 'Logged in user is not admin'}, 403
         return func(*args, **kwargs)
 
@@ -27,6 +32,11 @@ class Admins:
     def __init__(self):
         self.categories = categories.Categories()
         self.books = books.Books()
+        self.stock_shards = stock_shards.StockShards()
+
+    @staticmethod
+    def get_metrics() -> Tuple[Dict, int]:
+        return metrics.metrics.snapshot(), 200
 
     def list_categories(self) -> Tuple[List[Dict], int]:
         return self.categories.read(), 200
@@ -39,13 +49,17 @@ class Admins:
 
     def update_category(self, old_category: str, new_category: str) -> Tuple[Dict, int]:
         try:
-            return self.categories.update(old_category, new_category), 200
+            result = self.categories.update(old_category, new_category)
+            cache.catalog_cache.bump()      # listings can filter by category name
+            return result, 200
         except Exception as e:
             return {'category_name': old_category, 'error': str(e.__class__), 'message': 'Old category not found'}, 404
 
     def delete_category(self, category: str) -> Tuple[Dict, int]:
         try:
-            return self.categories.delete(category), 200
+            result = self.categories.delete(category)
+            cache.catalog_cache.bump()
+            return result, 200
         except IndexError as e:
             return {'category_name': category, 'error': str(e.__class__), 'message': 'Category not found'}, 404
         except Exception as e:
@@ -56,20 +70,58 @@ class Admins:
             filter_values: Optional[List] = None,
             filter_column: str = categories.CategoriesColumns.CATEGORY_NAME,
             order_column: Optional[Literal[books.BooksColumns.PRICE, books.BooksColumns.YEAR_PUBLISHED]] = None,
-            order_descending: Optional[bool] = None
-    ) -> Tuple[List[Dict], int]:
-        return self.books.read(filter_values, filter_column, order_column, order_descending), 200
+            order_descending: Optional[bool] = None,
+            limit: Optional[int] = None,
+            after: Optional[str] = None,
+            min_price: Optional[float] = None,
+            max_price: Optional[float] = None,
+            min_year: Optional[int] = None,
+            max_year: Optional[int] = None,
+            columns: Optional[List[str]] = None,
+            stream: bool = False
+    ) -> Tuple:
+        try:
+            after_key = pagination.decode_cursor(after, order_column, order_descending)
+        except ValueError as e:
+            return {'error': str(e.__class__), 'message': e.args[0]}, 400
+        query = dict(
+            filter_values=filter_values,
+            filter_column=filter_column,
+            order_column=order_column,
+            order_descending=order_descending,
+            limit=limit,
+            after=after_key,
+            min_price=min_price,
+            max_price=max_price,
+            min_year=min_year,
+            max_year=max_year,
+            columns=columns
+        )
+        if stream:
+            # books are sent while being read, so there is no next cursor and nothing to cache
+            return self.books.stream(**query), 200
+        return pagination.paginate(cache.read_books(self.books, **query), limit, order_column, order_descending)
 
     def add_book(self, book: Dict) -> Tuple[Dict, int]:
         try:
-            return self.books.create(book), 201
+            result = self.books.create(book)
+            cache.catalog_cache.bump()
+            return result, 201
         except Exception as e:
             book.update(error=str(e.__class__), message=e.args[0])
             return book, 409
 
     def update_book(self, book: Dict) -> Tuple[Dict, int]:
+        """
+        Updates the given columns of a book. The stock of a hot book is spread across its shards, where it is taken from
+        """
         try:
-            return self.books.update({k: v for k, v in book.items() if v}, book[books.BooksColumns.TITLE]), 200
+            result = self.books.update({k: v for k, v in book.items() if v}, book[books.BooksColumns.TITLE])
+            if book.get(books.BooksColumns.STOCK):
+                # the books row of a hot book only displays its stock, which its next rebalance would overwrite
+                self.stock_shards.set_stock(result[books.BooksColumns.BOOK_ID], book[books.BooksColumns.STOCK])
+            cache.catalog_cache.bump()
+            return result, 200
         except IndexError as e:
             book.update(error=str(e.__class__), message='Book not found')
             return book, 404
@@ -79,8 +131,23 @@ class Admins:
 
     def delete_book(self, title: str) -> Tuple[Dict, int]:
         try:
-            return self.books.delete(title), 200
+            result = self.books.delete(title)
+            cache.catalog_cache.bump()
+            return result, 200
         except IndexError as e:
             return {'title': title, 'error': str(e.__class__), 'message': 'Book not found'}, 404
         except Exception as e:
             return {'title': title, 'error': str(e.__class__), 'message': e.args[0]}, 409
+
+    def set_book_shards(self, title: str, shards: int) -> Tuple[Dict, int]:
+        """
+        Flags a book as hot, with its stock split across `shards` counters, or back to a regular book if `shards` is 0
+        """
+        found = self.books.read(
+            filter_column=books.BooksColumns.TITLE, filter_values=[title], columns=[books.BooksColumns.BOOK_ID]
+        )
+        result = self.stock_shards.set_shards(found[0][books.BooksColumns.BOOK_ID], shards) if found else None
+        if result is None:
+            return {'title': title, 'error': str(IndexError), 'message': 'Book not found'}, 404
+        cache.catalog_cache.bump()
+        return {'title': title, **result}, 200
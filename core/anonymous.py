@@ -1,5 +1,7 @@
 from typing import List, Dict, Tuple, Optional, Literal
 
+import const
+from core import cache, pagination
 from orm import books, categories
 
 
@@ -12,8 +14,70 @@ class AnonymousUsers:
             filter_values: Optional[List] = None,
             filter_column: str = categories.CategoriesColumns.CATEGORY_NAME,
             order_column: Optional[Literal[books.BooksColumns.PRICE, books.BooksColumns.YEAR_PUBLISHED]] = None,
-            order_descending: Optional[bool] = None
-    ) -> Tuple[List[Dict], int]:
-        return [
-            i for i in self.books.read(filter_values, filter_column, order_column, order_descending) if i['stock'] > 0
-        ], 200
+            order_descending: Optional[bool] = None,
+            limit: Optional[int] = None,
+            after: Optional[str] = None,
+            min_price: Optional[float] = None,
+            max_price: Optional[float] = None,
+            min_year: Optional[int] = None,
+            max_year: Optional[int] = None,
+            columns: Optional[List[str]] = None,
+            stream: bool = False
+    ) -> Tuple:
+        try:
+            after_key = pagination.decode_cursor(after, order_column, order_descending)
+        except ValueError as e:
+            return {'error': str(e.__class__), 'message': e.args[0]}, 400
+        query = dict(
+            filter_values=filter_values,
+            filter_column=filter_column,
+            order_column=order_column,
+            order_descending=order_descending,
+            limit=limit,
+            after=after_key,
+            in_stock_only=True,
+            min_price=min_price,
+            max_price=max_price,
+            min_year=min_year,
+            max_year=max_year,
+            columns=columns
+        )
+        if stream:
+            # books are sent while being read, so there is no next cursor and nothing to cache
+            return self.books.stream(**query), 200
+        return pagination.paginate(cache.read_books(self.books, **query), limit, order_column, order_descending)
+
+    def search_books(self, query: str, limit: int = const.SEARCH_PAGE_SIZE, after: Optional[str] = None) -> Tuple:
+        try:
+            after_key = pagination.decode_cursor(after, books.SEARCH_RANK)
+        except ValueError as e:
+            return {'error': str(e.__class__), 'message': e.args[0]}, 400
+        search_query = {'search': query, 'limit': limit, 'after': after_key}
+        books_page = cache.catalog_cache.get_or_read(
+            search_query, lambda: self.books.search(query, limit, after_key, in_stock_only=True)
+        )
+        return pagination.paginate(books_page, limit, books.SEARCH_RANK)
+
+    def get_books_facets(
+            self,
+            filter_values: Optional[List] = None,
+            filter_column: str = categories.CategoriesColumns.CATEGORY_NAME,
+            min_price: Optional[float] = None,
+            max_price: Optional[float] = None,
+            min_year: Optional[int] = None,
+            max_year: Optional[int] = None
+    ) -> Tuple[Dict, int]:
+        """
+        Number of available books per category, author, price bucket and year bucket, among the books matching the
+        listing filters
+        """
+        filters = dict(
+            filter_values=filter_values,
+            filter_column=filter_column,
+            in_stock_only=True,
+            min_price=min_price,
+            max_price=max_price,
+            min_year=min_year,
+            max_year=max_year
+        )
+        return cache.catalog_cache.get_or_read({'facets': True, **filters}, lambda: self.books.facets(**filters)), 200
@@ -3,8 +3,27 @@ from typing import Dict, Tuple
 from flask_jwt_extended import create_access_token, create_refresh_token
 from werkzeug.security import generate_password_hash, check_password_hash
 
+import const
+from core import cache, password_hashing
 from orm import users
 
+# access and refresh tokens carry the role of the user, as of when they were issued
+ADMIN_CLAIM = 'is_admin'
+
+users_table = users.Users()
+
+
+def read_is_admin(email: str) -> bool:
+    """
+    Whether the user is admin, as of at most `ROLES_CACHE_TTL_SECONDS` ago; False if there is no such user
+    """
+    role = cache.roles_cache.get(email)
+    if role is None:
+        db_results = users_table.read(identifier=email)
+        role = bool(db_results and db_results[0][users.UsersColumns.IS_ADMIN])
+        cache.roles_cache.set(email, role)
+    return role
+
 
 class Authentication:
     """
@@ -14,7 +33,12 @@ class Authentication:
         self.users = users.Users()
 
     def register(self, credentials: Dict) -> Tuple[Dict, int]:
-        credentials['passwd'] = generate_password_hash(credentials['passwd'], 'sha256')
+        try:
+            credentials['passwd'] = password_hashing.pool.run(
+                generate_password_hash, credentials['passwd'], const.PASSWORD_HASH_METHOD, const.PASSWORD_SALT_LENGTH
+            )
+        except password_hashing.PoolSaturatedError as e:
+            return self._saturated(credentials['email'], e)
         try:
             result = self.users.create(credentials)
             return result, 201
@@ -33,20 +57,50 @@ class Authentication:
             return result, 404
 
         passwd_hash = db_results[0]['passwd']
-        if not check_password_hash(passwd_hash, passwd):
+        try:
+            passwd_ok = password_hashing.pool.run(check_password_hash, passwd_hash, passwd)
+        except password_hashing.PoolSaturatedError as e:
+            return self._saturated(email, e)
+        if not passwd_ok:
             result.update(message='Email or password are incorrect')
             return result, 401
         else:
+            if password_hashing.needs_rehash(passwd_hash):
+                self._rehash(email, passwd)
+            role = bool(db_results[0][users.UsersColumns.IS_ADMIN])
+            cache.roles_cache.set(email, role)
             result.update(
-                access_token=create_access_token(identity=email),
-                refresh_token=create_refresh_token(identity=email)
+                access_token=create_access_token(identity=email, additional_claims={ADMIN_CLAIM: role}),
+                refresh_token=create_refresh_token(identity=email, additional_claims={ADMIN_CLAIM: role})
             )
             return result, 200
 
+    def _rehash(self, email: str, passwd: str):
+        """
+        Replaces, in the background, a password hash made with other parameters than the configured ones
+        """
+        def store_new_hash():
+            self.users.update_passwd(
+                email, generate_password_hash(passwd, const.PASSWORD_HASH_METHOD, const.PASSWORD_SALT_LENGTH)
+            )
+        try:
+            password_hashing.pool.submit(store_new_hash)
+        except password_hashing.PoolSaturatedError:
+            pass    # done at a later login
+
+    @staticmethod
+    def _saturated(email: str, e: Exception) -> Tuple[Dict, int, Dict]:
+        return {'email': email, 'error': str(e.__class__), 'message': e.args[0]}, 503, {
+            'Retry-After': str(const.PASSWORD_HASHING_RETRY_AFTER_SECONDS)
+        }
+
     @staticmethod
     def refresh(email: str, refresh_token: str) -> Tuple[Dict, int]:
+        """
+        New access token, with the current role of the user: a promotion is effective from the next refresh on
+        """
         return {
             'email': email,
-            'access_token': create_access_token(email),
+            'access_token': create_access_token(email, additional_claims={ADMIN_CLAIM: read_is_admin(email)}),
             'refresh_token': refresh_token
         }, 200
@@ -0,0 +1,190 @@
+"""
+in-process caching of catalog reads and user roles
+"""
+import time
+import uuid
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple, Union
+
+import const
+from core import singleflight
+from orm import catalog_version
+
+
+class LRUCache:
+    """
+    Bounded, thread safe mapping that evicts the least recently used entry when full
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        with self._lock:
+            return self._entries.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class TTLCache(LRUCache):
+    """
+    LRU cache whose entries are only served for `ttl` seconds after they were set
+    """
+    def __init__(self, max_size: int, ttl: float):
+        super().__init__(max_size)
+        self.ttl = ttl
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        entry = super().get(key, _MISSING)
+        if entry is _MISSING or entry[0] < time.monotonic():
+            return default
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        super().set(key, (time.monotonic() + self.ttl, value))
+
+
+class LocalVersion:
+    """
+    Catalog version counting the changes made through this process only: for single instance setups
+    """
+    def __init__(self):
+        self._version = 0
+        self._lock = Lock()
+
+    def read(self) -> int:
+        return self._version
+
+    def bump(self) -> int:
+        with self._lock:
+            self._version += 1
+            return self._version
+
+
+class CatalogCache(LRUCache):
+    """
+    LRU cache of catalog query results, tagged with a catalog version. Every path that changes what a listing would
+    return (book CRUD, category renames, books going in or out of stock) must call `bump`, which drops all cached
+    results.
+    The version is kept by `versions`, shared by all application instances: a change made through another instance is
+    seen at the latest `check_interval` seconds later, then the cached results are dropped too.
+    """
+    def __init__(
+            self,
+            max_size: int,
+            versions: Union[LocalVersion, catalog_version.CatalogVersion, None] = None,
+            check_interval: float = 0
+    ):
+        super().__init__(max_size)
+        self.versions = versions or LocalVersion()
+        self.check_interval = check_interval
+        self.version = 0
+        # instances whose versions are equal may still have cached different results, read before one of them synced
+        self.instance = uuid.uuid4().hex
+        self._checked_at = float('-inf')
+        self._reads = singleflight.SingleFlight()
+
+    @property
+    def tag(self) -> str:
+        """
+        Identifies the catalog as of the current version, unlike the version alone, across restarts and processes
+        """
+        self.sync()
+        return f'{self.instance}:{self.version}'
+
+    def sync(self):
+        """
+        Catches up with the changes made through the other instances, if `check_interval` passed since the last check
+        """
+        now = time.monotonic()
+        if now < self._checked_at + self.check_interval:
+            return
+        # the other threads keep the version they have meanwhile, instead of checking too
+        self._checked_at = now
+        self._adopt(self.versions.read())
+
+    def bump(self):
+        self._adopt(self.versions.bump(), clear=True)
+
+    def _adopt(self, version: int, clear: bool = False):
+        with self._lock:
+            # versions only grow: one read before a concurrent bump must not move back
+            if version > self.version:
+                self.version = version
+                clear = True
+            if clear:
+                self._entries.clear()
+
+    @staticmethod
+    def normalize(query: Dict) -> Tuple:
+        """
+        Turns query keyword arguments into a hashable key; filter values are sorted since IN does not care about order
+        """
+        key = []
+        for name, value in sorted(query.items()):
+            if name == 'filter_values' and value:
+                value = sorted(value, key=str)
+            key.append((name, tuple(value) if isinstance(value, list) else value))
+        return tuple(key)
+
+    def get_or_read(self, query: Dict, read: Callable[[], Any]) -> Any:
+        """
+        Returns the cached result of `query` or runs `read` and caches its result. Concurrent misses of the same query
+        run `read` once, the others wait for its result.
+        The version is part of the key, so a result read while the catalog changed is never served afterwards.
+        """
+        self.sync()
+        key = (self.version, self.normalize(query))
+        result = self.get(key, _MISSING)
+        if result is _MISSING:
+            result = self._reads.do(key, lambda: self._read_and_set(key, read))
+        return result
+
+    def _read_and_set(self, key: Tuple, read: Callable[[], Any]) -> Any:
+        # a flight of the same query may have cached its result between this caller's miss and this flight
+        result = self.get(key, _MISSING)
+        if result is not _MISSING:
+            return result
+        result = read()
+        if key[0] == self.version:
+            self.set(key, result)
+        return result
+
+
+_MISSING = object()
+
+catalog_cache = CatalogCache(
+    const.CATALOG_CACHE_SIZE,
+    catalog_version.CatalogVersion() if const.CATALOG_VERSION_STORE == 'database' else LocalVersion(),
+    const.CATALOG_VERSION_CHECK_SECONDS
+)
+# email -> whether the user is admin
+roles_cache = TTLCache(const.ROLES_CACHE_SIZE, const.ROLES_CACHE_TTL_SECONDS)
+
+
+def read_books(books_table, **query) -> Any:
+    """
+    `books_table.read(**query)`, served from the catalog cache when possible
+    """
+    return catalog_cache.get_or_read(query, lambda: books_table.read(**query))
@@ -0,0 +1,131 @@
+"""
+replay of the responses of user requests sent with an Idempotency-Key header, so that clients can retry mutations
+safely
+"""
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from typing import Callable, Dict, Optional, Tuple
+
+import const
+from core import cache, metrics
+from orm import idempotency_keys
+
+CLAIM_TIMEOUT = timedelta(seconds=const.IDEMPOTENCY_CLAIM_TIMEOUT_SECONDS)
+KEY_TTL = timedelta(hours=const.IDEMPOTENCY_KEY_TTL_HOURS)
+
+
+class DatabaseStore:
+    """
+    Keys kept in the idempotency_keys table: shared by all application instances, and kept across restarts
+    """
+    def __init__(self):
+        self.idempotency_keys = idempotency_keys.IdempotencyKeys()
+
+    def claim(self, scope: str, key: str, fingerprint: str) -> Optional[Dict]:
+        return self.idempotency_keys.claim(scope, key, fingerprint, CLAIM_TIMEOUT)
+
+    def save(self, scope: str, key: str, status: int, response: Dict):
+        self.idempotency_keys.save(scope, key, status, response)
+
+    def release(self, scope: str, key: str):
+        self.idempotency_keys.release(scope, key)
+
+    def purge(self) -> int:
+        return self.idempotency_keys.purge(KEY_TTL)
+
+
+class MemoryStore:
+    """
+    Keys kept in process, at most `max_size` of them (least recently used first out): for single instance setups
+    """
+    def __init__(self, max_size: int):
+        self._keys = cache.LRUCache(max_size)
+        self._lock = Lock()
+
+    def claim(self, scope: str, key: str, fingerprint: str) -> Optional[Dict]:
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            existing = self._keys.get((scope, key))
+            if existing is not None:
+                # a claim whose request never stored its response is taken over, like a key kept long enough
+                unfinished = existing[idempotency_keys.IdempotencyKeysColumns.STATUS] is None
+                lifetime = CLAIM_TIMEOUT if unfinished else KEY_TTL
+                if existing[idempotency_keys.IdempotencyKeysColumns.CREATED_AT] >= now - lifetime:
+                    return dict(existing)
+            self._keys.set((scope, key), {
+                idempotency_keys.IdempotencyKeysColumns.FINGERPRINT: fingerprint,
+                idempotency_keys.IdempotencyKeysColumns.STATUS: None,
+                idempotency_keys.IdempotencyKeysColumns.RESPONSE: None,
+                idempotency_keys.IdempotencyKeysColumns.CREATED_AT: now
+            })
+            return None
+
+    def save(self, scope: str, key: str, status: int, response: Dict):
+        with self._lock:
+            claimed = self._keys.get((scope, key))
+            if claimed is not None:
+                claimed.update({
+                    idempotency_keys.IdempotencyKeysColumns.STATUS: status,
+                    idempotency_keys.IdempotencyKeysColumns.RESPONSE: response
+                })
+
+    def release(self, scope: str, key: str):
+        with self._lock:
+            claimed = self._keys.get((scope, key))
+            if claimed is not None and claimed[idempotency_keys.IdempotencyKeysColumns.STATUS] is None:
+                self._keys.pop((scope, key))
+
+    def purge(self) -> int:
+        # expired keys are ignored by `claim`, and evicted when the store is full
+        return 0
+
+
+def run_once(
+        scope: str, key: str, fingerprint: str, run: Callable[[], Tuple[Dict, int]]
+) -> Tuple[Dict, int, Dict]:
+    """
+    Runs a request sent with an idempotency key, unless it ran already: then its stored response is returned, without
+    running it again. Server errors are not stored, so that retries run the request again.
+    :param scope: owner of the key; keys of different users never clash
+    :param fingerprint: hash of the request, to refuse a key reused for another request
+    :param run: runs the request, returns its response and status
+    :return: response, status and headers
+    """
+    existing = store.claim(scope, key, fingerprint)
+    if existing is None:
+        try:
+            response, status = run()
+        except Exception:
+            store.release(scope, key)
+            raise
+        if status >= 500:
+            store.release(scope, key)
+        else:
+            store.save(scope, key, status, response)
+        return response, status, {}
+
+    if existing[idempotency_keys.IdempotencyKeysColumns.FINGERPRINT] != fingerprint:
+        return {'error': str(ValueError), 'message': f'Idempotency key "{key}" was sent with another request'}, 422, {}
+    if existing[idempotency_keys.IdempotencyKeysColumns.STATUS] is None:
+        return {
+            'error': str(RuntimeError), 'message': f'Request with idempotency key "{key}" is still running; retry later'
+        }, 409, {}
+    metrics.metrics.increment('idempotent_replays')
+    return (
+        existing[idempotency_keys.IdempotencyKeysColumns.RESPONSE],
+        existing[idempotency_keys.IdempotencyKeysColumns.STATUS],
+        {'Idempotent-Replayed': 'true'}
+    )
+
+
+def purge_expired_keys() -> int:
+    """
+    Run periodically by the scheduler: deletes the keys kept for `IDEMPOTENCY_KEY_TTL_HOURS` already
+    :return: number of keys deleted
+    """
+    purged = store.purge()
+    metrics.metrics.increment('idempotency_keys_purged', purged)
+    return purged
+
+
+store = DatabaseStore() if const.IDEMPOTENCY_STORE == 'database' else MemoryStore(const.IDEMPOTENCY_MEMORY_STORE_SIZE)
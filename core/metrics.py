@@ -0,0 +1,47 @@
+"""
+in-process metrics of background work, exposed to admins
+"""
+from collections import defaultdict
+from threading import Lock
+from typing import Dict
+
+
+class Metrics:
+    """
+    Counters, and summaries (count, sum, min, max and last value) of observed values, by name
+    """
+    def __init__(self):
+        self._counters = defaultdict(int)
+        self._summaries = {}
+        self._lock = Lock()
+
+    def increment(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            summary = self._summaries.get(name)
+            if summary is None:
+                self._summaries[name] = {'count': 1, 'sum': value, 'min': value, 'max': value, 'last': value}
+                return
+            summary['count'] += 1
+            summary['sum'] += value
+            summary['min'] = min(summary['min'], value)
+            summary['max'] = max(summary['max'], value)
+            summary['last'] = value
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'summaries': {name: dict(summary) for name, summary in self._summaries.items()}
+            }
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._summaries.clear()
+
+
+metrics = Metrics()
@@ -0,0 +1,80 @@
+"""
+post-checkout work, done by background workers so that checkout only waits for the order to be written
+"""
+import logging
+from typing import Dict
+
+import const
+from core import cache, metrics, task_queue
+from orm import orders, stock_shards
+
+logger = logging.getLogger(__name__)
+
+ORDER_PLACED = 'order_placed'
+
+
+def send_receipt(order: Dict):
+    lines = ', '.join(
+        f'{line[orders.OrderLinesColumns.QUANTITY]} x book {line[orders.OrderLinesColumns.BOOK_ID]} at '
+        f'{line[orders.OrderLinesColumns.PRICE]}' for line in order['lines']
+    )
+    logger.info(
+        f'Receipt of order {order[orders.OrdersColumns.ORDER_ID]} for {order[orders.OrdersColumns.EMAIL]}: {lines}; '
+        f'total {order[orders.OrdersColumns.PRICE]}'
+    )
+
+
+def reconcile_stock(order: Dict):
+    """
+    Hot books only display their stock as of their last rebalance: refresh the ones sold
+    """
+    book_ids = [line[orders.OrderLinesColumns.BOOK_ID] for line in order['lines']]
+    if stock_shards.StockShards.availability_changed(stock_shards.StockShards().rebalance(book_ids)):
+        cache.catalog_cache.bump()
+
+
+def record_sale(order: Dict):
+    metrics.metrics.increment('orders_processed')
+    metrics.metrics.increment('books_sold', order[orders.OrdersColumns.QUANTITY])
+    metrics.metrics.observe('order_price', order[orders.OrdersColumns.PRICE])
+
+
+def _handle_order(order: Dict):
+    send_receipt(order)
+    reconcile_stock(order)
+    record_sale(order)
+
+
+def process_order(payload: Dict):
+    """
+    Handler of ORDER_PLACED tasks. Does nothing for an order processed already, or being processed by another worker
+    (of any application instance), so it can be queued several times safely.
+    """
+    orders.Orders().process(payload['order_id'], _handle_order)
+
+
+workers = task_queue.WorkerPool(
+    task_queue.TaskQueue(const.TASK_QUEUE_PATH, const.TASK_CLAIM_TIMEOUT_SECONDS),
+    {ORDER_PLACED: process_order},
+    workers=const.ORDER_WORKERS,
+    poll_interval=const.TASK_POLL_INTERVAL_SECONDS,
+    max_attempts=const.TASK_MAX_ATTEMPTS,
+    retry_delay=const.TASK_RETRY_DELAY_SECONDS
+)
+
+
+def submit(order_id: int) -> bool:
+    """
+    Queues the post-checkout work of an order
+    """
+    return workers.submit(ORDER_PLACED, {'order_id': order_id}, key=f'order:{order_id}')
+
+
+def requeue_placed_orders() -> int:
+    """
+    Queues the orders still waiting for their post-checkout work, which the queue may have missed if the server stopped
+    right after placing them. Orders queued already by this instance are not queued twice; the ones queued by other
+    instances are, but only one of them processes an order (see `process_order`).
+    :return: number of orders queued
+    """
+    return sum(submit(order_id) for order_id in orders.Orders().read_ids(orders.OrderStatus.PLACED))
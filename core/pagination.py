@@ -0,0 +1,70 @@
+"""
+keyset (cursor) pagination for book listings
+"""
+import base64
+import json
+from typing import Dict, List, Optional, Tuple
+
+from orm import books
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def _keyset(book: Dict, order_column: Optional[str]) -> List:
+    """
+    Values of the ordering columns of a book; book_id is always the last one, as tiebreaker
+    """
+    key = [book[order_column]] if order_column else []
+    key.append(book[books.BooksColumns.BOOK_ID])
+    return key
+
+
+def encode_cursor(book: Dict, order_column: Optional[str], descending: bool = False) -> str:
+    """
+    Opaque cursor pointing right after the given book, for the given ordering
+    """
+    payload = json.dumps(
+        {'order': order_column, 'desc': bool(descending), 'key': _keyset(book, order_column)}, separators=(',', ':')
+    )
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def _is_valid_keyset(key) -> bool:
+    """
+    Whether `key` can be compared with the ordering columns: a number (price, year or search rank) if there is an
+    ordering column, then a book_id
+    """
+    if not isinstance(key, list) or not key or isinstance(key[-1], bool) or not isinstance(key[-1], int):
+        return False
+    return all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in key[:-1])
+
+
+def decode_cursor(cursor: Optional[str], order_column: Optional[str], descending: bool = False) -> Optional[List]:
+    """
+    Turns a cursor received from the client back into keyset values
+    :raises ValueError: cursor is malformed or was issued for another ordering
+    """
+    if not cursor:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        key = payload['key']
+        key_length = len(key)
+    except (ValueError, KeyError, TypeError):
+        raise ValueError(f'Malformed cursor "{cursor}"')
+    if payload.get('order') != order_column or payload.get('desc') is not bool(descending):
+        raise ValueError('Cursor was issued for a different ordering')
+    if key_length != (2 if order_column else 1) or not _is_valid_keyset(key):
+        raise ValueError(f'Malformed cursor "{cursor}"')
+    return key
+
+
+def paginate(
+        books_page: List[Dict], limit: Optional[int], order_column: Optional[str], descending: bool = False
+) -> Tuple:
+    """
+    Builds the service response for a page; a next cursor header is added only when the page is full
+    """
+    if limit and len(books_page) == limit:
+        return books_page, 200, {NEXT_CURSOR_HEADER: encode_cursor(books_page[-1], order_column, descending)}
+    return books_page, 200
@@ -0,0 +1,73 @@
+"""
+password hashing, run on a bounded pool of threads so that bursts of logins cannot take every request thread
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import BoundedSemaphore
+from typing import Callable
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
+
+import const
+from core import metrics
+
+
+class PoolSaturatedError(Exception):
+    pass
+
+
+class HashingPool:
+    """
+    Runs hashing functions on `workers` threads, with at most `max_queued` more waiting for a thread: past that,
+    new work is refused at once instead of queueing up behind a burst.
+    hashlib releases the GIL while it hashes, so the other request threads keep running meanwhile.
+    """
+    def __init__(self, workers: int, max_queued: int):
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='password-hashing')
+        self._slots = BoundedSemaphore(workers + max_queued)
+
+    def submit(self, func: Callable, *args) -> Future:
+        """
+        :raise PoolSaturatedError: if all workers are busy and the queue is full
+        """
+        if not self._slots.acquire(blocking=False):
+            metrics.metrics.increment('password_hashing_rejected')
+            raise PoolSaturatedError('Too many authentication requests at the moment; retry later')
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def run(self, func: Callable, *args):
+        """
+        Runs `func(*args)` on the pool, and waits for its result
+        :raise PoolSaturatedError: if all workers are busy and the queue is full
+        """
+        return self.submit(func, *args).result()
+
+
+def _recorded_method(method: str) -> str:
+    """
+    Method as werkzeug records it in the hashes it makes: pbkdf2 methods with their number of iterations
+    """
+    if method.startswith('pbkdf2:') and method.count(':') == 1:
+        return f'{method}:{DEFAULT_PBKDF2_ITERATIONS}'
+    return method
+
+
+def needs_rehash(passwd_hash: str) -> bool:
+    """
+    Whether the hash was made with other parameters than the current ones: method and cost (`PASSWORD_HASH_METHOD`),
+    or salt length (`PASSWORD_SALT_LENGTH`)
+    """
+    parts = passwd_hash.split('$')
+    return (
+        len(parts) != 3
+        or parts[0] != _recorded_method(const.PASSWORD_HASH_METHOD)
+        or len(parts[1]) != const.PASSWORD_SALT_LENGTH
+    )
+
+
+pool = HashingPool(const.PASSWORD_HASHING_WORKERS, const.PASSWORD_HASHING_MAX_QUEUED)
@@ -0,0 +1,50 @@
+"""
+in-process admission control: token buckets per client, and a cap on concurrent work
+"""
+import time
+from threading import BoundedSemaphore, Lock
+from typing import Hashable
+
+from core import cache
+
+
+class TokenBuckets:
+    """
+    One token bucket per key, refilled with `rate` tokens per second up to `burst`; every request takes a token.
+    Past `max_keys`, the buckets of the keys seen least recently are dropped: they start full again, which only gives an
+    idle client its burst back.
+    """
+    def __init__(self, rate: float, burst: int, max_keys: int):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = cache.LRUCache(max_keys)
+        self._lock = Lock()
+
+    def take(self, key: Hashable) -> float:
+        """
+        Takes a token from the bucket of `key`, if there is one
+        :return: 0 if a token was taken, else seconds until there is one
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens >= 1:
+                self._buckets.set(key, (tokens - 1, now))
+                return 0
+            self._buckets.set(key, (tokens, now))
+            return (1 - tokens) / self.rate
+
+
+class ConcurrencyLimit:
+    """
+    At most `max_concurrent` holders at a time; extra ones are refused at once instead of waiting
+    """
+    def __init__(self, max_concurrent: int):
+        self._slots = BoundedSemaphore(max_concurrent)
+
+    def acquire(self) -> bool:
+        return self._slots.acquire(blocking=False)
+
+    def release(self):
+        self._slots.release()
@@ -1,46 +1,82 @@
-from datetime import datetime, timedelta
+from collections import Counter
 from typing import List, Dict, Tuple, Optional, Literal
 
 import const
-from orm import books, carts, categories
+from core import cache, metrics, order_processing, pagination
+from orm import books, carts, categories, orders, stock_shards
 
 
 class RegisteredUsers:
     def __init__(self):
         self.books = books.Books()
         self.carts = carts.Carts()
+        self.stock_shards = stock_shards.StockShards()
+        self.orders = orders.Orders()
 
     def list_books(
             self,
             filter_values: Optional[List] = None,
             filter_column: str = categories.CategoriesColumns.CATEGORY_NAME,
             order_column: Optional[Literal[books.BooksColumns.PRICE, books.BooksColumns.YEAR_PUBLISHED]] = None,
-            order_descending: Optional[bool] = None
-    ) -> Tuple[List[Dict], int]:
-        return [
-            i for i in self.books.read(filter_values, filter_column, order_column, order_descending) if i['stock'] > 0
-        ], 200
-
-    def add_book_to_cart(self, email: str, book_id: int) -> Tuple[Dict, int]:
-        import microservice_apis
-        response = {'email': email}
+            order_descending: Optional[bool] = None,
+            limit: Optional[int] = None,
+            after: Optional[str] = None,
+            min_price: Optional[float] = None,
+            max_price: Optional[float] = None,
+            min_year: Optional[int] = None,
+            max_year: Optional[int] = None,
+            columns: Optional[List[str]] = None,
+            stream: bool = False
+    ) -> Tuple:
         try:
-            book = self._validate_book_stock(book_id)
+            after_key = pagination.decode_cursor(after, order_column, order_descending)
+        except ValueError as e:
+            return {'error': str(e.__class__), 'message': e.args[0]}, 400
+        query = dict(
+            filter_values=filter_values,
+            filter_column=filter_column,
+            order_column=order_column,
+            order_descending=order_descending,
+            limit=limit,
+            after=after_key,
+            in_stock_only=True,
+            min_price=min_price,
+            max_price=max_price,
+            min_year=min_year,
+            max_year=max_year,
+            columns=columns
+        )
+        if stream:
+            # books are sent while being read, so there is no next cursor and nothing to cache
+            return self.books.stream(**query), 200
+        return pagination.paginate(cache.read_books(self.books, **query), limit, order_column, order_descending)
 
-            new_cart_item = self.carts.create({carts.CartsColumns.EMAIL: email, carts.CartsColumns.BOOK_ID: book_id})
-            self.books.update(
-                update_data={books.BooksColumns.STOCK: book[books.BooksColumns.STOCK] - 1},
-                identifier=book_id,
-                identifier_type=books.BooksColumns.BOOK_ID
-            )
-            response.update(message='Book added to user cart')
-            microservice_apis.scheduler.add_job(
-                func,
-                'date',
-                run_date=datetime.now() + timedelta(minutes=const.CART_CLEANUP_TIMEDELTA_MINUTES),
-                id=str(new_cart_item[carts.CartsColumns.CART_ID]),
-                replace_existing=True,
-                args=[new_cart_item[carts.CartsColumns.CART_ID], book_id]
+    def add_book_to_cart(self, email: str, book_id: int, quantity: int = 1) -> Tuple[Dict, int]:
+        """
+        Adds copies of the book to the user's cart line of this book, which is created if needed
+        """
+        response = {'email': email}
+        try:
+            cart_line = self.carts.add_book(email, book_id, quantity)
+            rebalanced = {}
+            if not cart_line:
+                # nothing was reserved; only now read the book, to tell a missing book from one out of stock
+                book = self._validate_book_stock(book_id)
+                if book[books.BooksColumns.HOT]:
+                    # its shards with enough copies may only be locked by other buyers; wait for them this time
+                    cart_line = self.carts.add_book(email, book_id, quantity, skip_locked=False)
+                    rebalanced = {} if cart_line else self.stock_shards.rebalance([book_id], reserve=quantity)
+                if rebalanced:
+                    # none of its shards has enough copies, but together they have; now the first one has
+                    cart_line = self.carts.add_book(email, book_id, quantity)
+            if _listed_availability_changed([cart_line] if cart_line else [], rebalanced):
+                cache.catalog_cache.bump()
+            if not cart_line:
+                raise Exception(f'Book with ID "{book_id}" does not have {quantity} copies in stock')
+            response.update(
+                cart_id=cart_line[carts.CartsColumns.CART_ID],
+                quantity=cart_line[carts.CartsColumns.QUANTITY],
+                message='Book added to user cart'
             )
             return response, 201
         except ValueError as e:
@@ -50,103 +86,183 @@ class RegisteredUsers:
             response.update(error=str(e.__class__), message=e.args[0])
             return response, 403
 
+    def add_books_to_cart(self, email: str, book_ids: List[int]) -> Tuple[Dict, int]:
+        """
+        Adds several books at once, with the same few statements whatever their number.
+        Each requested book is added or refused independently of the others; a book requested n times needs n copies.
+        """
+        response = {'email': email}
+        if not 0 < len(book_ids) <= const.CART_BATCH_MAX_BOOKS:
+            response.update(items=[], message=f'Between 1 and {const.CART_BATCH_MAX_BOOKS} books can be added at once')
+            return response, 400
+
+        cart_lines = self.carts.add_books(email, book_ids)
+        refused = self._refused_copies(book_ids, cart_lines)
+        # nothing was reserved for these; only now read them, to tell missing books from the ones out of stock
+        refused_books = self.books.read(
+            filter_column=books.BooksColumns.BOOK_ID,
+            filter_values=list(dict.fromkeys(refused)),
+            columns=[books.BooksColumns.BOOK_ID, books.BooksColumns.HOT]
+        ) if refused else []
+        existing_ids = {book[books.BooksColumns.BOOK_ID] for book in refused_books}
+        hot_ids = {book[books.BooksColumns.BOOK_ID] for book in refused_books if book[books.BooksColumns.HOT]}
+        refused = [book_id for book_id in refused if book_id in hot_ids]
+        rebalanced = {}
+        if refused:
+            # hot books: their shards with enough copies may only be locked by other buyers; wait for them this time
+            cart_lines += self.carts.add_books(email, refused, skip_locked=False)
+            refused = self._refused_copies(refused, cart_lines)
+        if refused:
+            # hot books whose shards have enough copies together, but none of them alone
+            copies = Counter(refused)
+            for quantity in sorted(set(copies.values())):
+                rebalanced.update(self.stock_shards.rebalance(
+                    [book_id for book_id in copies if copies[book_id] == quantity], reserve=quantity
+                ))
+            if rebalanced:
+                cart_lines += self.carts.add_books(email, [book_id for book_id in refused if book_id in rebalanced])
+        cart_ids = {line[carts.CartsColumns.BOOK_ID]: line[carts.CartsColumns.CART_ID] for line in cart_lines}
+
+        items = []
+        for book_id in book_ids:
+            item = {'book_id': book_id}
+            if book_id in cart_ids:
+                item.update(cart_id=cart_ids[book_id], status=201, message='Book added to user cart')
+            elif book_id in existing_ids:
+                item.update(status=403, message=f'Book with ID "{book_id}" does not have enough copies in stock')
+            else:
+                item.update(status=404, message=f'No book with ID "{book_id}"')
+            items.append(item)
+        added = sum(item['status'] == 201 for item in items)
+        response.update(items=items, message=f'{added} of {len(book_ids)} books added to user cart')
+
+        if _listed_availability_changed(cart_lines, rebalanced):
+            cache.catalog_cache.bump()
+        if not cart_lines:
+            return response, 404 if not existing_ids else 403
+        return response, 201
+
+    @staticmethod
+    def _refused_copies(book_ids: List[int], cart_lines: List[Dict]) -> List[int]:
+        """
+        Requested copies of the books that got no cart line
+        """
+        added_ids = {line[carts.CartsColumns.BOOK_ID] for line in cart_lines}
+        return [book_id for book_id in book_ids if book_id not in added_ids]
+
     def _validate_book_stock(self, book_id: int) -> Dict:
-        read_result = self.books.read(filter_column=books.BooksColumns.BOOK_ID, filter_values=[book_id])
+        read_result = self.books.read(
+            filter_column=books.BooksColumns.BOOK_ID,
+            filter_values=[book_id],
+            columns=[books.BooksColumns.BOOK_ID, books.BooksColumns.STOCK, books.BooksColumns.HOT]
+        )
         if not read_result:
             raise ValueError(f'No book with ID "{book_id}"')
         book = read_result[0]
-        if not book[books.BooksColumns.STOCK]:
+        # the stock of a hot book is only displayed, as of its last rebalance
+        if not book[books.BooksColumns.STOCK] and not book[books.BooksColumns.HOT]:
             raise Exception(f'Book with ID "{book_id}" is out of stock. It should not be in this request')
         return book
 
-    def delete_book_from_cart(self, email: str, cart_id: int) -> Tuple[Dict, int]:
-        import microservice_apis
+    def delete_book_from_cart(self, email: str, cart_id: int, quantity: int = 1) -> Tuple[Dict, int]:
         """
-        Checks if cart item is in the cart of the currently logged user, then removes it
+        Takes copies out of the cart line if it is in the cart of the currently logged user, and puts them back in
+        stock, in a single statement whatever the size of the cart. The line is removed with its last copy.
         """
         response = {'email': email}
-        try:
-            book_id = self._check_if_item_is_in_the_right_cart(cart_id, email)
-            self.carts.delete(identifier=cart_id)
-            microservice_apis.scheduler.remove_job(str(cart_id))
-            self._increase_book_stock(book_id)
-            response.update(message='Book deleted from user cart')
-            return response, 200
-        except ValueError as e:
-            response.update(error=str(e.__class__), message=e.args[0])
-            return response, 404
-        except RuntimeError as e:
-            response.update(error=str(e.__class__), message=e.args[0])
+        back_in_stock = self.carts.remove(cart_id, email, quantity)
+        if back_in_stock is None:
+            response.update(error=str(RuntimeError), message=f'Item with ID "{cart_id}" not in cart of user "{email}"')
             return response, 404
-
-    def _check_if_item_is_in_the_right_cart(self, cart_id: int, email: str) -> int:
-        # this method is doing 2 things, not respecting rules of Clean Code... will leave it like this
-        user_cart = self.carts.read(email)
-        if not user_cart:
-            raise ValueError(f'Cart is empty for user "{email}"')
-        if cart_id not in [item[carts.CartsColumns.CART_ID] for item in user_cart]:
-            raise RuntimeError(f'Item with ID "{cart_id}" not in cart of user "{email}"')
-        for item in user_cart:
-            if item[carts.CartsColumns.CART_ID] == cart_id:
-                return item[carts.CartsColumns.BOOK_ID]
-
-    def _increase_book_stock(self, book_id: int):
-        book = self.books.read(filter_column=books.BooksColumns.BOOK_ID, filter_values=[book_id])[0]
-        self.books.update(
-            update_data={books.BooksColumns.STOCK: book[books.BooksColumns.STOCK] + 1},
-            identifier=book_id,
-            identifier_type=books.BooksColumns.BOOK_ID
-        )
+        if back_in_stock:
+            cache.catalog_cache.bump()
+        response.update(message='Book deleted from user cart')
+        return response, 200
 
     def get_cart_content(self, email: str) -> Tuple[Dict, int]:
         response = {'email': email}
         cart_content = self.carts.get_cart_content(email)
-        if not cart_content:
+        if not cart_content['items']:
             response.update(error=str(ValueError.__class__), message=f'Cart is empty for user "{email}"')
             return response, 404
-        price, book_titles = sum([item[books.BooksColumns.PRICE] for item in cart_content]), [
-            item[books.BooksColumns.TITLE] for item in cart_content
-        ]
-        response.update(price=price, books=book_titles)
+        response.update(
+            price=cart_content['price'],
+            quantity=cart_content['quantity'],
+            books=[item[books.BooksColumns.TITLE] for item in cart_content['items']],
+            items=cart_content['items']
+        )
         return response, 200
 
     def checkout_cart(self, email: str) -> Tuple[Dict, int]:
-        result = self.carts.delete(identifier=email, identifier_type=carts.CartsColumns.EMAIL)
-        if result:
-            self._stop_cart_cleanup_jobs(
-                [str(item[carts.CartsColumns.CART_ID]) for item in result]
-            )
-            return {'email': email, 'message': f'Cart emptied for user "{email}"'}, 200
-        else:
+        """
+        Turns the cart into an order in a single statement, and leaves the post-checkout work (receipt, stock
+        reconciliation, sales metrics) to the background workers
+        """
+        order = self.orders.place(email)
+        if order is None:
             return {'email': email, 'message': f'Cart empty for user "{email}", nothing to checkout'}, 404
+        order_processing.submit(order[orders.OrdersColumns.ORDER_ID])
+        return {
+            'email': email,
+            'order_id': order[orders.OrdersColumns.ORDER_ID],
+            'price': order[orders.OrdersColumns.PRICE],
+            'quantity': order[orders.OrdersColumns.QUANTITY],
+            'status': order[orders.OrdersColumns.STATUS],
+            'message': f'Order placed for user "{email}"'
+        }, 200
 
-    @staticmethod
-    def _stop_cart_cleanup_jobs(job_ids: List[str]):
-        import microservice_apis
-        for job_id in job_ids:
-            microservice_apis.scheduler.remove_job(job_id)
 
-
-global func
+def _listed_availability_changed(cart_lines: List[Dict], rebalanced: Dict) -> bool:
+    """
+    Whether adding `cart_lines` (after `rebalanced` hot books) took the last copy of a book, or displays a hot book as
+    back in stock or out of it: public listings only show the books in stock, so their cached pages are outdated.
+    Other stock changes are not worth dropping the catalog cache, the stock listed is only indicative.
+    """
+    return any(line[books.BooksColumns.STOCK] == 0 for line in cart_lines) or (
+        stock_shards.StockShards.availability_changed(rebalanced)
+    )
 
 
-def func(cart_id, book_id):
+def reap_expired_carts(
+        batch_size: int = const.CART_REAPER_BATCH_SIZE, max_batches: int = const.CART_REAPER_MAX_BATCHES
+) -> int:
     """
-     Cart cleanup function, triggered automatically after 30 minutes from adding a book to cart, that deletes said book
-     from your cart and makes it available to the other users (increases book stock by 1)
-
-     According to apscheduler documentation, it needs to be a global function and needs to only have serializable
-     parameters (in order to use pickle)
-     https://apscheduler.readthedocs.io/en/3.x/userguide.html#adding-jobs
+     Cart cleanup, run periodically by the scheduler: removes the cart lines whose lifetime is over and makes their
+     copies available to the other users again, `batch_size` lines per statement. Several application instances can
+     reap at the same time, each one skips the lines the others are working on.
+     Records the size of each batch, and how late its oldest line was removed.
+     :return: number of cart lines removed
     """
     carts_table = carts.Carts()
-    carts_table.delete(cart_id)
-
-    books_table = books.Books()
-    book = books_table.read(filter_column=books.BooksColumns.BOOK_ID, filter_values=[book_id])[0]
-    books_table.update(
-        update_data={books.BooksColumns.STOCK: book[books.BooksColumns.STOCK] + 1},
-        identifier=book_id,
-        identifier_type=books.BooksColumns.BOOK_ID
-    )
-    print('AAAAAAAAA')
+    total = 0
+    back_in_stock_books = 0
+    for _ in range(max_batches):
+        expired, restocked_books, back_in_stock, lag = carts_table.expire(batch_size)
+        if not expired:
+            break
+        total += expired
+        back_in_stock_books += back_in_stock
+        metrics.metrics.observe('cart_reaper_batch_size', expired)
+        metrics.metrics.increment('cart_reaper_expired_items', expired)
+        metrics.metrics.increment('cart_reaper_restocked_books', restocked_books)
+        metrics.metrics.observe('cart_reaper_lag_seconds', lag.total_seconds())
+        if expired < batch_size:
+            break
+    metrics.metrics.increment('cart_reaper_runs')
+    if back_in_stock_books:
+        cache.catalog_cache.bump()
+    return total
+
+
+def rebalance_hot_books() -> int:
+    """
+    Run periodically by the scheduler: spreads the stock of the hot books evenly across their shards again, and
+    refreshes the stock they display
+    :return: number of hot books rebalanced
+    """
+    rebalanced = stock_shards.StockShards().rebalance()
+    metrics.metrics.increment('stock_rebalancer_runs')
+    metrics.metrics.observe('stock_rebalancer_books', len(rebalanced))
+    if stock_shards.StockShards.availability_changed(rebalanced):
+        cache.catalog_cache.bump()
+    return len(rebalanced)
@@ -0,0 +1,52 @@
+"""
+coalescing of identical concurrent calls, so that a burst of identical reads runs one query
+"""
+from threading import Event, Lock
+from typing import Any, Callable, Dict, Hashable
+
+from core import metrics
+
+
+class _Call:
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Calls keyed by what they compute: while a call is running, the calls with the same key do not run, they wait for
+    its result (or its exception) instead
+    """
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = Lock()
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """
+        :return: result of `func`, or of the call with the same key running already
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.metrics.increment('coalesced_calls')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
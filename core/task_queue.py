@@ -0,0 +1,184 @@
+"""
+durable local queue of background tasks, and the pool of worker threads running them
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+_CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS tasks (
+        task_id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        key TEXT UNIQUE,
+        payload TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        available_at REAL NOT NULL,
+        claimed_until REAL NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        error TEXT
+    )
+"""
+
+_CLAIM = """
+    UPDATE tasks SET claimed_until = :claimed_until, attempts = attempts + 1
+    WHERE task_id = (
+        SELECT task_id FROM tasks
+        WHERE NOT failed AND available_at <= :now AND claimed_until <= :now
+        ORDER BY available_at, task_id LIMIT 1
+    )
+    RETURNING task_id, name, payload, attempts, created_at
+"""
+
+
+class TaskQueue:
+    """
+    Tasks stored in a local sqlite database, so that the ones not done yet survive a restart of the server.
+    A task is claimed by one worker at a time. A claim that is neither done nor given up within `claim_timeout` seconds
+    (e.g. the server stopped meanwhile) expires, and the task is claimed again: tasks run at least once, so their
+    handlers must be idempotent.
+    """
+    def __init__(self, path: str, claim_timeout: float):
+        self.path = path
+        self.claim_timeout = claim_timeout
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # one connection per thread; autocommit, every statement below is atomic on its own
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = FULL')
+            connection.execute(_CREATE_TABLE)
+            self._local.connection = connection
+        return connection
+
+    def put(self, name: str, payload: Dict, key: Optional[str] = None) -> bool:
+        """
+        :param key: if given, the task is not added while another task with the same key is still in the queue
+        :return: whether the task was added
+        """
+        now = time.time()
+        cursor = self._connection().execute(
+            'INSERT OR IGNORE INTO tasks (name, key, payload, created_at, available_at) VALUES (?, ?, ?, ?, ?)',
+            (name, key, json.dumps(payload), now, now)
+        )
+        return cursor.rowcount == 1
+
+    def claim(self) -> Optional[Dict]:
+        """
+        :return: the next task available (task_id, name, payload, attempts, created_at), or None if there is none
+        """
+        now = time.time()
+        row = self._connection().execute(_CLAIM, {'now': now, 'claimed_until': now + self.claim_timeout}).fetchone()
+        if row is None:
+            return None
+        task_id, name, payload, attempts, created_at = row
+        return {'task_id': task_id, 'name': name, 'payload': json.loads(payload), 'attempts': attempts,
+                'created_at': created_at}
+
+    def done(self, task_id: int):
+        self._connection().execute('DELETE FROM tasks WHERE task_id = ?', (task_id,))
+
+    def retry(self, task_id: int, delay: float):
+        self._connection().execute(
+            'UPDATE tasks SET available_at = ?, claimed_until = 0 WHERE task_id = ?', (time.time() + delay, task_id)
+        )
+
+    def fail(self, task_id: int, error: str):
+        """
+        Gives up on a task; it stays in the queue, for inspection
+        """
+        self._connection().execute('UPDATE tasks SET failed = 1, error = ? WHERE task_id = ?', (error, task_id))
+
+    def counts(self) -> Dict[str, int]:
+        """
+        :return: number of tasks pending and failed
+        """
+        pending, failed = self._connection().execute(
+            'SELECT count(*) - coalesce(sum(failed), 0), coalesce(sum(failed), 0) FROM tasks'
+        ).fetchone()
+        return {'pending': pending, 'failed': failed}
+
+
+class WorkerPool:
+    """
+    Threads running the tasks of a queue, each one with the handler registered for its name.
+    A task whose handler raises is retried after `retry_delay` seconds, doubled at each attempt, until `max_attempts`.
+    """
+    def __init__(
+            self,
+            queue: TaskQueue,
+            handlers: Dict[str, Callable[[Dict], None]],
+            workers: int,
+            poll_interval: float,
+            max_attempts: int,
+            retry_delay: float
+    ):
+        self.queue = queue
+        self.handlers = handlers
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+        self._wakeup = threading.Condition()
+
+    def start(self):
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'task-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, name: str, payload: Dict, key: Optional[str] = None) -> bool:
+        """
+        Queues a task, and wakes up a worker for it
+        :return: whether the task was added (see `TaskQueue.put`)
+        """
+        added = self.queue.put(name, payload, key)
+        with self._wakeup:
+            self._wakeup.notify()
+        return added
+
+    def _work(self):
+        while not self._stopping.is_set():
+            task = self.queue.claim()
+            if task is None:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+            self.run(task)
+
+    def run(self, task: Dict):
+        try:
+            self.handlers[task['name']](task['payload'])
+        except Exception as e:
+            if task['attempts'] >= self.max_attempts:
+                logger.exception(f'Task {task["task_id"]} ({task["name"]}) failed {task["attempts"]} times, giving up')
+                self.queue.fail(task['task_id'], repr(e))
+                metrics.metrics.increment('tasks_failed')
+            else:
+                self.queue.retry(task['task_id'], self.retry_delay * 2 ** (task['attempts'] - 1))
+                metrics.metrics.increment('tasks_retried')
+            return
+        self.queue.done(task['task_id'])
+        metrics.metrics.increment('tasks_done')
+        metrics.metrics.observe('task_latency_seconds', time.time() - task['created_at'])
@@ -6,6 +6,8 @@ from werkzeug.middleware.proxy_fix import ProxyFix
 
 import const
 import microservice_apis
+from core import order_processing
+from microservice_apis import admission, compression
 from orm import carts
 
 app = Flask(__name__)
@@ -17,8 +19,15 @@ app.config['JWT_ACCESS_TOKEN_EXPIRES'] = const.JWT_ACCESS_TOKEN_EXPIRES
 app.config['JWT_REFRESH_TOKEN_EXPIRES'] = const.JWT_REFRESH_TOKEN_EXPIRES
 JWTManager(app)
 
-app.wsgi_app = ProxyFix(app.wsgi_app)
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=const.TRUSTED_PROXIES, x_proto=const.TRUSTED_PROXIES)
 microservice_apis.api.init_app(app)
+# first hook: refused requests cost nothing else
+app.before_request(admission.admit)
+app.teardown_request(admission.release)
+app.after_request(compression.compress_response)
+order_processing.workers.start()
+# once, right away: orders placed just before the server last stopped may have missed the task queue
+microservice_apis.scheduler.add_job(order_processing.requeue_placed_orders, id='orders_requeue')
 
 
 logger = logging.getLogger('werkzeug')
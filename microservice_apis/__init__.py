@@ -1,8 +1,8 @@
-from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.background import BackgroundScheduler
 from flask_restx import Api
 
 import const
+from core import idempotency as idempotency_core, registered_users as registered_users_core
 from microservice_apis import anonymous, authentication, registered_users, admins
 
 api = Api(title='Book Shop API', description='Book shop RESTful API')
@@ -12,8 +12,30 @@ api.add_namespace(authentication.namespace)
 api.add_namespace(registered_users.namespace)
 api.add_namespace(admins.namespace)
 
-scheduler = BackgroundScheduler(
-    jobstores={'default': SQLAlchemyJobStore(url=const.DB_CONNECTION_URL)}
+# jobs are rescheduled at every start: nothing to persist
+scheduler = BackgroundScheduler()
+scheduler.add_job(
+    registered_users_core.reap_expired_carts,
+    'interval',
+    seconds=const.CART_REAPER_INTERVAL_SECONDS,
+    id='cart_reaper',
+    max_instances=1,
+    coalesce=True
+)
+scheduler.add_job(
+    registered_users_core.rebalance_hot_books,
+    'interval',
+    seconds=const.STOCK_REBALANCE_INTERVAL_SECONDS,
+    id='stock_rebalancer',
+    max_instances=1,
+    coalesce=True
+)
+scheduler.add_job(
+    idempotency_core.purge_expired_keys,
+    'interval',
+    seconds=const.IDEMPOTENCY_PURGE_INTERVAL_SECONDS,
+    id='idempotency_keys_purge',
+    max_instances=1,
+    coalesce=True
 )
 scheduler.start()
-
@@ -1,8 +1,10 @@
 from flask_jwt_extended import jwt_required
-from flask_restx import Namespace, Resource, fields
+from flask_restx import Namespace, Resource, fields, inputs
 from flask_restx.reqparse import RequestParser
+
+import const
 from core import admins
-from orm import books
+from microservice_apis import listing, serialization
 
 namespace = Namespace('Admins', 'Server administrators that can alter database content', '/admins')
 
@@ -30,7 +32,7 @@ admins_service = admins.Admins()
 class CategoriesManagement(Resource):
     @namespace.response(401, 'Missing Authorization Header')
     @namespace.response(403, 'Logged in user is not admin')
-    @namespace.marshal_list_with(categories_response)
+    @serialization.marshal_list_with(namespace, categories_response)
     @jwt_required()
     @admins.is_admin
     def get(self):
@@ -121,46 +123,25 @@ books_dto = namespace.model(
 
 @namespace.route('/books')
 class BooksManagement(Resource):
-    @namespace.doc(
-        params={
-            'filter': {'in': 'query', 'description': 'Field to filter by'},
-            'filter-values': {'in': 'query', 'description': 'Accepted field values'},
-            'order': {'in': 'query', 'description': 'Field to order by'},
-            'order-descending': {'in': 'query', 'description': 'Whether to order descending or ascending'},
-        }
-    )
+    @namespace.doc(params=listing.BOOKS_LISTING_PARAMS)
+    @namespace.response(304, 'Listing did not change since the ETag sent in If-None-Match')
     @namespace.response(400, 'Input payload validation failed')
     @namespace.response(401, 'Missing Authorization Header')
     @namespace.response(403, 'Logged in user is not admin')
-    @namespace.marshal_list_with(books_response)
+    @listing.marshal_listing(namespace, books_response)
     @jwt_required()
     @admins.is_admin
+    @listing.conditional_listing(const.LISTING_MAX_AGE_SECONDS['admins'], private=True)
     def get(self):
         """
-        Reads books based on generic filtering capability. Filtering can be done on any column, but only with exact
-        values: you cannot specify a range for price for example... It is also possible to filter by category name, even
-        though current table has category_id as column -> join with Categories table is used. You can also order results
-        by price or by year, either ascending or descending.
+        Reads books based on generic filtering capability. Filtering can be done on any column with exact values, and on
+        intervals for price and year. It is also possible to filter by category name, even though current table has
+        category_id as column -> join with Categories table is used. You can also order results by price or by year,
+        either ascending or descending.
+        Results are paginated, `limit` books per page: follow the X-Next-Cursor header via `after` for the next one.
+        Use `fields` to only receive some of the book fields, and `stream` to receive books while they are read.
         """
-        parser = RequestParser()
-        parser.add_argument(
-            'filter',
-            location='args',
-            choices=(
-                *books.BOOKS_COLUMNS, 'category_name'
-            )
-        )
-        parser.add_argument('filter-values', location='args', action='split')
-        parser.add_argument('order', location='args', choices=('price', 'year'))
-        parser.add_argument('order-descending', location='args', type=bool, default=False)
-
-        args = parser.parse_args()
-        return admins_service.list_books(
-            filter_values=args['filter-values'],
-            filter_column=args['filter'],
-            order_column=args['order'],
-            order_descending=args['order-descending']
-        )
+        return admins_service.list_books(**listing.parse_books_listing_args(listing.ADMIN_BOOKS_FILTERS))
 
     @namespace.response(400, 'Input payload validation failed')
     @namespace.response(401, 'Missing Authorization Header')
@@ -223,3 +204,71 @@ class BooksManagement(Resource):
         parser = RequestParser()
         parser.add_argument('title', location='json', required=True)
         return admins_service.delete_book(parser.parse_args()['title'])
+
+
+book_shards_response = namespace.model(
+    'BookShardsResponse',
+    {
+        'title': fields.String(description='Title of the book', required=True),
+        'book_id': fields.Integer(description='Internal ID'),
+        'shards': fields.Integer(description='Stock counters of the book; 0 if it is not hot'),
+        'stock': fields.Integer(description='Copies left in stock'),
+        'error': fields.String(description='Backend error class'),
+        'message': fields.String(description='Error message')
+    }
+)
+
+
+@namespace.route('/books/shards')
+class BookShardsManagement(Resource):
+    @namespace.doc(params={
+        'title': {'in': 'json', 'description': 'Title of the book'},
+        'shards': {
+            'in': 'json', 'description': f'Number of stock counters, at most {const.STOCK_SHARDS_MAX}; 0 to stop'
+        }
+    })
+    @namespace.response(400, 'Input payload validation failed')
+    @namespace.response(401, 'Missing Authorization Header')
+    @namespace.response(403, 'Logged in user is not admin')
+    @namespace.response(404, 'Book not found')
+    @namespace.marshal_with(book_shards_response)
+    @jwt_required()
+    @admins.is_admin
+    def put(self):
+        """
+        Flag a book as hot, e.g. before a flash sale: its stock is split across several counters, so that buyers do not
+        wait on each other. Its displayed stock is refreshed periodically. Set `shards` to 0 to make it a regular book
+        again.
+        """
+        parser = RequestParser()
+        parser.add_argument('title', location='json', required=True)
+        parser.add_argument('shards', location='json', required=True, type=inputs.int_range(0, const.STOCK_SHARDS_MAX))
+        return admins_service.set_book_shards(**parser.parse_args())
+
+
+metrics_response = namespace.model(
+    'MetricsResponse',
+    {
+        'counters': fields.Raw(description='Counter name -> value, since the server started'),
+        'summaries': fields.Raw(
+            description='Name -> count, sum, min, max and last of the observed values, e.g. cart_reaper_batch_size, '
+                        'cart_reaper_lag_seconds or stock_rebalancer_books'
+        ),
+        'message': fields.String(description='Error message')
+    }
+)
+
+
+@namespace.route('/metrics')
+class Metrics(Resource):
+    @namespace.response(401, 'Missing Authorization Header')
+    @namespace.response(403, 'Logged in user is not admin')
+    @namespace.marshal_with(metrics_response)
+    @jwt_required()
+    @admins.is_admin
+    def get(self):
+        """
+        Metrics of the background work of this server instance, like the cart expiry reaper or the hot books stock
+        rebalancer
+        """
+        return admins_service.get_metrics()
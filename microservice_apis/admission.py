@@ -0,0 +1,77 @@
+"""
+admission control of API requests: per client rate limits, and a cap on the requests served at the same time, checked
+before any other work so that excess requests are refused cheaply
+"""
+import math
+
+from flask import Response, g, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+
+import const
+from core import metrics, rate_limiting
+from microservice_apis import admins, anonymous, authentication, registered_users, serialization
+
+# first path segment -> namespace name, as in const.RATE_LIMITS
+NAMESPACES = {
+    anonymous.namespace.path: 'anonymous',
+    authentication.namespace.path: 'authentication',
+    registered_users.namespace.path: 'registered_users',
+    admins.namespace.path: 'admins'
+}
+
+rate_limits = {
+    name: rate_limiting.TokenBuckets(*limit, const.RATE_LIMITED_CLIENTS_MAX)
+    for name, limit in const.RATE_LIMITS.items() if limit is not None
+}
+concurrency_limit = rate_limiting.ConcurrencyLimit(const.MAX_CONCURRENT_REQUESTS)
+
+
+def client_key() -> str:
+    """
+    Identity of the logged user, or the IP of the client for anonymous requests: the address the outermost trusted
+    proxy got the request from, as ProxyFix sets it from X-Forwarded-For when configured with `TRUSTED_PROXIES`. The
+    hops a client adds to the header itself are ignored, so that it cannot pick a fresh bucket for each request.
+    """
+    try:
+        identity = verify_jwt_in_request(optional=True) and get_jwt_identity()
+    except Exception:
+        identity = None     # invalid tokens are refused by the endpoints themselves
+    return f'user:{identity}' if identity else f'ip:{request.remote_addr}'
+
+
+def _refused(status: int, message: str, retry_after: float) -> Response:
+    return Response(
+        serialization.dumps({'error': str(RuntimeError), 'message': message}),
+        status,
+        mimetype='application/json',
+        headers={'Retry-After': str(max(1, math.ceil(retry_after)))}
+    )
+
+
+def admit():
+    """
+    `before_request` hook: refuses the request with 503 if `MAX_CONCURRENT_REQUESTS` requests are being served already,
+    or with 429 if its client exceeds the rate limit of the namespace. The cap is checked first, since telling the
+    client needs the JWT decoded: a busy server does not spend that on requests it sheds anyway.
+    """
+    if not concurrency_limit.acquire():
+        metrics.metrics.increment('shed_requests')
+        return _refused(503, 'Server busy; retry after Retry-After seconds', const.SHED_RETRY_AFTER_SECONDS)
+    namespace = NAMESPACES.get('/' + request.path.split('/')[1])
+    buckets = rate_limits.get(namespace)
+    if buckets is not None:
+        wait = buckets.take(client_key())
+        if wait:
+            concurrency_limit.release()
+            metrics.metrics.increment('rate_limited_requests')
+            metrics.metrics.increment(f'rate_limited_requests_{namespace}')
+            return _refused(429, 'Too many requests; retry after Retry-After seconds', wait)
+    g.admitted = True
+
+
+def release(_exception=None):
+    """
+    `teardown_request` hook: frees the slot of an admitted request, once its response was sent (streamed ones included)
+    """
+    if g.pop('admitted', False):
+        concurrency_limit.release()
@@ -1,46 +1,83 @@
-from flask_restx import Namespace, Resource
-from flask_restx.reqparse import RequestParser
-from microservice_apis import admins
+from flask_restx import Namespace, Resource, fields
+
+import const
+from microservice_apis import admins, listing, serialization
 from core import anonymous
+from orm import books
 
 namespace = Namespace('Anonymous users', 'Guest users that are not authenticated', '/anonymous')
 anonymous_service = anonymous.AnonymousUsers()
 
+facet_count = namespace.model(
+    'FacetCount',
+    {
+        'value': fields.Raw(description='Category name, author, or lower bound of the price / year bucket'),
+        'count': fields.Integer(description='Number of available books')
+    }
+)
+
+facets_response = namespace.model(
+    'FacetsResponse',
+    {
+        books.BooksFacets.CATEGORIES: fields.List(fields.Nested(facet_count), description='Most books first'),
+        books.BooksFacets.AUTHORS: fields.List(
+            fields.Nested(facet_count), description=f'Most books first, at most {const.FACETS_MAX_AUTHORS} authors'
+        ),
+        books.BooksFacets.PRICES: fields.List(
+            fields.Nested(facet_count), description=f'Buckets {const.FACETS_PRICE_BUCKET_WIDTH} wide, cheapest first'
+        ),
+        books.BooksFacets.YEARS: fields.List(
+            fields.Nested(facet_count), description=f'Buckets {const.FACETS_YEAR_BUCKET_WIDTH} years wide, oldest first'
+        )
+    }
+)
+
 
 @namespace.route('/')
 class AnonymousListing(Resource):
-    @namespace.doc(
-        params={
-            'filter': {'in': 'query', 'description': 'Field to filter by'},
-            'filter-values': {'in': 'query', 'description': 'Accepted field values'},
-            'order': {'in': 'query', 'description': 'Field to order by'},
-            'order-descending': {'in': 'query', 'description': 'Whether to order descending or ascending'},
-        }
-    )
+    @namespace.doc(params=listing.BOOKS_LISTING_PARAMS)
+    @namespace.response(304, 'Listing did not change since the ETag sent in If-None-Match')
     @namespace.response(400, 'Input payload validation failed')
     @namespace.response(401, 'Missing Authorization Header')
-    @namespace.marshal_list_with(admins.books_response)
+    @listing.marshal_listing(namespace, admins.books_response)
+    @listing.conditional_listing(const.LISTING_MAX_AGE_SECONDS['anonymous'])
     def get(self):
         """
         List available books, based on filtering criteria if provided. Books with stock = 0 are excluded.
-        Filtering can be done on any column, but only with exact values: you cannot specify a range for price for
-        example... It is also possible to filter by category name.
+        Filtering can be done on any column with exact values, and on intervals for price and year. It is also possible
+        to filter by category name.
         You can also order results by price or by year, either ascending or descending.
+        Results are paginated, `limit` books per page: follow the X-Next-Cursor header via `after` for the next one.
+        Use `fields` to only receive some of the book fields, and `stream` to receive books while they are read.
         """
-        parser = RequestParser()
-        parser.add_argument(
-            'filter',
-            location='args',
-            choices=('title', 'year_published', 'author', 'price', 'category_name', 'stock')
-        )
-        parser.add_argument('filter-values', location='args', action='split')
-        parser.add_argument('order', location='args', choices=('price', 'year'))
-        parser.add_argument('order-descending', location='args', type=bool, default=False)
-
-        args = parser.parse_args()
-        return anonymous_service.list_books(
-            filter_values=args['filter-values'],
-            filter_column=args['filter'],
-            order_column=args['order'],
-            order_descending=args['order-descending']
-        )
+        return anonymous_service.list_books(**listing.parse_books_listing_args(listing.PUBLIC_BOOKS_FILTERS))
+
+
+@namespace.route('/books/search')
+class AnonymousSearch(Resource):
+    @namespace.doc(params=listing.BOOKS_SEARCH_PARAMS)
+    @namespace.response(304, 'Listing did not change since the ETag sent in If-None-Match')
+    @namespace.response(400, 'Input payload validation failed')
+    @serialization.marshal_list_with(namespace, admins.books_response)
+    @listing.conditional_listing(const.LISTING_MAX_AGE_SECONDS['anonymous'])
+    def get(self):
+        """
+        Search available books by title and author, most relevant results first. Books with stock = 0 are excluded.
+        Results are paginated: the cursor of the next page is sent in the X-Next-Cursor header.
+        """
+        return anonymous_service.search_books(**listing.parse_books_search_args())
+
+
+@namespace.route('/books/facets')
+class AnonymousFacets(Resource):
+    @namespace.doc(params=listing.BOOKS_FACETS_PARAMS)
+    @namespace.response(304, 'Facets did not change since the ETag sent in If-None-Match')
+    @namespace.response(400, 'Input payload validation failed')
+    @namespace.marshal_with(facets_response)
+    @listing.conditional_listing(const.LISTING_MAX_AGE_SECONDS['anonymous'])
+    def get(self):
+        """
+        Number of available books per category, per author, per price bucket and per year bucket, among the books
+        matching the same filters as the listing. Each bucket is identified by its lower bound.
+        """
+        return anonymous_service.get_books_facets(**listing.parse_books_facets_args(listing.PUBLIC_BOOKS_FILTERS))
@@ -43,6 +43,7 @@ login_response = namespace.model(
         'email': fields.String(description='User email', required=True),
         'access_token': fields.String(description='Successful authentication token'),
         'refresh_token': fields.String(description='Refresh token'),
+        'error': fields.String(description='Backend error class'),
         'message': fields.String(description='Error message')
     }
 )
@@ -66,6 +67,7 @@ class Login(Resource):
     @namespace.response(400, 'Input payload validation failed')
     @namespace.response(404, 'No account associated with provided email')
     @namespace.response(401, 'Wrong password')
+    @namespace.response(503, 'Too many authentication requests at the moment; retry after Retry-After seconds')
     @namespace.marshal_with(login_response)
     def post(self):
         """
@@ -79,6 +81,7 @@ class Register(Resource):
     @namespace.expect(credentials_dto)
     @namespace.response(400, 'Input payload validation failed')
     @namespace.response(403, 'Email already in use')
+    @namespace.response(503, 'Too many authentication requests at the moment; retry after Retry-After seconds')
     @namespace.marshal_with(register_response)
     def post(self):
         """
@@ -0,0 +1,91 @@
+"""
+gzip / brotli compression of API responses, negotiated through Accept-Encoding
+"""
+import gzip
+from typing import List, Optional
+
+from flask import Response, request
+
+import const
+from core import cache
+
+try:
+    import brotli
+except ImportError:     # optional dependency, only gzip is offered without it
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/html', 'text/plain'}
+
+# compressed bodies of responses with an ETag, keyed by (ETag, encoding); the ETag changes with the content, so
+# entries never need invalidation
+compressed_bodies = cache.LRUCache(const.COMPRESSED_BODIES_CACHE_SIZE)
+
+
+def available_encodings() -> List[str]:
+    """
+    Supported encodings, preferred first
+    """
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=const.BROTLI_QUALITY)
+    # fixed mtime, so the same content always gives the same bytes
+    return gzip.compress(data, compresslevel=const.GZIP_COMPRESSION_LEVEL, mtime=0)
+
+
+def etag_variant(etag: str, encoding: str) -> str:
+    """
+    A strong ETag is specific to one encoding of a representation, so compressed responses get a suffixed ETag
+    """
+    return f'{etag}-{encoding}'
+
+
+def etag_variants(etag: str) -> List[str]:
+    """
+    All the ETags a client may hold for the representation identified by `etag`
+    """
+    return [etag, *[etag_variant(etag, encoding) for encoding in available_encodings()]]
+
+
+def _negotiated_encoding() -> Optional[str]:
+    return request.accept_encodings.best_match(available_encodings())
+
+
+def compress_response(response: Response) -> Response:
+    """
+    `after_request` hook compressing large enough, non streamed responses the client accepts in compressed form.
+    Compressed bodies of responses with an ETag are cached, so a repeated listing is only compressed once.
+    """
+    etag, _ = response.get_etag()
+    if response.status_code == 304:
+        # answer with the ETag variant the client validated
+        response.vary.add('Accept-Encoding')
+        encoding = _negotiated_encoding()
+        if etag and encoding and request.if_none_match.contains(etag_variant(etag, encoding)):
+            response.set_etag(etag_variant(etag, encoding))
+        return response
+    if (
+            response.direct_passthrough
+            or response.is_streamed
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers
+    ):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _negotiated_encoding()
+    if not encoding or (response.content_length or 0) < const.COMPRESSION_MIN_SIZE:
+        return response
+
+    body = compressed_bodies.get((etag, encoding)) if etag else None
+    if body is None:
+        body = compress(response.get_data(), encoding)
+        if etag:
+            compressed_bodies.set((etag, encoding), body)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        response.set_etag(etag_variant(etag, encoding))
+    return response
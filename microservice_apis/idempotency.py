@@ -0,0 +1,64 @@
+"""
+Idempotency-Key header handling of the endpoints that change user data
+"""
+import hashlib
+import json
+from functools import wraps
+
+from flask import request
+from flask_jwt_extended import get_jwt_identity
+from flask_restx import Namespace
+from flask_restx.utils import unpack
+
+import const
+from core import idempotency
+
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+
+
+def request_fingerprint() -> str:
+    """
+    Hash of what the current request asks for. A JSON body is hashed in canonical form, so that a retry serializing
+    the same payload with other key order or whitespace is still recognized; any other body is hashed as sent.
+    """
+    fingerprint = hashlib.sha256(f'{request.method} {request.path}\n'.encode())
+    body = request.get_data()
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':')).encode()
+    except ValueError:
+        pass
+    fingerprint.update(body)
+    return fingerprint.hexdigest()
+
+
+def idempotent(namespace: Namespace):
+    """
+    Makes a mutation of the current user safe to retry: when sent with an Idempotency-Key header, the response of its
+    first run is stored, and returned to the requests sent later with the same key, which do not run again.
+    Goes below `marshal_with`, and below `jwt_required`: keys belong to the logged user.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+            if key is None:
+                return func(*args, **kwargs)
+            if not 0 < len(key) <= const.IDEMPOTENCY_KEY_MAX_LENGTH:
+                return {
+                    'error': str(ValueError),
+                    'message': f'{IDEMPOTENCY_KEY_HEADER} must have 1 to {const.IDEMPOTENCY_KEY_MAX_LENGTH} characters'
+                }, 400
+            return idempotency.run_once(
+                get_jwt_identity(), key, request_fingerprint(), lambda: unpack(func(*args, **kwargs))[:2]
+            )
+
+        wrapper = namespace.doc(params={IDEMPOTENCY_KEY_HEADER: {
+            'in': 'header',
+            'description': f'Unique value (e.g. a UUID) making retries safe: a request sent again with the same key '
+                           f'within {const.IDEMPOTENCY_KEY_TTL_HOURS} hours gets the first response, with an '
+                           f'Idempotent-Replayed header, and does not run again. A key sent with another request '
+                           f'is refused (422)'
+        }})(wrapper)
+        return namespace.response(409, 'Request with the same idempotency key still running')(wrapper)
+
+    return decorator
@@ -0,0 +1,242 @@
+"""
+query string handling and HTTP caching shared by the book listing endpoints
+"""
+import hashlib
+from functools import wraps
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from flask import Response, request, stream_with_context
+from flask_restx import Model, Namespace, inputs, marshal
+from flask_restx.reqparse import RequestParser
+from flask_restx.utils import unpack
+
+import const
+from core import cache
+from microservice_apis import compression, serialization
+from orm import books, categories
+
+PUBLIC_BOOKS_FILTERS = (
+    books.BooksColumns.TITLE,
+    books.BooksColumns.YEAR_PUBLISHED,
+    books.BooksColumns.AUTHOR,
+    books.BooksColumns.PRICE,
+    categories.CategoriesColumns.CATEGORY_NAME,
+    books.BooksColumns.STOCK
+)
+
+ADMIN_BOOKS_FILTERS = (*books.BOOKS_COLUMNS, categories.CategoriesColumns.CATEGORY_NAME)
+
+# query string value -> books column
+BOOKS_ORDER_COLUMNS = {'price': books.BooksColumns.PRICE, 'year': books.BooksColumns.YEAR_PUBLISHED}
+
+BOOKS_LISTING_PARAMS = {
+    'filter': {'in': 'query', 'description': 'Field to filter by'},
+    'filter-values': {'in': 'query', 'description': 'Accepted field values'},
+    'order': {'in': 'query', 'description': 'Field to order by'},
+    'order-descending': {'in': 'query', 'description': 'Whether to order descending or ascending'},
+    'limit': {
+        'in': 'query',
+        'description': f'Page size, at most and by default {const.BOOKS_PAGE_SIZE_LIMIT}; when the page is full, the '
+                       f'cursor of the next page is sent in the X-Next-Cursor header. Streams are not paged by default'
+    },
+    'after': {'in': 'query', 'description': 'Cursor received in the X-Next-Cursor header of the previous page'},
+    'min-price': {'in': 'query', 'description': 'Lowest accepted price (included)'},
+    'max-price': {'in': 'query', 'description': 'Highest accepted price (included)'},
+    'min-year': {'in': 'query', 'description': 'Lowest accepted publishing year (included)'},
+    'max-year': {'in': 'query', 'description': 'Highest accepted publishing year (included)'},
+    'fields': {'in': 'query', 'description': 'Comma separated book fields to return, e.g. book_id,title,price'},
+    'stream': {
+        'in': 'query',
+        'description': 'Send books while they are read from the database, either one JSON object per line (ndjson) or '
+                       'as a chunked JSON array (json); no X-Next-Cursor is sent'
+    },
+}
+
+BOOKS_FACETS_PARAMS = {
+    k: BOOKS_LISTING_PARAMS[k] for k in ('filter', 'filter-values', 'min-price', 'max-price', 'min-year', 'max-year')
+}
+
+# `stream` query parameter value -> mimetype
+STREAM_FORMATS = {'ndjson': 'application/x-ndjson', 'json': 'application/json'}
+
+
+def book_field(value: str) -> str:
+    """
+    Request parser type of a single entry of the `fields` query parameter
+    """
+    if value not in books.BOOKS_COLUMNS:
+        raise ValueError(f'Unknown book field "{value}"')
+    return value
+
+
+def parse_books_listing_args(filter_choices: Iterable[str]) -> Dict:
+    """
+    Parses the listing query string into `list_books` keyword arguments
+    :param filter_choices: columns the caller is allowed to filter by
+    """
+    parser = _books_filters_parser(filter_choices)
+    parser.add_argument('order', location='args', choices=tuple(BOOKS_ORDER_COLUMNS))
+    parser.add_argument('order-descending', location='args', type=bool, default=False)
+    parser.add_argument('limit', location='args', type=inputs.int_range(1, const.BOOKS_PAGE_SIZE_LIMIT))
+    parser.add_argument('after', location='args')
+    parser.add_argument('fields', location='args', action='split', type=book_field)
+    parser.add_argument('stream', location='args', choices=tuple(STREAM_FORMATS))
+
+    args = parser.parse_args()
+    stream = args['stream'] is not None
+    return {
+        **_books_filters(args),
+        'order_column': BOOKS_ORDER_COLUMNS.get(args['order']),
+        'order_descending': args['order-descending'],
+        # a stream is read lazily, whatever its size
+        'limit': args['limit'] or (None if stream else const.BOOKS_PAGE_SIZE_LIMIT),
+        'after': args['after'],
+        'columns': args['fields'],
+        'stream': stream
+    }
+
+
+def parse_books_facets_args(filter_choices: Iterable[str]) -> Dict:
+    """
+    Parses the facets query string (the listing filters) into `get_books_facets` keyword arguments
+    :param filter_choices: columns the caller is allowed to filter by
+    """
+    return _books_filters(_books_filters_parser(filter_choices).parse_args())
+
+
+def _books_filters_parser(filter_choices: Iterable[str]) -> RequestParser:
+    parser = RequestParser()
+    parser.add_argument('filter', location='args', choices=tuple(filter_choices))
+    parser.add_argument('filter-values', location='args', action='split')
+    parser.add_argument('min-price', location='args', type=float)
+    parser.add_argument('max-price', location='args', type=float)
+    parser.add_argument('min-year', location='args', type=int)
+    parser.add_argument('max-year', location='args', type=int)
+    return parser
+
+
+def _books_filters(args: Dict) -> Dict:
+    return {
+        'filter_values': args['filter-values'],
+        'filter_column': args['filter'],
+        'min_price': args['min-price'],
+        'max_price': args['max-price'],
+        'min_year': args['min-year'],
+        'max_year': args['max-year'],
+    }
+
+
+def requested_output() -> Dict:
+    """
+    Book fields asked for through the `fields` query parameter, and the `stream` format, if any
+    """
+    parser = RequestParser()
+    parser.add_argument('fields', location='args', action='split', type=book_field)
+    parser.add_argument('stream', location='args', choices=tuple(STREAM_FORMATS))
+    return parser.parse_args()
+
+
+def _json_array_chunks(objects: Iterator[Dict]) -> Iterator[bytes]:
+    yield b'['
+    for i, obj in enumerate(objects):
+        yield (b',' if i else b'') + serialization.dumps(obj)
+    yield b']'
+
+
+def streamed_listing(
+        books_iterator: Iterator[Dict], model: Model, fields: Optional[List[str]], stream_format: str, headers: Dict
+) -> Response:
+    """
+    Response that serializes and sends books one by one, while they are read from the database
+    """
+    serialize_one = serialization.serializer(model, fields).serialize_one
+    serialized = (serialize_one(book) for book in books_iterator)
+    if stream_format == 'ndjson':
+        chunks = (serialization.dumps(book) + b'\n' for book in serialized)
+    else:
+        chunks = _json_array_chunks(serialized)
+    return Response(stream_with_context(chunks), mimetype=STREAM_FORMATS[stream_format], headers=headers)
+
+
+def marshal_listing(namespace: Namespace, model: Model):
+    """
+    Like `namespace.marshal_list_with(model)`, except that successful responses only contain the fields requested
+    through the `fields` query parameter, and are streamed when the `stream` query parameter is given.
+    Error responses are marshalled with the whole model.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            data, code, headers = unpack(func(*args, **kwargs))
+            if code != 200:
+                return marshal(data, model), code, headers
+            output = requested_output()
+            if output['stream']:
+                return streamed_listing(data, model, output['fields'], output['stream'], headers)
+            if const.FAST_LIST_SERIALIZATION:
+                return serialization.serializer(model, output['fields']).response(data, code, headers)
+            fields_model = {f: model[f] for f in output['fields']} if output['fields'] else model
+            return marshal(data, fields_model), code, headers
+
+        return namespace.response(200, 'Success', [model])(wrapper)
+
+    return decorator
+
+
+BOOKS_SEARCH_PARAMS = {
+    'q': {'in': 'query', 'description': 'Words from the title or the author; typos are tolerated'},
+    'limit': BOOKS_LISTING_PARAMS['limit'],
+    'after': BOOKS_LISTING_PARAMS['after'],
+}
+
+
+def parse_books_search_args() -> Dict:
+    """
+    Parses the search query string into `search_books` keyword arguments
+    """
+    parser = RequestParser()
+    parser.add_argument('q', location='args', required=True)
+    parser.add_argument(
+        'limit', location='args', type=inputs.int_range(1, const.BOOKS_PAGE_SIZE_LIMIT), default=const.SEARCH_PAGE_SIZE
+    )
+    parser.add_argument('after', location='args')
+
+    args = parser.parse_args()
+    return {'query': args['q'], 'limit': args['limit'], 'after': args['after']}
+
+
+def listing_etag() -> str:
+    """
+    Strong ETag of a listing: the same catalog tag and the same query always produce the same body
+    """
+    query = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+    return hashlib.sha1(f'{cache.catalog_cache.tag}:{request.path}?{query}'.encode()).hexdigest()
+
+
+def conditional_listing(max_age: int, private: bool = False):
+    """
+    Adds ETag and Cache-Control headers to a listing endpoint and answers 304, without running the listing, when the
+    client's If-None-Match already holds the current ETag. Must be placed under the authentication decorators.
+    :param max_age: Cache-Control max-age, in seconds
+    :param private: whether shared caches (CDN, proxies) must not store the response
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            etag = listing_etag()
+            headers = {
+                'ETag': f'"{etag}"',
+                'Cache-Control': f'{"private" if private else "public"}, max-age={max_age}'
+            }
+            if any(request.if_none_match.contains(variant) for variant in compression.etag_variants(etag)):
+                return None, 304, headers
+
+            data, code, response_headers = unpack(func(*args, **kwargs))
+            if code != 200:
+                return data, code, response_headers
+            headers.update(response_headers)
+            return data, code, headers
+
+        return wrapper
+
+    return decorator
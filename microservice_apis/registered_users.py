@@ -1,8 +1,11 @@
+from typing import List
+
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from flask_restx import Namespace, Resource, fields
+from flask_restx import Namespace, Resource, fields, inputs
 from flask_restx.reqparse import RequestParser
 
-from microservice_apis import admins
+import const
+from microservice_apis import admins, idempotency, listing
 from core import registered_users
 
 namespace = Namespace('Registered users', 'Registered user actions', '/user-actions')
@@ -16,106 +19,191 @@ cart_management_response = namespace.model(
     'CartManagementResponse',
     {
         'email': fields.String(description='Cart owner', required=True),
+        'cart_id': fields.Integer(description='Cart line of the book'),
+        'quantity': fields.Integer(description='Copies of the book now in cart'),
         'error': fields.String(description='Backend error class'),
         'message': fields.String(description='Description message', required=True)
     }
 )
 
+books_batch_dto = namespace.model(
+    'BooksBatchDTO',
+    {
+        'book_ids': fields.List(
+            fields.Integer(description='Book to add in cart'),
+            description=f'At most {const.CART_BATCH_MAX_BOOKS} books; repeat an ID to add several copies',
+            required=True
+        )
+    }
+)
+
+cart_batch_item = namespace.model(
+    'CartBatchItem',
+    {
+        'book_id': fields.Integer(description='Requested book', required=True),
+        'cart_id': fields.Integer(description='Cart line of the book, if it was added'),
+        'status': fields.Integer(description='201 if added, 403 if not enough copies in stock, 404 if no such book'),
+        'message': fields.String(description='Description message', required=True)
+    }
+)
+
+cart_batch_response = namespace.model(
+    'CartBatchResponse',
+    {
+        'email': fields.String(description='Cart owner', required=True),
+        'items': fields.List(fields.Nested(cart_batch_item), description='One result per requested book, in order'),
+        'message': fields.String(description='Description message', required=True)
+    }
+)
+
+cart_line = namespace.model(
+    'CartLine',
+    {
+        'cart_id': fields.Integer(description='Cart line', required=True),
+        'book_id': fields.Integer(description='Book in cart', required=True),
+        'title': fields.String(description='Title of the book'),
+        'price': fields.Float(description='Price of one copy'),
+        'quantity': fields.Integer(description='Copies in cart', required=True)
+    }
+)
+
 cart_content_response = namespace.model(
     'CartContentResponse',
     {
         'email': fields.String(description='User email', required=True),
         'price': fields.Float(description='Total price of all the books'),
+        'quantity': fields.Integer(description='Total number of copies'),
         'books': fields.List(fields.String(description='Book titles')),
+        'items': fields.List(fields.Nested(cart_line), description='One line per book, with its quantity'),
         'error': fields.String(description='Backend error class'),
         'message': fields.String(description='Error message')
     }
 )
 
 
+checkout_response = namespace.model(
+    'CheckoutResponse',
+    {
+        'email': fields.String(description='Cart owner', required=True),
+        'order_id': fields.Integer(description='New order'),
+        'price': fields.Float(description='Total price of the order'),
+        'quantity': fields.Integer(description='Total number of copies'),
+        'status': fields.String(description='"placed" until its receipt is sent, then "processed"'),
+        'message': fields.String(description='Description message', required=True)
+    }
+)
+
+
 registered_users_service = registered_users.RegisteredUsers()
 
 
+def book_ids(value) -> List[int]:
+    """
+    Request parser type of a JSON list of book IDs
+    """
+    if not isinstance(value, list):
+        raise ValueError('Expected a list of book IDs')
+    return [int(book_id) for book_id in value]
+
+
 @namespace.route('/')
 class RegisteredUserActions(Resource):
-    @namespace.doc(
-        params={
-            'filter': {'in': 'query', 'description': 'Field to filter by'},
-            'filter-values': {'in': 'query', 'description': 'Accepted field values'},
-            'order': {'in': 'query', 'description': 'Field to order by'},
-            'order-descending': {'in': 'query', 'description': 'Whether to order descending or ascending'},
-        }
-    )
+    @namespace.doc(params=listing.BOOKS_LISTING_PARAMS)
+    @namespace.response(304, 'Listing did not change since the ETag sent in If-None-Match')
     @namespace.response(400, 'Input payload validation failed')
     @namespace.response(401, 'Missing Authorization Header')
-    @namespace.marshal_list_with(admins.books_response)
+    @listing.marshal_listing(namespace, admins.books_response)
     @jwt_required()
+    @listing.conditional_listing(const.LISTING_MAX_AGE_SECONDS['registered_users'], private=True)
     def get(self):
         """
         List available books, based on filtering criteria if provided. Books with stock = 0 are excluded.
-        Filtering can be done on any column, but only with exact values: you cannot specify a range for price for
-        example... It is also possible to filter by category name.
+        Filtering can be done on any column with exact values, and on intervals for price and year. It is also possible
+        to filter by category name.
         You can also order results by price or by year, either ascending or descending.
+        Results are paginated, `limit` books per page: follow the X-Next-Cursor header via `after` for the next one.
+        Use `fields` to only receive some of the book fields, and `stream` to receive books while they are read.
         """
-        parser = RequestParser()
-        parser.add_argument(
-            'filter',
-            location='args',
-            choices=('title', 'year_published', 'author', 'price', 'category_name', 'stock')
-        )
-        parser.add_argument('filter-values', location='args', action='split')
-        parser.add_argument('order', location='args', choices=('price', 'year'))
-        parser.add_argument('order-descending', location='args', type=bool, default=False)
-
-        args = parser.parse_args()
         return registered_users_service.list_books(
-            filter_values=args['filter-values'],
-            filter_column=args['filter'],
-            order_column=args['order'],
-            order_descending=args['order-descending']
+            **listing.parse_books_listing_args(listing.PUBLIC_BOOKS_FILTERS)
         )
 
     @jwt_required()
-    @namespace.doc(params={'book_id': {'in': 'json', 'description': 'Book to add in cart'}})
+    @namespace.doc(params={
+        'book_id': {'in': 'json', 'description': 'Book to add in cart'},
+        'quantity': {'in': 'json', 'description': 'Copies to add; 1 by default'}
+    })
     @namespace.response(400, 'Input payload validation failed')
     @namespace.response(422, 'Signature verification failed')
-    @namespace.response(403, 'Book is out of stock. It should not be in this request')
+    @namespace.response(403, 'Book does not have enough copies in stock')
     @namespace.response(404, 'No book with given ID')
     @namespace.marshal_with(cart_management_response)
+    @idempotency.idempotent(namespace)
     def post(self):
         """
         Add book in cart
 
-        steps:
-         - check book validity (existence and stock)
-         - add entry to cart
-         - decrease quantity in books
+        steps, in a single statement:
+         - decrease stock in books by `quantity`, if there are enough copies
+         - add the copies to the cart line of the book, created if the book is not in cart yet
 
-         *Note*: After 30 minutes, the book will automatically be taken out of the cart and made available to the other
-         users (book stock will be increased by 1)
+         *Note*: After 30 minutes, the copies will automatically be taken out of the cart and made available to the
+         other users (book stock will be increased back)
         """
         parser = RequestParser()
         parser.add_argument('book_id', location='json', required=True, type=int)
-        return registered_users_service.add_book_to_cart(get_jwt_identity(), parser.parse_args()['book_id'])
+        parser.add_argument('quantity', location='json', type=inputs.positive, default=1)
+        args = parser.parse_args()
+        return registered_users_service.add_book_to_cart(get_jwt_identity(), args['book_id'], args['quantity'])
 
     @jwt_required()
-    @namespace.doc(params={'cart_id': {'in': 'json', 'description': 'Cart item to remove'}})
+    @namespace.doc(params={
+        'cart_id': {'in': 'json', 'description': 'Cart line to decrease'},
+        'quantity': {'in': 'json', 'description': 'Copies to remove; 1 by default'}
+    })
     @namespace.response(400, 'Input payload validation failed')
     @namespace.response(422, 'Signature verification failed')
     @namespace.response(404, 'Resource not found')
     @namespace.marshal_with(cart_management_response)
+    @idempotency.idempotent(namespace)
     def delete(self):
         """
         Delete book from cart
 
-        steps:
-         - check if book in current user cart
-         - remove from cart
-         - increase quantity in books
+        steps, in a single statement:
+         - decrease the cart line by `quantity`, if it is in the current user cart; it is removed with its last copy
+         - increase stock in books by the copies removed
         """
         parser = RequestParser()
         parser.add_argument('cart_id', location='json', required=True, type=int)
-        return registered_users_service.delete_book_from_cart(get_jwt_identity(), parser.parse_args()['cart_id'])
+        parser.add_argument('quantity', location='json', type=inputs.positive, default=1)
+        args = parser.parse_args()
+        return registered_users_service.delete_book_from_cart(get_jwt_identity(), args['cart_id'], args['quantity'])
+
+
+@namespace.route('/batch')
+class RegisteredUserBatchActions(Resource):
+    @jwt_required()
+    @namespace.expect(books_batch_dto)
+    @namespace.response(400, 'Input payload validation failed')
+    @namespace.response(422, 'Signature verification failed')
+    @namespace.response(403, 'None of the books has enough copies in stock')
+    @namespace.response(404, 'None of the books exists')
+    @namespace.marshal_with(cart_batch_response)
+    @idempotency.idempotent(namespace)
+    def post(self):
+        """
+        Add several books in cart at once
+
+        Each book is added to its cart line if it has enough copies in stock, independently of the others; `items`
+        holds the result of each one. Responds 201 as soon as one book was added.
+
+         *Note*: After 30 minutes, the books will automatically be taken out of the cart and made available to the
+         other users
+        """
+        parser = RequestParser()
+        parser.add_argument('book_ids', location='json', required=True, type=book_ids)
+        return registered_users_service.add_books_to_cart(get_jwt_identity(), parser.parse_args()['book_ids'])
 
 
 @namespace.route('/cart')
@@ -133,8 +221,12 @@ class Cart(Resource):
     @jwt_required()
     @namespace.response(422, 'Signature verification failed')
     @namespace.response(404, 'Cart is empty')
+    @namespace.marshal_with(checkout_response)
+    @idempotency.idempotent(namespace)
     def delete(self):
         """
         Buy items available in cart
+
+        The cart becomes an order, which is returned right away; its receipt is sent in the background
         """
         return registered_users_service.checkout_cart(get_jwt_identity())
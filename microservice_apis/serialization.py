@@ -0,0 +1,96 @@
+"""
+fast serialization of list responses, producing the same output as flask_restx marshalling
+"""
+import json
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from flask import Response
+from flask_restx import Model, Namespace, fields, marshal
+from flask_restx.utils import unpack
+
+import const
+from core import cache
+
+try:
+    import orjson
+except ImportError:     # optional dependency, the standard library encoder is used without it
+    orjson = None
+
+# flask_restx field class -> conversion its `format` applies to non null values
+_CONVERTERS = {
+    fields.Integer: int,
+    fields.String: str,
+    fields.Float: float,
+    fields.Boolean: bool
+}
+
+
+def dumps(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+class ListSerializer:
+    """
+    Precompiled equivalent of `marshal(objects, model)`: the field list and the conversion of each field are resolved
+    once, instead of walking the model for every object. Fields that are not plain Integer/String/Float/Boolean
+    (custom attribute, default value, nested...) fall back to their own `output`, so the result is always the same
+    as marshalling.
+    """
+    def __init__(self, model: Dict[str, fields.Raw]):
+        self._fields: List[Tuple[str, Optional[Callable], fields.Raw]] = []
+        for key, field in model.items():
+            simple = field.attribute is None and field.default is None and not getattr(field, 'mask', None)
+            self._fields.append((key, _CONVERTERS.get(type(field)) if simple else None, field))
+
+    def serialize_one(self, obj: Dict) -> Dict:
+        result = {}
+        for key, converter, field in self._fields:
+            if converter is None:
+                result[key] = field.output(key, obj)
+            else:
+                value = obj.get(key)
+                result[key] = None if value is None else converter(value)
+        return result
+
+    def serialize(self, objects: Iterable[Dict]) -> List[Dict]:
+        serialize_one = self.serialize_one
+        return [serialize_one(obj) for obj in objects]
+
+    def response(self, objects: Iterable[Dict], code: int, headers: Dict) -> Response:
+        return Response(dumps(self.serialize(objects)), status=code, headers=headers, mimetype='application/json')
+
+
+_serializers = cache.LRUCache(64)
+
+
+def serializer(model: Model, keys: Optional[Iterable[str]] = None) -> ListSerializer:
+    """
+    Compiled serializer of `model`, optionally restricted to some of its keys; compiled once per model and keys
+    """
+    cache_key = (model.name, tuple(keys) if keys else None)
+    compiled = _serializers.get(cache_key)
+    if compiled is None:
+        compiled = ListSerializer({k: model[k] for k in keys} if keys else model)
+        _serializers.set(cache_key, compiled)
+    return compiled
+
+
+def marshal_list_with(namespace: Namespace, model: Model):
+    """
+    Drop-in replacement of `namespace.marshal_list_with(model)` for list endpoints, using the compiled serializer when
+    const.FAST_LIST_SERIALIZATION is on. Error responses are marshalled by flask_restx as usual.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            data, code, headers = unpack(func(*args, **kwargs))
+            if const.FAST_LIST_SERIALIZATION and code == 200 and isinstance(data, list):
+                return serializer(model).response(data, code, headers)
+            return marshal(data, model), code, headers
+
+        return namespace.response(200, 'Success', [model])(wrapper)
+
+    return decorator
@@ -29,11 +29,17 @@ class BaseTable(Base):
 
     @staticmethod
     def _transform_returning_row_into_dict(r: Row, columns: List[str]) -> Dict:
-        result = dict()
-        for c in columns:
-            result[c] = getattr(r._mapping, c)
+        mapping = r._mapping
+        return {c: mapping[c] for c in columns}
 
-        return result
+    @staticmethod
+    def _row_mapper(columns: List[str]) -> Callable[[Row], Dict]:
+        """
+        Precomputed mapping of rows into dicts, for rows of a SELECT of exactly `columns`, in the same order.
+        Much cheaper than the `_transform_*` methods: no attribute lookup per column
+        """
+        columns = tuple(columns)
+        return lambda r: dict(zip(columns, r))
 
     @staticmethod
     def _transform_select_row_into_dict(r: Row, columns: List[str]) -> Dict:
@@ -1,10 +1,14 @@
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Literal, Union
+from typing import Dict, Iterator, List, Optional, Literal, Tuple, Union
 
 from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy import Integer, Column, String, select, update, delete, Float, ForeignKey, CheckConstraint
-from sqlalchemy.orm import relationship
+from sqlalchemy import Integer, Column, String, select, update, delete, Float, ForeignKey, CheckConstraint, tuple_
+from sqlalchemy import Index, Computed, Boolean, text, false, func, cast, or_, literal_column
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import relationship, deferred
+from sqlalchemy.sql import Select
 
+import const
 import orm
 
 from orm import categories, carts  # leave this import here!! without it books table cannot create relationship
@@ -19,6 +23,7 @@ class BooksColumns:
     PRICE = 'price'
     CATEGORY_ID = 'category_id'
     STOCK = 'stock'
+    HOT = 'hot'
 
 
 BOOKS_COLUMNS = [
@@ -45,8 +50,38 @@ RETURNING_BOOKS_COLUMNS = [
 BOOKS_UNIQUE_IDENTIFIERS = [BooksColumns.BOOK_ID, BooksColumns.TITLE]
 
 
+# key under which Books.search returns the relevance of each hit
+SEARCH_RANK = 'rank'
+
+SEARCH_TEXT_CONFIG = 'english'
+
+
+@dataclass
+class BooksFacets:
+    CATEGORIES = 'categories'
+    AUTHORS = 'authors'
+    PRICES = 'prices'
+    YEARS = 'years'
+
+
 class Books(orm.BaseTable):
     __tablename__ = 'books'
+    __table_args__ = (
+        # created by orm/migrations; declared here as well so that `create_all` builds the same schema
+        # public listings only ever look at books that can still be bought
+        Index('books_in_stock_idx', 'book_id', postgresql_where=text('stock > 0')),
+        Index('books_in_stock_price_idx', 'price', 'book_id', postgresql_where=text('stock > 0')),
+        Index('books_in_stock_year_published_idx', 'year_published', 'book_id', postgresql_where=text('stock > 0')),
+        # range filters and keyset ordering
+        Index('books_price_idx', 'price', 'book_id'),
+        Index('books_year_published_idx', 'year_published', 'book_id'),
+        # join with categories
+        Index('books_category_id_idx', 'category_id'),
+        # full-text search, and trigram similarity for typos (needs the pg_trgm extension)
+        Index('books_search_vector_idx', 'search_vector', postgresql_using='gin'),
+        Index('books_title_trgm_idx', 'title', postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'}),
+        Index('books_author_trgm_idx', 'author', postgresql_using='gin', postgresql_ops={'author': 'gin_trgm_ops'}),
+    )
 
     book_id = Column(Integer, primary_key=True)
     title = Column(String, nullable=False, unique=True)
@@ -60,6 +95,13 @@ class Books(orm.BaseTable):
     price = Column(Float, CheckConstraint(r'price > 0'), nullable=False)
     category_id = Column(Integer, ForeignKey('categories.category_id'))
     stock = Column(Integer, CheckConstraint(r'stock >= 0'), nullable=False)
+    # flash sales: the stock of a hot book is kept in orm.stock_shards, `stock` only displays it
+    hot = Column(Boolean, nullable=False, server_default=false())
+    # maintained by postgres; deferred so that regular reads do not fetch it
+    search_vector = deferred(Column(
+        TSVECTOR,
+        Computed(f"to_tsvector('{SEARCH_TEXT_CONFIG}', title || ' ' || author)", persisted=True)
+    ))
 
     carts = relationship('Carts')
 
@@ -80,22 +122,88 @@ class Books(orm.BaseTable):
             filter_values: Optional[List] = None,
             filter_column: str = categories.CategoriesColumns.CATEGORY_NAME,
             order_column: Optional[Literal[BooksColumns.PRICE, BooksColumns.YEAR_PUBLISHED]] = None,
-            order_descending: Optional[bool] = None
+            order_descending: Optional[bool] = None,
+            limit: Optional[int] = None,
+            after: Optional[List] = None,
+            in_stock_only: bool = False,
+            min_price: Optional[float] = None,
+            max_price: Optional[float] = None,
+            min_year: Optional[int] = None,
+            max_year: Optional[int] = None,
+            columns: Optional[List[str]] = None
     ) -> List[Dict]:
         """
-        Reads books based on generic filtering capability. Filtering can be done on any column, but only with exact
-        values: you cannot specify a range for price for example... It is also possible to filter by category name, even
+        Reads books based on generic filtering capability. Filtering can be done on any column with exact values, and
+        on intervals (bounds included) for price and year. It is also possible to filter by category name, even
         though current table has category_id as column -> join with Categories table is used. You can also order results
         by price or by year, either ascending or descending.
+        When `limit` is given, results are paginated using keyset pagination: rows are additionally ordered by book_id
+        (as tiebreaker) and `after` holds the ordering values of the last row of the previous page.
+        When `columns` is given, only those columns are selected (plus the ones keyset pagination needs).
 
-        **FUTURE DEVELOPMENT**: Handle intervals for price and year
         :param filter_values: exact values of book columns, used for the IN clause
         :param filter_column: column used for filtering
         :param order_column: column used for ordering
         :param order_descending: whether to sort in descending order, or ascending
+        :param limit: maximum number of books to return
+        :param after: keyset of the last book already returned: [order_column value, book_id] or [book_id]
+        :param in_stock_only: exclude books with stock = 0
+        :param min_price: lowest accepted price
+        :param max_price: highest accepted price
+        :param min_year: lowest accepted publishing year
+        :param max_year: highest accepted publishing year
+        :param columns: books columns to read; all of them by default
         :return: filtered and sorted books
         """
-        select_stmt = select(Books)
+        select_stmt, columns = self._read_statement(
+            filter_values, filter_column, order_column, order_descending, limit, after, in_stock_only,
+            min_price, max_price, min_year, max_year, columns
+        )
+        to_dict = super(Books, Books)._row_mapper(columns)
+        with self.session_factory() as session:
+            exec_result = session.execute(select_stmt)
+            return [to_dict(r) for r in exec_result]
+
+    def stream(self, yield_per: int = const.BOOKS_STREAM_YIELD_PER, **read_kwargs) -> Iterator[Dict]:
+        """
+        Same as `read`, but rows are fetched lazily through a server-side cursor, `yield_per` at a time, so memory use
+        does not depend on the number of books. The session stays open until the generator is exhausted or closed.
+        :param yield_per: number of rows fetched from the server at once
+        :param read_kwargs: same arguments as `read`
+        """
+        select_stmt, columns = self._read_statement(**read_kwargs)
+        to_dict = super(Books, Books)._row_mapper(columns)
+        with self.session_factory() as session:
+            exec_result = session.execute(select_stmt.execution_options(yield_per=yield_per))
+            for r in exec_result:
+                yield to_dict(r)
+
+    @staticmethod
+    def _read_statement(
+            filter_values: Optional[List] = None,
+            filter_column: str = categories.CategoriesColumns.CATEGORY_NAME,
+            order_column: Optional[str] = None,
+            order_descending: Optional[bool] = None,
+            limit: Optional[int] = None,
+            after: Optional[List] = None,
+            in_stock_only: bool = False,
+            min_price: Optional[float] = None,
+            max_price: Optional[float] = None,
+            min_year: Optional[int] = None,
+            max_year: Optional[int] = None,
+            columns: Optional[List[str]] = None
+    ) -> Tuple[Select, List[str]]:
+        """
+        Builds the SELECT behind `read` and `stream`; see `read` for the meaning of the arguments.
+        Columns are selected directly, never whole Books entities, so rows can go through a row mapper.
+        :return: statement and the selected columns, in order
+        """
+        key_column_names = [order_column] if order_column else []
+        key_column_names.append(BooksColumns.BOOK_ID)
+        columns = columns or BOOKS_COLUMNS
+        if limit:
+            columns = list(dict.fromkeys([*columns, *key_column_names]))
+        select_stmt = select(*[Books.__table__.c[c] for c in columns]).select_from(Books)
         if filter_values and filter_column:
             if filter_column == categories.CategoriesColumns.CATEGORY_NAME:
                 select_stmt = select_stmt.join(categories.Categories).where(
@@ -105,13 +213,115 @@ class Books(orm.BaseTable):
                 select_stmt = select_stmt.where(
                     Books.__table__.c[filter_column].in_(filter_values)
                 )
-        if order_column:
+        if in_stock_only:
+            select_stmt = select_stmt.where(Books.stock > 0)
+        if min_price is not None:
+            select_stmt = select_stmt.where(Books.price >= min_price)
+        if max_price is not None:
+            select_stmt = select_stmt.where(Books.price <= max_price)
+        if min_year is not None:
+            select_stmt = select_stmt.where(Books.year_published >= min_year)
+        if max_year is not None:
+            select_stmt = select_stmt.where(Books.year_published <= max_year)
+        if limit:
+            key_columns = [Books.__table__.c[c] for c in key_column_names]
+            if after:
+                select_stmt = select_stmt.where(
+                    tuple_(*key_columns) < tuple_(*after) if order_descending else tuple_(*key_columns) > tuple_(*after)
+                )
+            select_stmt = select_stmt.order_by(
+                *[c.desc() if order_descending else c for c in key_columns]
+            ).limit(limit)
+        elif order_column:
             select_stmt = select_stmt.order_by(
                 Books.__table__.c[order_column].desc() if order_descending else Books.__table__.c[order_column]
             )
+        return select_stmt, columns
+
+    def facets(
+            self,
+            price_bucket_width: int = const.FACETS_PRICE_BUCKET_WIDTH,
+            year_bucket_width: int = const.FACETS_YEAR_BUCKET_WIDTH,
+            max_authors: int = const.FACETS_MAX_AUTHORS,
+            **filters
+    ) -> Dict[str, List[Dict]]:
+        """
+        Counts the books matching `filters` per category, per author, per price bucket and per year bucket, with a
+        single GROUP BY GROUPING SETS query, so nothing but the counts leaves the database.
+        A bucket is identified by its lower bound: with a width of 10, value 20 counts prices in [20, 30).
+        :param price_bucket_width: width of the price buckets
+        :param year_bucket_width: width of the year buckets (10 -> decades)
+        :param max_authors: only the authors with the most books are returned
+        :param filters: `read` filtering arguments (filter_values, filter_column, in_stock_only, min/max price and year)
+        :return: {facet: [{'value': ..., 'count': ...}]}; categories and authors by count descending, buckets by value
+        """
+        # widths are rendered inline, so the grouped expressions and the selected ones are the same SQL
+        price_width = literal_column(str(int(price_bucket_width)))
+        year_width = literal_column(str(int(year_bucket_width)))
+        filtered_books = self._read_statement(columns=[BooksColumns.BOOK_ID], **filters)[0].cte('filtered_books')
+        facet_columns = {
+            BooksFacets.CATEGORIES: categories.Categories.category_name,
+            BooksFacets.AUTHORS: Books.author,
+            BooksFacets.PRICES: cast(func.floor(Books.price / price_width) * price_width, Float),
+            BooksFacets.YEARS: cast(func.floor(Books.year_published / year_width) * year_width, Integer),
+        }
+        select_stmt = select(
+            *[column.label(facet) for facet, column in facet_columns.items()],
+            *[func.grouping(column).label(f'grouping_{facet}') for facet, column in facet_columns.items()],
+            func.count().label('count')
+        ).select_from(Books).join(
+            filtered_books, filtered_books.c.book_id == Books.book_id
+        ).outerjoin(categories.Categories).group_by(func.grouping_sets(*facet_columns.values()))
+
+        result = {facet: [] for facet in facet_columns}
         with self.session_factory() as session:
-            exec_result = session.execute(select_stmt)
-            return [super(Books, Books)._transform_select_row_into_dict(r, BOOKS_COLUMNS) for r in exec_result]
+            for r in session.execute(select_stmt):
+                mapping = r._mapping
+                # each row belongs to exactly one grouping set; GROUPING() is 0 for the column it groups by
+                facet = next(f for f in facet_columns if mapping[f'grouping_{f}'] == 0)
+                result[facet].append({'value': mapping[facet], 'count': mapping['count']})
+        for facet in (BooksFacets.CATEGORIES, BooksFacets.AUTHORS):
+            result[facet].sort(key=lambda bucket: -bucket['count'])
+        for facet in (BooksFacets.PRICES, BooksFacets.YEARS):
+            result[facet].sort(key=lambda bucket: bucket['value'])
+        del result[BooksFacets.AUTHORS][max_authors:]
+        return result
+
+    def search(
+            self,
+            query: str,
+            limit: int,
+            after: Optional[List] = None,
+            in_stock_only: bool = False
+    ) -> List[Dict]:
+        """
+        Searches books by title and author, most relevant first. A book matches if it matches the full-text query, or
+        if its title or author is similar enough to the query (trigram similarity, so typos are tolerated).
+        Relevance is the full-text rank plus the best trigram similarity; results are paginated with keyset pagination.
+        :param query: text typed by the user
+        :param limit: maximum number of books to return
+        :param after: [rank, book_id] of the last book already returned
+        :param in_stock_only: exclude books with stock = 0
+        :return: matching books, each with its relevance under the `SEARCH_RANK` key
+        """
+        ts_query = func.websearch_to_tsquery(SEARCH_TEXT_CONFIG, query)
+        rank = cast(
+            func.ts_rank(Books.search_vector, ts_query) + func.greatest(
+                func.similarity(Books.title, query), func.similarity(Books.author, query)
+            ),
+            Float
+        )
+        select_stmt = select(*[Books.__table__.c[c] for c in BOOKS_COLUMNS], rank.label(SEARCH_RANK)).where(
+            or_(Books.search_vector.op('@@')(ts_query), Books.title.op('%')(query), Books.author.op('%')(query))
+        )
+        if in_stock_only:
+            select_stmt = select_stmt.where(Books.stock > 0)
+        if after:
+            select_stmt = select_stmt.where(tuple_(rank, Books.book_id) < tuple_(*after))
+        select_stmt = select_stmt.order_by(rank.desc(), Books.book_id.desc()).limit(limit)
+        to_dict = super(Books, Books)._row_mapper([*BOOKS_COLUMNS, SEARCH_RANK])
+        with self.session_factory() as session:
+            return [to_dict(r) for r in session.execute(select_stmt)]
 
     def update(self, update_data: Dict, identifier: Union[str, int], identifier_type: str = BooksColumns.TITLE) -> Dict:
         """
@@ -133,6 +343,21 @@ class Books(orm.BaseTable):
             session.commit()
             return super(Books, Books)._transform_returning_row_into_dict(exec_result[0], BOOKS_COLUMNS)
 
+    def increase_stock(self, book_id: int, amount: int = 1) -> Optional[Dict]:
+        """
+        Adds `amount` copies to the stock of a book, computed by postgres so that concurrent updates are not lost
+        :return: the updated book, or None if there is no such book
+        """
+        update_stmt = update(Books).where(Books.book_id == book_id).values(stock=Books.stock + amount).returning(
+            Books.book_id, Books.title, Books.year_published, Books.author, Books.price, Books.category_id, Books.stock
+        )
+        with self.session_factory() as session:
+            exec_result = session.execute(update_stmt).fetchall()
+            session.commit()
+            if not exec_result:
+                return None
+            return super(Books, Books)._transform_returning_row_into_dict(exec_result[0], BOOKS_COLUMNS)
+
     def delete(self, identifier: str, identifier_type: str = BooksColumns.TITLE) -> Dict:
         """
         Deletes a book
@@ -1,11 +1,15 @@
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Literal, Union
+from datetime import timedelta
+from typing import Dict, List, Optional, Literal, Tuple, Union
 
 from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy import Integer, Column, String, select, update, delete, Float, ForeignKey, CheckConstraint
+from sqlalchemy import Integer, Column, String, select, update, delete, Float, ForeignKey, CheckConstraint, Index
+from sqlalchemy import ARRAY, DateTime, literal, func, text, union_all, null, false
+from sqlalchemy.sql.selectable import CTE
 
+import const
 import orm
-from orm import books
+from orm import books, stock_shards
 
 
 @dataclass
@@ -13,42 +17,255 @@ class CartsColumns:
     CART_ID = 'cart_id'
     EMAIL = 'email'
     BOOK_ID = 'book_id'
+    QUANTITY = 'quantity'
+    EXPIRES_AT = 'expires_at'
 
 
 CARTS_COLUMNS = [
     CartsColumns.CART_ID,
     CartsColumns.EMAIL,
-    CartsColumns.BOOK_ID
+    CartsColumns.BOOK_ID,
+    CartsColumns.QUANTITY
 ]
 
+# cart lines written by an add to cart, with the stock left in the books row of their book (None for a hot book);
+# books.BooksColumns.STOCK, not defined yet when orm.books imports this module
+ADDED_CARTS_COLUMNS = [*CARTS_COLUMNS, 'stock']
+
 
 class Carts(orm.BaseTable):
     __tablename__ = 'carts'
+    __table_args__ = (
+        # created by orm/migrations; one line per book in a cart, and covering, so that reading a cart never visits
+        # the table
+        Index(
+            'carts_email_book_id_key', 'email', 'book_id', unique=True, postgresql_include=['cart_id', 'quantity']
+        ),
+        Index('carts_book_id_idx', 'book_id'),
+        # cart expiry reaper
+        Index('carts_expires_at_idx', 'expires_at'),
+    )
 
     cart_id = Column(Integer, primary_key=True)
     email = Column(String, nullable=False)
     book_id = Column(Integer, ForeignKey('books.book_id'))
+    quantity = Column(Integer, CheckConstraint('quantity > 0'), nullable=False, server_default=text('1'))
+    # the book goes back in stock once this is past; see `expire`
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+    @staticmethod
+    def _expires_at():
+        return func.now() + timedelta(minutes=const.CART_CLEANUP_TIMEDELTA_MINUTES)
 
     def create(self, cart: Dict) -> Dict:
         """
         Insert a new cart entry
         """
-        insert_stmt = insert(Carts).values(cart).returning(Carts.cart_id, Carts.email, Carts.book_id)
+        insert_stmt = insert(Carts).values({CartsColumns.EXPIRES_AT: Carts._expires_at(), **cart}).returning(
+            Carts.cart_id, Carts.email, Carts.book_id, Carts.quantity
+        )
         with self.session_factory() as session:
             exec_result = session.execute(insert_stmt).fetchall()
             session.commit()
             return super(Carts, Carts)._transform_returning_row_into_dict(exec_result[0], CARTS_COLUMNS)
 
+    @staticmethod
+    def _take_stock(requested: CTE, skip_locked: bool = True) -> CTE:
+        """
+        CTE taking the `requested` copies (book_id, quantity; one row per book) out of stock, for the books that have
+        enough copies: out of the books table, or out of a stock shard for hot books
+        :param skip_locked: whether the shards locked by other buyers are skipped, rather than waited for
+        :return: CTE of the copies taken (book_id, quantity, stock left in the books row; null for hot books)
+        """
+        taken_books = update(books.Books).where(
+            books.Books.book_id == requested.c.book_id,
+            books.Books.hot.is_(False),
+            books.Books.stock >= requested.c.quantity
+        ).values(stock=books.Books.stock - requested.c.quantity).returning(
+            books.Books.book_id, requested.c.quantity, books.Books.stock
+        ).cte('taken_books')
+        taken_shards = stock_shards.StockShards.take(requested, skip_locked)
+        return union_all(
+            select(taken_books.c.book_id, taken_books.c.quantity, taken_books.c.stock),
+            select(taken_shards.c.book_id, taken_shards.c.quantity, null().label('stock'))
+        ).cte('taken')
+
+    @staticmethod
+    def _restock(returned: CTE) -> CTE:
+        """
+        CTE putting the `returned` copies (book_id, quantity; one row per book) back in stock: in the books table, or in
+        a stock shard for hot books
+        :return: CTE of the restocked books (book_id, back_in_stock: whether the books row had no copy left; false for
+        hot books)
+        """
+        # whether a book is hot cannot change until this transaction ends
+        restocked_books = select(books.Books.book_id, books.Books.hot).where(
+            books.Books.book_id.in_(select(returned.c.book_id))
+        ).with_for_update(read=True, key_share=True).cte('restocked_books')
+        restock_books = update(books.Books).where(
+            books.Books.book_id == restocked_books.c.book_id,
+            restocked_books.c.hot.is_(False),
+            books.Books.book_id == returned.c.book_id
+        ).values(stock=books.Books.stock + returned.c.quantity).returning(
+            books.Books.book_id, (books.Books.stock == returned.c.quantity).label('back_in_stock')
+        ).cte('restock_books')
+        restock_shards = stock_shards.StockShards.restock(returned, restocked_books)
+        return union_all(
+            select(restock_books.c.book_id, restock_books.c.back_in_stock),
+            select(restock_shards.c.book_id, false().label('back_in_stock'))
+        ).cte('restock')
+
+    @staticmethod
+    def _add_lines(email: str, taken: CTE):
+        """
+        Statement writing the cart lines of the copies in `taken` (book_id, quantity, stock): a book already in the
+        cart gets its quantity increased, and its lifetime restarted
+        :return: SELECT of the lines written, with the stock left (see ADDED_CARTS_COLUMNS)
+        """
+        insert_stmt = insert(Carts).from_select(
+            [Carts.email, Carts.book_id, Carts.quantity, Carts.expires_at],
+            select(literal(email), taken.c.book_id, taken.c.quantity, Carts._expires_at())
+        )
+        added = insert_stmt.on_conflict_do_update(
+            index_elements=[Carts.email, Carts.book_id],
+            set_={
+                CartsColumns.QUANTITY: Carts.quantity + insert_stmt.excluded.quantity,
+                CartsColumns.EXPIRES_AT: insert_stmt.excluded.expires_at
+            }
+        ).returning(Carts.cart_id, Carts.email, Carts.book_id, Carts.quantity).cte('added')
+        return select(added.c.cart_id, added.c.email, added.c.book_id, added.c.quantity, taken.c.stock).join_from(
+            added, taken, taken.c.book_id == added.c.book_id
+        )
+
+    @staticmethod
+    def _lock_lines(email: str, book_ids: List[int]):
+        """
+        SELECT locking the cart lines the user already has for these books, in book_id order.
+        Every path changing both a cart line and the stock of its book locks the cart line first, as `remove` and
+        `expire` do, so that an add and a remove of the same line cannot deadlock. Locking the books row first would
+        not do: the stock of hot books is taken out of shards, without locking their books row.
+        """
+        return select(Carts.cart_id).where(
+            Carts.email == email, Carts.book_id.in_(sorted(set(book_ids)))
+        ).order_by(Carts.book_id).with_for_update()
+
+    def add_book(self, email: str, book_id: int, quantity: int = 1, skip_locked: bool = True) -> Optional[Dict]:
+        """
+        Takes copies of the book out of stock and puts them in the user's cart, in a single statement: the cart line is
+        only written if the conditional stock decrement found enough copies, so concurrent buyers cannot oversell a book
+        :param skip_locked: whether the shards of a hot book locked by other buyers are skipped, rather than waited for
+        :return: the cart line of the book (see ADDED_CARTS_COLUMNS), or None if the book does not exist or does not
+        have enough copies (in one of its shards not locked by other buyers, for a hot book)
+        """
+        requested = select(
+            literal(book_id, Integer).label('book_id'), literal(quantity, Integer).label('quantity')
+        ).cte('requested')
+        with self.session_factory() as session:
+            session.execute(self._lock_lines(email, [book_id]))
+            exec_result = session.execute(self._add_lines(email, self._take_stock(requested, skip_locked))).fetchall()
+            session.commit()
+            if not exec_result:
+                return None
+            return super(Carts, Carts)._transform_returning_row_into_dict(exec_result[0], ADDED_CARTS_COLUMNS)
+
+    def add_books(self, email: str, book_ids: List[int], skip_locked: bool = True) -> List[Dict]:
+        """
+        Batch variant of `add_book`, with the same three statements whatever the number of books: the user's cart lines
+        of the requested books, then the requested books are locked, then the stock of each one is decreased by the
+        number of times it is requested, if there are enough copies left, and its cart line is written. A book without
+        enough copies is not taken at all.
+        :param skip_locked: see `add_book`
+        :return: the cart lines of the books taken (see ADDED_CARTS_COLUMNS); books missing from them were not added
+        """
+        requested_ids = func.unnest(literal(list(book_ids), ARRAY(Integer))).column_valued('book_id')
+        requested = select(
+            requested_ids.label('book_id'), func.count().label('quantity')
+        ).group_by(requested_ids).cte('requested')
+        # concurrent batches lock their books in the same order, so they cannot deadlock; hot books are not locked, the
+        # shard of each copy taken is
+        lock_stmt = select(books.Books.book_id).where(
+            books.Books.book_id.in_(sorted(set(book_ids))), books.Books.hot.is_(False)
+        ).order_by(books.Books.book_id).with_for_update()
+        to_dict = super(Carts, Carts)._row_mapper(ADDED_CARTS_COLUMNS)
+        with self.session_factory() as session:
+            session.execute(self._lock_lines(email, book_ids))
+            session.execute(lock_stmt)
+            exec_result = session.execute(self._add_lines(email, self._take_stock(requested, skip_locked))).fetchall()
+            session.commit()
+            return [to_dict(r) for r in exec_result]
+
+    def remove(self, cart_id: int, email: Optional[str] = None, quantity: int = 1) -> Optional[int]:
+        """
+        Takes copies out of a cart line and puts them back in stock, in a single statement. The line is deleted once
+        its quantity reaches 0.
+        :param cart_id: cart line to decrease
+        :param email: if given, the line is only decreased if it is in the cart of this user
+        :param quantity: copies to take out; at most the quantity of the line
+        :return: whether the book is back in stock (it had no copy left), or None if there was no such cart line
+        """
+        line = select(
+            Carts.cart_id, Carts.book_id, Carts.quantity, func.least(Carts.quantity, quantity).label('removed')
+        ).where(Carts.cart_id == cart_id)
+        if email is not None:
+            line = line.where(Carts.email == email)
+        line = line.with_for_update().cte('line')
+        # exactly one of these two applies
+        deleted = delete(Carts).where(
+            Carts.cart_id == line.c.cart_id, line.c.quantity <= quantity
+        ).returning(Carts.book_id, line.c.removed.label('quantity')).cte('deleted')
+        decreased = update(Carts).where(
+            Carts.cart_id == line.c.cart_id, line.c.quantity > quantity
+        ).values(quantity=Carts.quantity - quantity).returning(
+            Carts.book_id, line.c.removed.label('quantity')
+        ).cte('decreased')
+        returned = union_all(
+            select(deleted.c.book_id, deleted.c.quantity), select(decreased.c.book_id, decreased.c.quantity)
+        ).cte('returned')
+        select_stmt = select(self._restock(returned).c.back_in_stock)
+        with self.session_factory() as session:
+            exec_result = session.execute(select_stmt).fetchall()
+            session.commit()
+            return exec_result[0][0] if exec_result else None
+
+    def expire(self, batch_size: int) -> Tuple[int, int, int, Optional[timedelta]]:
+        """
+        Removes up to `batch_size` cart lines past their expiry, oldest first, and puts their copies back in stock, in
+        a single statement. Lines locked by another transaction (e.g. another reaper) are skipped.
+        :return: number of lines removed, number of distinct books restocked, how many of them are back in stock (they
+        had no copy left), and how late the oldest line was removed (None if no line was due)
+        """
+        due = select(Carts.cart_id).where(Carts.expires_at <= func.now()).order_by(Carts.expires_at).limit(
+            batch_size
+        ).with_for_update(skip_locked=True).cte('due')
+        removed = delete(Carts).where(Carts.cart_id == due.c.cart_id).returning(
+            Carts.book_id, Carts.quantity, Carts.expires_at
+        ).cte('removed')
+        restocked = select(
+            removed.c.book_id, func.sum(removed.c.quantity).label('quantity')
+        ).group_by(removed.c.book_id).cte('restocked')
+        restock = self._restock(restocked)
+        select_stmt = select(
+            func.count(),
+            select(func.count()).select_from(restock).scalar_subquery(),
+            select(func.count()).select_from(restock).where(restock.c.back_in_stock).scalar_subquery(),
+            func.now() - func.min(removed.c.expires_at)
+        ).select_from(removed)
+        with self.session_factory() as session:
+            expired, restocked_books, back_in_stock, lag = session.execute(select_stmt).fetchall()[0]
+            session.commit()
+            return expired, restocked_books, back_in_stock, lag
+
     def read(self, email: Optional[str] = None):
         """
         Reads entries in carts. If email is provided, read the cart of the given user
         """
-        select_stmt = select(Carts)
+        select_stmt = select(Carts.cart_id, Carts.email, Carts.book_id, Carts.quantity)
         if email:
             select_stmt = select_stmt.where(Carts.email == email)
+        to_dict = super(Carts, Carts)._row_mapper(CARTS_COLUMNS)
         with self.session_factory() as session:
             exec_result = session.execute(select_stmt)
-            return [super(Carts, Carts)._transform_select_row_into_dict(r, CARTS_COLUMNS) for r in exec_result]
+            return [to_dict(r) for r in exec_result]
 
     def delete(
             self, identifier: Union[str, int], identifier_type: str = CartsColumns.CART_ID
@@ -62,7 +279,7 @@ class Carts(orm.BaseTable):
         if identifier_type == CartsColumns.BOOK_ID:
             raise ValueError('Cannot delete all books of same type from all carts')
         delete_stmt = delete(Carts).where(Carts.__table__.c[identifier_type] == identifier).returning(
-            Carts.cart_id, Carts.email, Carts.book_id
+            Carts.cart_id, Carts.email, Carts.book_id, Carts.quantity
         )
         with self.session_factory() as session:
             exec_result = session.execute(delete_stmt).fetchall()
@@ -72,10 +289,22 @@ class Carts(orm.BaseTable):
             else:
                 return [super(Carts, Carts)._transform_returning_row_into_dict(r, CARTS_COLUMNS) for r in exec_result]
 
-    def get_cart_content(self, email):
-        select_stmt = select(books.Books.title, books.Books.price).join(Carts).where(Carts.email == email)
+    def get_cart_content(self, email: str) -> Dict:
+        """
+        Lines of the user's cart, with the total price and number of copies, computed by postgres in the same query
+        :return: {'items': [cart line with the book title and price], 'price': total price, 'quantity': total copies}
+        """
+        select_stmt = select(
+            Carts.cart_id, Carts.book_id, books.Books.title, books.Books.price, Carts.quantity,
+            func.sum(books.Books.price * Carts.quantity).over(), func.sum(Carts.quantity).over()
+        ).select_from(Carts).join(books.Books).where(Carts.email == email)
+        to_dict = super(Carts, Carts)._row_mapper([
+            CartsColumns.CART_ID, CartsColumns.BOOK_ID, books.BooksColumns.TITLE, books.BooksColumns.PRICE,
+            CartsColumns.QUANTITY
+        ])
+        content = {'items': [], 'price': 0, 'quantity': 0}
         with self.session_factory() as session:
-            exec_result = session.execute(select_stmt)
-            return [super(Carts, Carts)._transform_returning_row_into_dict(
-                r, [books.BooksColumns.TITLE, books.BooksColumns.PRICE]
-            ) for r in exec_result]
+            for r in session.execute(select_stmt):
+                content['items'].append(to_dict(r))
+                content['price'], content['quantity'] = r[-2:]
+        return content
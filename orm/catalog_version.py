@@ -0,0 +1,29 @@
+from sqlalchemy import Sequence, select, text
+
+import orm
+
+CATALOG_VERSION_SEQUENCE = Sequence('catalog_version_seq')
+
+
+class CatalogVersion:
+    """
+    Number of catalog changes made through all application instances, kept in a sequence (created by
+    orm/migrations): bumping it takes no lock, so concurrent changes never wait on each other
+    """
+    def __init__(self):
+        self.session_factory = orm.session_factory
+
+    def read(self) -> int:
+        # a sequence never bumped holds 1 already, without having handed it out
+        select_stmt = text('SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM catalog_version_seq')
+        with self.session_factory() as session:
+            return session.execute(select_stmt).scalar()
+
+    def bump(self) -> int:
+        """
+        :return: the new version
+        """
+        with self.session_factory() as session:
+            version = session.execute(select(CATALOG_VERSION_SEQUENCE.next_value())).scalar()
+            session.commit()
+            return version
@@ -44,14 +44,11 @@ class Categories(orm.BaseTable):
         """
         Reads all existing categories
         """
-        select_stmt = select(Categories)
+        select_stmt = select(Categories.category_id, Categories.category_name)
+        to_dict = super(Categories, Categories)._row_mapper(CATEGORIES_COLUMNS)
         with self.session_factory() as session:
             exec_result = session.execute(select_stmt)
-            return [
-                super(Categories, Categories)._transform_select_row_into_dict(
-                    r, CATEGORIES_COLUMNS
-                ) for r in exec_result
-            ]
+            return [to_dict(r) for r in exec_result]
 
     def update(self, old_category: str, new_category: str) -> Dict:
         """
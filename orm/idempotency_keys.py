@@ -0,0 +1,110 @@
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Dict, Optional
+
+from sqlalchemy.dialects.postgresql import insert, JSONB
+from sqlalchemy import Column, String, SmallInteger, DateTime, Index, select, update, delete, func
+
+import orm
+
+
+@dataclass
+class IdempotencyKeysColumns:
+    EMAIL = 'email'
+    KEY = 'key'
+    FINGERPRINT = 'fingerprint'
+    STATUS = 'status'
+    RESPONSE = 'response'
+    CREATED_AT = 'created_at'
+
+
+IDEMPOTENCY_KEYS_COLUMNS = [
+    IdempotencyKeysColumns.FINGERPRINT,
+    IdempotencyKeysColumns.STATUS,
+    IdempotencyKeysColumns.RESPONSE,
+    IdempotencyKeysColumns.CREATED_AT
+]
+
+
+class IdempotencyKeys(orm.BaseTable):
+    """
+    Responses of the user requests sent with an Idempotency-Key header, so that a retried request gets the response of
+    the first one instead of running again. A key is claimed (without status nor response) while its request runs.
+    """
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        # created by orm/migrations; purge of the keys kept long enough
+        Index('idempotency_keys_created_at_idx', 'created_at'),
+    )
+
+    email = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    # hash of the request the key was first sent with
+    fingerprint = Column(String, nullable=False)
+    status = Column(SmallInteger)
+    response = Column(JSONB)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    def claim(self, email: str, key: str, fingerprint: str, claim_timeout: timedelta) -> Optional[Dict]:
+        """
+        Claims the key for a request about to run. A claim older than `claim_timeout` whose request never stored its
+        response (e.g. the server stopped meanwhile) is taken over.
+        :return: None if the key is now claimed by the caller, else the key as it is (see IDEMPOTENCY_KEYS_COLUMNS)
+        """
+        insert_stmt = insert(IdempotencyKeys).values(email=email, key=key, fingerprint=fingerprint)
+        claim_stmt = insert_stmt.on_conflict_do_update(
+            index_elements=[IdempotencyKeys.email, IdempotencyKeys.key],
+            set_={
+                IdempotencyKeys.fingerprint: insert_stmt.excluded.fingerprint,
+                IdempotencyKeys.created_at: func.now()
+            },
+            where=IdempotencyKeys.status.is_(None) & (IdempotencyKeys.created_at < func.now() - claim_timeout)
+        ).returning(IdempotencyKeys.key)
+        select_stmt = select(*[IdempotencyKeys.__table__.c[c] for c in IDEMPOTENCY_KEYS_COLUMNS]).where(
+            IdempotencyKeys.email == email, IdempotencyKeys.key == key
+        )
+        with self.session_factory() as session:
+            claimed = session.execute(claim_stmt).fetchall()
+            session.commit()
+            if claimed:
+                return None
+            # a new statement: sees the key even if it was claimed by a request that committed after this one started
+            existing = session.execute(select_stmt).fetchall()
+            if not existing:
+                return None     # purged meanwhile; running the request is what a retry would do anyway
+            return super(IdempotencyKeys, IdempotencyKeys)._row_mapper(IDEMPOTENCY_KEYS_COLUMNS)(existing[0])
+
+    def save(self, email: str, key: str, status: int, response: Dict):
+        """
+        Stores the response of the request that claimed the key
+        """
+        update_stmt = update(IdempotencyKeys).where(
+            IdempotencyKeys.email == email, IdempotencyKeys.key == key
+        ).values(status=status, response=response)
+        with self.session_factory() as session:
+            session.execute(update_stmt)
+            session.commit()
+
+    def release(self, email: str, key: str):
+        """
+        Gives up a claimed key, whose request failed: its retries run again
+        """
+        delete_stmt = delete(IdempotencyKeys).where(
+            IdempotencyKeys.email == email, IdempotencyKeys.key == key, IdempotencyKeys.status.is_(None)
+        )
+        with self.session_factory() as session:
+            session.execute(delete_stmt)
+            session.commit()
+
+    def purge(self, ttl: timedelta) -> int:
+        """
+        Deletes the keys older than `ttl`
+        :return: number of keys deleted
+        """
+        delete_stmt = delete(IdempotencyKeys).where(
+            IdempotencyKeys.created_at < func.now() - ttl
+        ).execution_options(synchronize_session=False)
+        with self.session_factory() as session:
+            deleted = session.execute(delete_stmt).rowcount
+            session.commit()
+            return deleted
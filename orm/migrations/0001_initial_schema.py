@@ -0,0 +1,49 @@
+"""
+Tables of the book shop, as they were created before migrations existed
+
+IF NOT EXISTS everywhere, so that databases created by hand adopt the migrations without changes.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS categories (
+        category_id SERIAL PRIMARY KEY,
+        category_name VARCHAR NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id SERIAL PRIMARY KEY,
+        email VARCHAR NOT NULL UNIQUE,
+        passwd VARCHAR NOT NULL,
+        is_admin BOOLEAN
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS books (
+        book_id SERIAL PRIMARY KEY,
+        title VARCHAR NOT NULL UNIQUE,
+        year_published INTEGER NOT NULL
+            CHECK (year_published > 1000)
+            CHECK (year_published <= date_part('year', current_date)),
+        author VARCHAR NOT NULL,
+        price FLOAT NOT NULL CHECK (price > 0),
+        category_id INTEGER REFERENCES categories (category_id),
+        stock INTEGER NOT NULL CHECK (stock >= 0)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS carts (
+        cart_id SERIAL PRIMARY KEY,
+        email VARCHAR NOT NULL,
+        book_id INTEGER REFERENCES books (book_id)
+    )
+    """,
+]
+
+
+def upgrade(connection: Connection):
+    for statement in STATEMENTS:
+        connection.execute(text(statement))
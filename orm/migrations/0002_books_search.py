@@ -0,0 +1,23 @@
+"""
+Full-text and typo tolerant search on books (Books.search)
+
+The tsvector column is generated by postgres; trigram indexes need the pg_trgm extension.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+STATEMENTS = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    """
+    ALTER TABLE books ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+        GENERATED ALWAYS AS (to_tsvector('english', title || ' ' || author)) STORED
+    """,
+    'CREATE INDEX IF NOT EXISTS books_search_vector_idx ON books USING gin (search_vector)',
+    'CREATE INDEX IF NOT EXISTS books_title_trgm_idx ON books USING gin (title gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS books_author_trgm_idx ON books USING gin (author gin_trgm_ops)',
+]
+
+
+def upgrade(connection: Connection):
+    for statement in STATEMENTS:
+        connection.execute(text(statement))
@@ -0,0 +1,46 @@
+"""
+Indexes of the hot queries: carts by user, carts by book, category joins, listing filters and keyset ordering
+
+Built concurrently, so the tables stay writable meanwhile. A concurrent build that fails leaves an invalid index behind,
+which IF NOT EXISTS would then skip: invalid indexes are dropped first.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+TRANSACTIONAL = False
+
+# index name -> definition
+INDEXES = {
+    # Carts.read, Carts.get_cart_content and checkout: covering, so reading a cart never visits the table
+    'carts_email_idx': 'ON carts (email) INCLUDE (cart_id, book_id)',
+    # foreign key checks when books are updated or deleted
+    'carts_book_id_idx': 'ON carts (book_id)',
+    # join with categories when filtering by category name
+    'books_category_id_idx': 'ON books (category_id)',
+    # admin listings: range filters, and keyset pagination ordered by (price | year_published, book_id)
+    'books_price_idx': 'ON books (price, book_id)',
+    'books_year_published_idx': 'ON books (year_published, book_id)',
+    # public listings only ever look at books in stock
+    'books_in_stock_idx': 'ON books (book_id) WHERE stock > 0',
+    'books_in_stock_price_idx': 'ON books (price, book_id) WHERE stock > 0',
+    'books_in_stock_year_published_idx': 'ON books (year_published, book_id) WHERE stock > 0',
+}
+
+# indexes created by `create_all` before this migration, on the ordering column only
+REPLACED_INDEXES = ['books_price_idx', 'books_year_published_idx']
+
+_INDEXES_TO_DROP = """
+    SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE pg_table_is_visible(c.oid)
+        AND ((NOT i.indisvalid AND c.relname = ANY(:names)) OR (i.indnatts = 1 AND c.relname = ANY(:replaced)))
+"""
+
+
+def upgrade(connection: Connection):
+    to_drop = connection.execute(
+        text(_INDEXES_TO_DROP), {'names': list(INDEXES), 'replaced': REPLACED_INDEXES}
+    ).scalars().all()
+    for name in to_drop:
+        connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {name}'))
+    for name, definition in INDEXES.items():
+        connection.execute(text(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}'))
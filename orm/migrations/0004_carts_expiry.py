@@ -0,0 +1,24 @@
+"""
+Cart entries carry their own expiry, swept by the cart reaper, instead of one APScheduler job each
+
+Entries that existed before get the full cart lifetime from now on. The APScheduler job store table is dropped with the
+jobs it held.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+import const
+
+STATEMENTS = [
+    'ALTER TABLE carts ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP WITH TIME ZONE',
+    f"UPDATE carts SET expires_at = now() + interval '{int(const.CART_CLEANUP_TIMEDELTA_MINUTES)} minutes' "
+    f"WHERE expires_at IS NULL",
+    'ALTER TABLE carts ALTER COLUMN expires_at SET NOT NULL',
+    'CREATE INDEX IF NOT EXISTS carts_expires_at_idx ON carts (expires_at)',
+    'DROP TABLE IF EXISTS apscheduler_jobs',
+]
+
+
+def upgrade(connection: Connection):
+    for statement in STATEMENTS:
+        connection.execute(text(statement))
@@ -0,0 +1,29 @@
+"""
+Carts hold one line per book, with a quantity, instead of one row per copy
+
+Rows of the same book in the same cart are compacted into the oldest one, which keeps the latest expiry. The unique
+(email, book_id) index replaces carts_email_idx, and is what increments of a cart line conflict on.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+STATEMENTS = [
+    'ALTER TABLE carts ADD COLUMN IF NOT EXISTS quantity INTEGER NOT NULL DEFAULT 1 '
+    'CONSTRAINT carts_quantity_check CHECK (quantity > 0)',
+    'WITH lines AS ('
+    ' SELECT min(cart_id) AS cart_id, email, book_id, count(*) AS copies, max(expires_at) AS expires_at'
+    ' FROM carts GROUP BY email, book_id HAVING count(*) > 1'
+    '), compacted AS ('
+    ' UPDATE carts SET quantity = lines.copies, expires_at = lines.expires_at'
+    ' FROM lines WHERE carts.cart_id = lines.cart_id'
+    ') '
+    'DELETE FROM carts USING lines '
+    'WHERE carts.email = lines.email AND carts.book_id = lines.book_id AND carts.cart_id <> lines.cart_id',
+    'CREATE UNIQUE INDEX IF NOT EXISTS carts_email_book_id_key ON carts (email, book_id) INCLUDE (cart_id, quantity)',
+    'DROP INDEX IF EXISTS carts_email_idx',
+]
+
+
+def upgrade(connection: Connection):
+    for statement in STATEMENTS:
+        connection.execute(text(statement))
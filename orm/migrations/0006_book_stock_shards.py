@@ -0,0 +1,24 @@
+"""
+Hot books keep their stock in several counter rows, so that concurrent buyers do not wait on the same books row
+
+No book is hot after this migration; admins flag them.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+STATEMENTS = [
+    'ALTER TABLE books ADD COLUMN IF NOT EXISTS hot BOOLEAN NOT NULL DEFAULT false',
+    """
+    CREATE TABLE IF NOT EXISTS book_stock_shards (
+        book_id INTEGER REFERENCES books (book_id) ON DELETE CASCADE,
+        shard INTEGER CHECK (shard >= 0),
+        stock INTEGER NOT NULL CHECK (stock >= 0),
+        PRIMARY KEY (book_id, shard)
+    )
+    """,
+]
+
+
+def upgrade(connection: Connection):
+    for statement in STATEMENTS:
+        connection.execute(text(statement))
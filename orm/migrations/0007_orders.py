@@ -0,0 +1,36 @@
+"""
+Orders and their lines, written at checkout instead of just emptying the cart
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS orders (
+        order_id SERIAL PRIMARY KEY,
+        email VARCHAR NOT NULL,
+        price FLOAT NOT NULL,
+        quantity INTEGER NOT NULL,
+        status VARCHAR NOT NULL DEFAULT 'placed',
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS order_lines (
+        order_id INTEGER REFERENCES orders (order_id) ON DELETE CASCADE,
+        book_id INTEGER REFERENCES books (book_id),
+        quantity INTEGER NOT NULL CHECK (quantity > 0),
+        price FLOAT NOT NULL,
+        PRIMARY KEY (order_id, book_id)
+    )
+    """,
+    # foreign key checks when books are updated or deleted
+    'CREATE INDEX IF NOT EXISTS order_lines_book_id_idx ON order_lines (book_id)',
+    # orders waiting for their post-checkout work, requeued when the server starts
+    "CREATE INDEX IF NOT EXISTS orders_placed_idx ON orders (order_id) WHERE status = 'placed'",
+]
+
+
+def upgrade(connection: Connection):
+    for statement in STATEMENTS:
+        connection.execute(text(statement))
@@ -0,0 +1,26 @@
+"""
+Stored responses of the user requests sent with an Idempotency-Key header, replayed to their retries
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        email VARCHAR,
+        key VARCHAR,
+        fingerprint VARCHAR NOT NULL,
+        status SMALLINT,
+        response JSONB,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+        PRIMARY KEY (email, key)
+    )
+    """,
+    # purge of the keys kept long enough
+    'CREATE INDEX IF NOT EXISTS idempotency_keys_created_at_idx ON idempotency_keys (created_at)',
+]
+
+
+def upgrade(connection: Connection):
+    for statement in STATEMENTS:
+        connection.execute(text(statement))
@@ -0,0 +1,15 @@
+"""
+Catalog version shared by all application instances
+A change made through one instance invalidates the catalog cache of the others too.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+STATEMENTS = [
+    'CREATE SEQUENCE IF NOT EXISTS catalog_version_seq',
+]
+
+
+def upgrade(connection: Connection):
+    for statement in STATEMENTS:
+        connection.execute(text(statement))
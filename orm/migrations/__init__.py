@@ -0,0 +1,109 @@
+"""
+versioned schema migrations
+
+Every module of this package named `<version>_<description>.py` (e.g. `0003_hot_query_indexes.py`) is a migration.
+It defines `upgrade(connection)`, which runs its DDL on the given connection. Migrations are applied once each, in
+version order, and recorded in the `schema_migrations` table, in the same transaction as their DDL.
+A migration that sets `TRANSACTIONAL = False` runs outside of any transaction instead, which CREATE INDEX CONCURRENTLY
+needs; it must then be safe to run again if it fails halfway (IF NOT EXISTS / IF EXISTS everywhere).
+
+Apply pending migrations with `python -m orm.migrations`
+"""
+import importlib
+import pkgutil
+import re
+from dataclasses import dataclass
+from types import ModuleType
+from typing import List, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+import orm
+
+MIGRATIONS_TABLE = 'schema_migrations'
+
+_MIGRATION_MODULE_NAME = re.compile(r'^(\d+)_(\w+)$')
+# pg_advisory_lock key, so that two application instances starting together do not run the same migration twice
+_MIGRATIONS_LOCK_ID = 7_402_851
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    module: ModuleType
+
+    @property
+    def transactional(self) -> bool:
+        return getattr(self.module, 'TRANSACTIONAL', True)
+
+    @property
+    def description(self) -> str:
+        return (self.module.__doc__ or self.name).strip().splitlines()[0]
+
+
+def discover() -> List[Migration]:
+    """
+    All migrations of this package, in version order
+    """
+    migrations = []
+    for module_info in pkgutil.iter_modules(__path__):
+        match = _MIGRATION_MODULE_NAME.match(module_info.name)
+        if match:
+            module = importlib.import_module(f'{__name__}.{module_info.name}')
+            migrations.append(Migration(int(match[1]), match[2], module))
+    migrations.sort(key=lambda m: m.version)
+    versions = [m.version for m in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f'Duplicate migration versions in {versions}')
+    return migrations
+
+
+def applied_versions(connection: Connection) -> Set[int]:
+    """
+    Versions of the migrations already applied; creates the bookkeeping table on first use
+    """
+    connection.execute(text(
+        f'CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} ('
+        f'version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, applied_at TIMESTAMP NOT NULL DEFAULT now())'
+    ))
+    return set(connection.execute(text(f'SELECT version FROM {MIGRATIONS_TABLE}')).scalars())
+
+
+def _record(connection: Connection, migration: Migration):
+    connection.execute(
+        text(f'INSERT INTO {MIGRATIONS_TABLE} (version, name) VALUES (:version, :name)'),
+        {'version': migration.version, 'name': migration.name}
+    )
+
+
+def upgrade(engine: Optional[Engine] = None, target: Optional[int] = None) -> List[Migration]:
+    """
+    Applies the pending migrations
+    :param engine: database to migrate; the application database by default
+    :param target: last version to apply; all of them by default
+    :return: the migrations that were applied
+    """
+    engine = engine or orm.engine
+    applied = []
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as lock_connection:
+        lock_connection.execute(text('SELECT pg_advisory_lock(:id)'), {'id': _MIGRATIONS_LOCK_ID})
+        try:
+            with engine.begin() as connection:
+                done = applied_versions(connection)
+            for migration in discover():
+                if migration.version in done or (target is not None and migration.version > target):
+                    continue
+                if migration.transactional:
+                    with engine.begin() as connection:
+                        migration.module.upgrade(connection)
+                        _record(connection, migration)
+                else:
+                    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                        migration.module.upgrade(connection)
+                        _record(connection, migration)
+                applied.append(migration)
+        finally:
+            lock_connection.execute(text('SELECT pg_advisory_unlock(:id)'), {'id': _MIGRATIONS_LOCK_ID})
+    return applied
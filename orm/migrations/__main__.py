@@ -0,0 +1,14 @@
+"""
+python -m orm.migrations [target version]
+"""
+import sys
+
+from orm import migrations
+
+if __name__ == '__main__':
+    target = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    applied = migrations.upgrade(target=target)
+    for migration in applied:
+        print(f'applied {migration.version:04d} {migration.name}: {migration.description}')
+    if not applied:
+        print('database schema is up to date')
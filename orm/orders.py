@@ -0,0 +1,182 @@
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import Integer, Column, String, select, update, delete, Float, ForeignKey, CheckConstraint, DateTime
+from sqlalchemy import Index, literal, func, text, true
+
+import orm
+from orm import books, carts
+
+
+@dataclass
+class OrdersColumns:
+    ORDER_ID = 'order_id'
+    EMAIL = 'email'
+    PRICE = 'price'
+    QUANTITY = 'quantity'
+    STATUS = 'status'
+    CREATED_AT = 'created_at'
+
+
+ORDERS_COLUMNS = [
+    OrdersColumns.ORDER_ID,
+    OrdersColumns.EMAIL,
+    OrdersColumns.PRICE,
+    OrdersColumns.QUANTITY,
+    OrdersColumns.STATUS,
+    OrdersColumns.CREATED_AT
+]
+
+
+@dataclass
+class OrderLinesColumns:
+    ORDER_ID = 'order_id'
+    BOOK_ID = 'book_id'
+    QUANTITY = 'quantity'
+    PRICE = 'price'
+
+
+ORDER_LINES_COLUMNS = [
+    OrderLinesColumns.ORDER_ID,
+    OrderLinesColumns.BOOK_ID,
+    OrderLinesColumns.QUANTITY,
+    OrderLinesColumns.PRICE
+]
+
+
+@dataclass
+class OrderStatus:
+    PLACED = 'placed'           # paid for; post-checkout work pending
+    PROCESSED = 'processed'     # post-checkout work done
+
+
+class OrderLines(orm.BaseTable):
+    __tablename__ = 'order_lines'
+
+    order_id = Column(Integer, ForeignKey('orders.order_id', ondelete='CASCADE'), primary_key=True)
+    book_id = Column(Integer, ForeignKey('books.book_id'), primary_key=True)
+    quantity = Column(Integer, CheckConstraint('quantity > 0'), nullable=False)
+    # price of one copy at checkout
+    price = Column(Float, nullable=False)
+
+
+class Orders(orm.BaseTable):
+    __tablename__ = 'orders'
+    __table_args__ = (
+        # created by orm/migrations; orders waiting for their post-checkout work
+        Index('orders_placed_idx', 'order_id', postgresql_where=text(f"status = '{OrderStatus.PLACED}'")),
+    )
+
+    order_id = Column(Integer, primary_key=True)
+    email = Column(String, nullable=False)
+    # total price and number of copies
+    price = Column(Float, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    status = Column(String, nullable=False, server_default=text(f"'{OrderStatus.PLACED}'"))
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    def place(self, email: str) -> Optional[Dict]:
+        """
+        Turns the cart of the user into an order, in a single statement: the cart lines are deleted, and written as
+        the lines of a new order, with the current price of their books. Their copies were taken out of stock when they
+        were added in cart already.
+        :return: the new order, or None if the cart is empty
+        """
+        bought = delete(carts.Carts).where(carts.Carts.email == email).returning(
+            carts.Carts.book_id, carts.Carts.quantity
+        ).cte('bought')
+        lines = select(bought.c.book_id, bought.c.quantity, books.Books.price).join_from(
+            bought, books.Books, books.Books.book_id == bought.c.book_id
+        ).cte('lines')
+        new_order = insert(Orders).from_select(
+            [Orders.email, Orders.price, Orders.quantity],
+            select(
+                literal(email), func.sum(lines.c.price * lines.c.quantity), func.sum(lines.c.quantity)
+            ).having(func.count() > 0)
+        ).returning(*[Orders.__table__.c[c] for c in ORDERS_COLUMNS]).cte('new_order')
+        new_lines = insert(OrderLines).from_select(
+            ORDER_LINES_COLUMNS,
+            # one order: each line gets its ID
+            select(new_order.c.order_id, lines.c.book_id, lines.c.quantity, lines.c.price).join_from(
+                lines, new_order, true()
+            )
+        ).returning(OrderLines.book_id).cte('new_lines')
+        # the count of new lines is not needed, but makes new_lines part of the statement
+        select_stmt = select(
+            *[new_order.c[c] for c in ORDERS_COLUMNS], select(func.count()).select_from(new_lines).scalar_subquery()
+        )
+        with self.session_factory() as session:
+            exec_result = session.execute(select_stmt).fetchall()
+            session.commit()
+            if not exec_result:
+                return None
+            return super(Orders, Orders)._row_mapper(ORDERS_COLUMNS)(exec_result[0])
+
+    def read(self, order_id: int) -> Optional[Dict]:
+        """
+        Reads an order, with its lines
+        :return: the order, with its lines under 'lines', or None if there is no such order
+        """
+        order_stmt = select(*[Orders.__table__.c[c] for c in ORDERS_COLUMNS]).where(Orders.order_id == order_id)
+        lines_stmt = select(*[OrderLines.__table__.c[c] for c in ORDER_LINES_COLUMNS]).where(
+            OrderLines.order_id == order_id
+        )
+        with self.session_factory() as session:
+            order = session.execute(order_stmt).fetchall()
+            if not order:
+                return None
+            order = super(Orders, Orders)._row_mapper(ORDERS_COLUMNS)(order[0])
+            order['lines'] = [
+                super(Orders, Orders)._row_mapper(ORDER_LINES_COLUMNS)(r) for r in session.execute(lines_stmt)
+            ]
+            return order
+
+    def process(self, order_id: int, handle: Callable[[Dict], None]) -> bool:
+        """
+        Runs `handle` on a placed order (read with its lines, as by `read`), then marks it processed, in a transaction
+        holding the lock of the order meanwhile: however many application instances queued the order, it is handled
+        once. An order locked by another worker is skipped; if `handle` raises, the order is left placed.
+        :return: whether the order was handled; not if it is processed already, being processed, or does not exist
+        """
+        lock_stmt = select(*[Orders.__table__.c[c] for c in ORDERS_COLUMNS]).where(
+            Orders.order_id == order_id, Orders.status == OrderStatus.PLACED
+        ).with_for_update(skip_locked=True)
+        lines_stmt = select(*[OrderLines.__table__.c[c] for c in ORDER_LINES_COLUMNS]).where(
+            OrderLines.order_id == order_id
+        )
+        update_stmt = update(Orders).where(Orders.order_id == order_id).values(status=OrderStatus.PROCESSED)
+        with self.session_factory() as session:
+            order = session.execute(lock_stmt).fetchall()
+            if not order:
+                return False
+            order = super(Orders, Orders)._row_mapper(ORDERS_COLUMNS)(order[0])
+            order['lines'] = [
+                super(Orders, Orders)._row_mapper(ORDER_LINES_COLUMNS)(r) for r in session.execute(lines_stmt)
+            ]
+            handle(order)
+            session.execute(update_stmt)
+            session.commit()
+            return True
+
+    def update_status(self, order_id: int, status: str) -> Optional[Dict]:
+        """
+        :return: the updated order, or None if there is no such order
+        """
+        update_stmt = update(Orders).where(Orders.order_id == order_id).values(status=status).returning(
+            *[Orders.__table__.c[c] for c in ORDERS_COLUMNS]
+        )
+        with self.session_factory() as session:
+            exec_result = session.execute(update_stmt).fetchall()
+            session.commit()
+            if not exec_result:
+                return None
+            return super(Orders, Orders)._row_mapper(ORDERS_COLUMNS)(exec_result[0])
+
+    def read_ids(self, status: str) -> List[int]:
+        """
+        IDs of the orders with the given status, oldest first
+        """
+        select_stmt = select(Orders.order_id).where(Orders.status == status).order_by(Orders.order_id)
+        with self.session_factory() as session:
+            return session.execute(select_stmt).scalars().all()
@@ -0,0 +1,200 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import Integer, Column, select, update, delete, ForeignKey, CheckConstraint, case, cast, func, true
+from sqlalchemy import literal
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql.selectable import CTE
+
+import orm
+from orm import books
+
+
+@dataclass
+class StockShardsColumns:
+    BOOK_ID = 'book_id'
+    SHARD = 'shard'
+    STOCK = 'stock'
+
+
+def _even_share(total, shards, shard):
+    """
+    Copies of shard number `shard` when `total` copies are spread over `shards` shards: the remainder goes to the first
+    shards, one copy each
+    """
+    return total / shards + cast(shard < total % shards, Integer)
+
+
+class StockShards(orm.BaseTable):
+    """
+    Stock of the books flagged as hot, split across several counter rows.
+
+    Every add to cart of a book decrements the same books row, so buyers of a popular book wait on each other's row
+    lock. A hot book keeps its stock in shards instead: each buyer decrements a random shard that has enough copies,
+    skipping the shards locked by other buyers, so they only wait on each other when all shards are busy.
+    The stock of the books row of a hot book is only for display: it is the sum of its shards, as of the last
+    `rebalance`.
+    """
+    __tablename__ = 'book_stock_shards'
+
+    book_id = Column(Integer, ForeignKey('books.book_id', ondelete='CASCADE'), primary_key=True)
+    shard = Column(Integer, CheckConstraint('shard >= 0'), primary_key=True)
+    stock = Column(Integer, CheckConstraint('stock >= 0'), nullable=False)
+
+    @staticmethod
+    def take(requested: CTE, skip_locked: bool = True) -> CTE:
+        """
+        CTE taking the `requested` copies (book_id, quantity) of hot books out of one random shard each, if one of their
+        shards has enough copies
+        :param skip_locked: whether the shards locked by other buyers are skipped, rather than waited for
+        :return: CTE of the copies taken (book_id, quantity)
+        """
+        picked = select(StockShards.book_id, StockShards.shard).where(
+            StockShards.book_id == requested.c.book_id, StockShards.stock >= requested.c.quantity
+        ).order_by(func.random()).limit(1).with_for_update(skip_locked=skip_locked).lateral('picked')
+        pick = select(picked.c.book_id, picked.c.shard, requested.c.quantity).select_from(
+            requested.join(picked, true())
+        ).cte('pick')
+        return update(StockShards).where(
+            StockShards.book_id == pick.c.book_id, StockShards.shard == pick.c.shard
+        ).values(stock=StockShards.stock - pick.c.quantity).returning(
+            StockShards.book_id, pick.c.quantity
+        ).cte('taken_shards')
+
+    @staticmethod
+    def restock(returned: CTE, restocked_books: CTE) -> CTE:
+        """
+        CTE putting the `returned` copies (book_id, quantity; one row per book) of hot books back in their driest shard
+        :param restocked_books: CTE of the returned books (book_id, hot), locked so that they cannot be flagged or
+        unflagged meanwhile
+        :return: CTE of the restocked books (book_id)
+        """
+        driest = aliased(StockShards)
+        driest_shard = select(driest.shard).where(driest.book_id == restocked_books.c.book_id).order_by(
+            driest.stock
+        ).limit(1).scalar_subquery()
+        insert_stmt = insert(StockShards).from_select(
+            [StockShards.book_id, StockShards.shard, StockShards.stock],
+            select(restocked_books.c.book_id, func.coalesce(driest_shard, 0), returned.c.quantity).where(
+                restocked_books.c.book_id == returned.c.book_id, restocked_books.c.hot
+            )
+        )
+        # the shards of a book flagged hot after this statement started are not visible to it, but conflict anyway
+        return insert_stmt.on_conflict_do_update(
+            index_elements=[StockShards.book_id, StockShards.shard],
+            set_={StockShards.stock: StockShards.stock + insert_stmt.excluded.stock}
+        ).returning(StockShards.book_id).cte('restock_shards')
+
+    def rebalance(self, book_ids: Optional[List[int]] = None, reserve: int = 0) -> Dict[int, Tuple[int, int]]:
+        """
+        Spreads the stock of hot books evenly across their shards again, so that no shard stays dry while others still
+        have copies, and writes their total stock in the books table, for display. Single statement.
+        :param book_ids: books to rebalance; all hot books by default. Books that are not hot are ignored.
+        :param reserve: copies kept in the first shard of each book on top of its share, so that a take bigger than the
+        share of one shard can succeed. Only the books whose shards have that many copies together, but none of them
+        alone, are rebalanced then.
+        :return: book_id -> (total stock, stock displayed until then), of the rebalanced books
+        """
+        locked = select(StockShards.book_id, StockShards.shard, StockShards.stock)
+        if book_ids is not None:
+            locked = locked.where(StockShards.book_id.in_(book_ids))
+        locked = locked.order_by(StockShards.book_id, StockShards.shard).with_for_update().cte('locked')
+        totals = select(
+            locked.c.book_id,
+            func.sum(locked.c.stock).label('stock'),
+            func.count().label('shards'),
+            func.least(func.sum(locked.c.stock), reserve).label('reserve')
+        ).group_by(locked.c.book_id)
+        if reserve:
+            totals = totals.having(func.sum(locked.c.stock) >= reserve).having(func.max(locked.c.stock) < reserve)
+        totals = totals.cte('totals')
+        spread = update(StockShards).where(StockShards.book_id == totals.c.book_id).values(
+            stock=_even_share(totals.c.stock - totals.c.reserve, totals.c.shards, StockShards.shard) + case(
+                (StockShards.shard == 0, totals.c.reserve), else_=0
+            )
+        ).returning(StockShards.book_id, StockShards.stock).cte('spread')
+        spread_totals = select(spread.c.book_id, func.sum(spread.c.stock).label('stock')).group_by(
+            spread.c.book_id
+        ).cte('spread_totals')
+        # as of the statement start, unlike the books rows RETURNING sees
+        displayed = select(books.Books.book_id, books.Books.stock).where(
+            books.Books.book_id.in_(select(totals.c.book_id))
+        ).cte('displayed')
+        update_stmt = update(books.Books).where(
+            books.Books.book_id == spread_totals.c.book_id, displayed.c.book_id == books.Books.book_id
+        ).values(stock=spread_totals.c.stock).returning(
+            books.Books.book_id, books.Books.stock, displayed.c.stock
+        ).execution_options(synchronize_session=False)
+        with self.session_factory() as session:
+            exec_result = session.execute(update_stmt).fetchall()
+            session.commit()
+            return {book_id: (stock, displayed_stock) for book_id, stock, displayed_stock in exec_result}
+
+    @staticmethod
+    def availability_changed(rebalanced: Dict[int, Tuple[int, int]]) -> bool:
+        """
+        Whether a `rebalance` displays any book as back in stock, or out of it
+        """
+        return any((stock > 0) != (displayed_stock > 0) for stock, displayed_stock in rebalanced.values())
+
+    def set_stock(self, book_id: int, stock: int) -> Optional[int]:
+        """
+        Sets the stock of a hot book: spread evenly across its shards, and written in the books table for display.
+        Single statement.
+        :return: the stock set, or None if the book is not hot
+        """
+        shards = select(func.count()).where(StockShards.book_id == book_id).scalar_subquery()
+        total = literal(stock, Integer)
+        spread = update(StockShards).where(StockShards.book_id == book_id).values(
+            stock=_even_share(total, shards, StockShards.shard)
+        ).returning(StockShards.book_id).cte('spread')
+        update_stmt = update(books.Books).where(
+            books.Books.book_id == book_id, books.Books.book_id.in_(select(spread.c.book_id))
+        ).values(stock=total).returning(books.Books.stock).execution_options(synchronize_session=False)
+        with self.session_factory() as session:
+            exec_result = session.execute(update_stmt).fetchall()
+            session.commit()
+            return exec_result[0].stock if exec_result else None
+
+    def set_shards(self, book_id: int, shards: int) -> Optional[Dict]:
+        """
+        Flags a book as hot, with its stock spread across `shards` shards, or back to a regular book if `shards` is 0
+        :return: book_id, number of shards and stock of the book, or None if there is no such book
+        """
+        book_stmt = select(books.Books.stock, books.Books.hot).where(books.Books.book_id == book_id).with_for_update()
+        with self.session_factory() as session:
+            book = session.execute(book_stmt).fetchone()
+            if book is None:
+                return None
+            stock = book.stock
+            if book.hot:
+                stock = sum(session.execute(
+                    delete(StockShards).where(StockShards.book_id == book_id).returning(StockShards.stock)
+                ).scalars())
+            if shards:
+                session.execute(insert(StockShards).values([
+                    {
+                        StockShardsColumns.BOOK_ID: book_id,
+                        StockShardsColumns.SHARD: shard,
+                        StockShardsColumns.STOCK: stock // shards + (shard < stock % shards)
+                    } for shard in range(shards)
+                ]))
+            session.execute(update(books.Books).where(books.Books.book_id == book_id).values(
+                hot=shards > 0, stock=stock
+            ))
+            session.commit()
+            return {'book_id': book_id, 'shards': shards, 'stock': stock}
+
+    def read(self, book_id: int) -> List[Dict]:
+        """
+        Shards of a book, in order; none if the book is not hot
+        """
+        select_stmt = select(StockShards.book_id, StockShards.shard, StockShards.stock).where(
+            StockShards.book_id == book_id
+        ).order_by(StockShards.shard)
+        to_dict = super(StockShards, StockShards)._row_mapper(
+            [StockShardsColumns.BOOK_ID, StockShardsColumns.SHARD, StockShardsColumns.STOCK]
+        )
+        with self.session_factory() as session:
+            return [to_dict(r) for r in session.execute(select_stmt)]
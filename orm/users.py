@@ -2,7 +2,7 @@ from dataclasses import dataclass
 from typing import Dict, List
 
 from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy import Integer, Column, String, select, Boolean
+from sqlalchemy import Integer, Column, String, select, update, Boolean
 from sqlalchemy.orm import relationship
 
 import orm
@@ -58,10 +58,19 @@ class Users(orm.BaseTable):
         :param identifier_type: column to search through
         :return: all valid hits
         """
-        select_stmt = select(Users).where(Users.__table__.c[identifier_type] == identifier)
-        result = []
+        select_stmt = select(*[Users.__table__.c[c] for c in USERS_COLUMNS]).where(
+            Users.__table__.c[identifier_type] == identifier
+        )
+        to_dict = super(Users, Users)._row_mapper(USERS_COLUMNS)
         with self.session_factory() as session:
             exec_result = session.execute(select_stmt)
-            for r in exec_result:
-                result.append(super(Users, Users)._transform_select_row_into_dict(r, USERS_COLUMNS))
-        return result
+            return [to_dict(r) for r in exec_result]
+
+    def update_passwd(self, email: str, passwd: str):
+        """
+        Replaces the password hash of a user
+        """
+        update_stmt = update(Users).where(Users.email == email).values(passwd=passwd)
+        with self.session_factory() as session:
+            session.execute(update_stmt)
+            session.commit()
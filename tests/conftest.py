@@ -1,7 +1,42 @@
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 import pytest
-from core import admins, registered_users
+from apscheduler.schedulers.background import BackgroundScheduler
+from core import admins, registered_users, cache, order_processing, task_queue
+
+
+@pytest.fixture(scope='session')
+def microservice_apis():
+    """
+    The microservice_apis package, imported without starting its job scheduler
+    """
+    with patch.object(BackgroundScheduler, 'start'):
+        import microservice_apis
+    return microservice_apis
+
+
+@pytest.fixture(autouse=True)
+def empty_catalog_cache(mocker):
+    # versions counted in process: no database needed
+    mocker.patch.object(cache.catalog_cache, 'versions', cache.LocalVersion())
+    cache.catalog_cache.clear()
+    yield
+    cache.catalog_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def temporary_task_queue(mocker, tmp_path):
+    # never the task queue of the application
+    mocker.patch.object(order_processing.workers, 'queue', task_queue.TaskQueue(
+        str(tmp_path / 'tasks.sqlite3'), order_processing.workers.queue.claim_timeout
+    ))
+
+
+@pytest.fixture(autouse=True)
+def empty_roles_cache():
+    cache.roles_cache.clear()
+    yield
+    cache.roles_cache.clear()
 
 
 @pytest.fixture
@@ -13,6 +48,8 @@ def admins_service():
     books_mock = MagicMock()
     service.books = books_mock
 
+    service.stock_shards = MagicMock()
+
     return service
 
 
@@ -25,4 +62,11 @@ def registered_users_service():
     carts_mock = MagicMock()
     service.carts = carts_mock
 
+    stock_shards_mock = MagicMock()
+    stock_shards_mock.rebalance.return_value = {}
+    service.stock_shards = stock_shards_mock
+
+    orders_mock = MagicMock()
+    service.orders = orders_mock
+
     return service
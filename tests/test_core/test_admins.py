@@ -2,7 +2,7 @@ from unittest.mock import MagicMock
 
 import pytest
 
-from core import admins
+from core import admins, pagination
 
 
 def test_is_admin(mocker):
@@ -16,6 +16,22 @@ def test_is_admin(mocker):
     assert decorated.__doc__ == 'some docstring'
 
 
+@pytest.mark.parametrize('claims, role, expected', [
+    ({'is_admin': True}, True, ('ok', 200)),
+    ({'is_admin': True}, False, ({'message': 'Logged in user is not admin'}, 403)),
+    ({'is_admin': False}, True, ({'message': 'Logged in user is not admin'}, 403)),
+    ({}, True, ('ok', 200))
+])
+def test_is_admin_checks_claim_then_role(mocker, claims, role, expected):
+    mocker.patch('core.admins.get_jwt', return_value=claims)
+    mocker.patch('core.admins.get_jwt_identity', return_value='e')
+    mocked_role = mocker.patch('core.authentication.read_is_admin', return_value=role)
+
+    assert admins.is_admin(lambda: ('ok', 200))() == expected
+    if claims.get('is_admin') is False:
+        mocked_role.assert_not_called()
+
+
 def test_list_categories(mocker, admins_service):
     expected = ['abc', 'def']
 
@@ -94,6 +110,14 @@ def test_update_book(mocker, admins_service):
     ret_val = 'updated'
     mocker.patch.object(admins_service.books, 'update', return_value=ret_val)
     assert admins_service.update_book({'k': 'v', 'title': 't'}) == (ret_val, 200)
+    admins_service.stock_shards.set_stock.assert_not_called()
+
+
+def test_update_book_stock(mocker, admins_service):
+    # a hot book gets the new stock in its shards too
+    mocker.patch.object(admins_service.books, 'update', return_value={'book_id': 3, 'stock': 50})
+    assert admins_service.update_book({'title': 't', 'stock': 50})[1] == 200
+    admins_service.stock_shards.set_stock.assert_called_once_with(3, 50)
 
 
 @pytest.mark.parametrize(
@@ -130,3 +154,90 @@ def test_delete_book_raises(mocker, admins_service, error, error_message, return
     assert result[1] == status_code
     assert 'error' in result[0]
     assert result[0]['message'] == return_message
+
+
+def test_list_books_paginated(mocker, admins_service):
+    ret_val = [{'book_id': 1, 'price': 3}, {'book_id': 2, 'price': 4}]
+    mocked_read = mocker.patch.object(admins_service.books, 'read', return_value=ret_val)
+    after = pagination.encode_cursor({'book_id': 5, 'price': 2}, 'price')
+    result = admins_service.list_books(order_column='price', limit=2, after=after)
+
+    mocked_read.assert_called_once_with(
+        filter_values=None,
+        filter_column='category_name',
+        order_column='price',
+        order_descending=None,
+        limit=2,
+        after=[2, 5],
+        min_price=None,
+        max_price=None,
+        min_year=None,
+        max_year=None,
+        columns=None
+    )
+    assert result[:2] == (ret_val, 200)
+    assert pagination.NEXT_CURSOR_HEADER in result[2]
+
+
+def test_list_books_invalid_cursor(mocker, admins_service):
+    mocked_read = mocker.patch.object(admins_service.books, 'read')
+    result = admins_service.list_books(order_column='price', limit=2, after='garbage')
+
+    mocked_read.assert_not_called()
+    assert result[1] == 400
+
+
+def test_add_book_invalidates_listing_cache(mocker, admins_service):
+    mocked_read = mocker.patch.object(admins_service.books, 'read', return_value=[])
+    mocker.patch.object(admins_service.books, 'create', return_value='added')
+
+    admins_service.list_books()
+    admins_service.list_books()
+    assert mocked_read.call_count == 1
+
+    admins_service.add_book({'title': 't'})
+    admins_service.list_books()
+    assert mocked_read.call_count == 2
+
+
+def test_list_books_price_and_year_ranges(mocker, admins_service):
+    mocked_read = mocker.patch.object(admins_service.books, 'read', return_value=[])
+    admins_service.list_books(max_price=20, min_year=2000, max_year=2010)
+
+    assert mocked_read.call_args.kwargs['min_price'] is None
+    assert mocked_read.call_args.kwargs['max_price'] == 20
+    assert mocked_read.call_args.kwargs['min_year'] == 2000
+    assert mocked_read.call_args.kwargs['max_year'] == 2010
+
+
+def test_list_books_stream(mocker, admins_service):
+    rows = iter([{'book_id': 1}])
+    mocked_stream = mocker.patch.object(admins_service.books, 'stream', return_value=rows)
+    mocked_read = mocker.patch.object(admins_service.books, 'read')
+
+    assert admins_service.list_books(limit=5, stream=True) == (rows, 200)
+    assert mocked_stream.call_args.kwargs['limit'] == 5
+    mocked_read.assert_not_called()
+
+
+def test_set_book_shards(mocker, admins_service):
+    mocker.patch.object(admins_service.books, 'read', return_value=[{'book_id': 4}])
+    mocked_set = mocker.patch.object(
+        admins_service.stock_shards, 'set_shards', return_value={'book_id': 4, 'shards': 8, 'stock': 100}
+    )
+    mocked_bump = mocker.patch('core.cache.catalog_cache.bump')
+
+    result = admins_service.set_book_shards('t', 8)
+
+    mocked_set.assert_called_once_with(4, 8)
+    mocked_bump.assert_called_once()
+    assert result == ({'title': 't', 'book_id': 4, 'shards': 8, 'stock': 100}, 200)
+
+
+def test_set_book_shards_not_found(mocker, admins_service):
+    mocker.patch.object(admins_service.books, 'read', return_value=[])
+
+    result = admins_service.set_book_shards('t', 8)
+
+    admins_service.stock_shards.set_shards.assert_not_called()
+    assert result[1] == 404
@@ -1,6 +1,6 @@
 from unittest.mock import MagicMock
 
-from core import anonymous
+from core import anonymous, pagination
 
 
 def test_list_books(mocker):
@@ -13,4 +13,47 @@ def test_list_books(mocker):
     result = service.list_books()
 
     mocked_read.assert_called_once()
-    assert result[1] == 200
+    assert mocked_read.call_args.kwargs['in_stock_only'] is True
+    assert result == (ret_val, 200)
+
+
+def test_search_books(mocker):
+    service = anonymous.AnonymousUsers()
+    service.books = MagicMock()
+
+    ret_val = [{'book_id': 4, 'rank': 0.7}, {'book_id': 2, 'rank': 0.5}]
+    mocked_search = mocker.patch.object(service.books, 'search', return_value=ret_val)
+    result = service.search_books('hary poter', limit=2)
+
+    mocked_search.assert_called_once_with('hary poter', 2, None, in_stock_only=True)
+    assert result[:2] == (ret_val, 200)
+    assert pagination.decode_cursor(result[2][pagination.NEXT_CURSOR_HEADER], 'rank') == [0.5, 2]
+
+
+def test_search_books_invalid_cursor(mocker):
+    service = anonymous.AnonymousUsers()
+    service.books = MagicMock()
+
+    result = service.search_books('potter', after=pagination.encode_cursor({'book_id': 1}, None))
+    assert result[1] == 400
+
+
+def test_get_books_facets(mocker):
+    service = anonymous.AnonymousUsers()
+    service.books = MagicMock()
+
+    ret_val = {'categories': [{'value': 'Fantasy', 'count': 3}], 'authors': [], 'prices': [], 'years': []}
+    mocked_facets = mocker.patch.object(service.books, 'facets', return_value=ret_val)
+    assert service.get_books_facets(filter_values=['Fantasy'], min_price=10) == (ret_val, 200)
+    assert service.get_books_facets(filter_values=['Fantasy'], min_price=10) == (ret_val, 200)
+
+    # the second call is served from the catalog cache
+    mocked_facets.assert_called_once_with(
+        filter_values=['Fantasy'],
+        filter_column='category_name',
+        in_stock_only=True,
+        min_price=10,
+        max_price=None,
+        min_year=None,
+        max_year=None
+    )
@@ -1,8 +1,9 @@
+from concurrent.futures import Future
 from unittest.mock import MagicMock
 
 import pytest
 
-from core import authentication
+from core import authentication, password_hashing
 
 
 def test_register(mocker):
@@ -38,7 +39,10 @@ def test_register_fails(mocker):
     [
         (({'email': 'e', 'message': 'No account associated with provided email'}, 404), [], True, None, None),
         (({'email': 'e', 'message': 'Wrong password'}, 401), [{'passwd': 'a'}], False, None, None),
-        (({'email': 'e', 'access_token': 'a', 'refresh_token': 'r'}, 200), [{'passwd': 'a'}], True, 'a', 'r')
+        (
+            ({'email': 'e', 'access_token': 'a', 'refresh_token': 'r'}, 200), [{'passwd': 'a', 'is_admin': False}],
+            True, 'a', 'r'
+        )
     ]
 )
 def test_login_no_account(mocker, expected, read_return, hash_return, access_return, refresh_return):
@@ -55,10 +59,84 @@ def test_login_no_account(mocker, expected, read_return, hash_return, access_ret
     assert actual == expected
 
 
+def test_login_tokens_carry_role(mocker):
+    mocked_table = MagicMock()
+    mocked_table.read.return_value = [{'passwd': 'a', 'is_admin': True}]
+    mocker.patch('core.authentication.check_password_hash', return_value=True)
+    mocked_access = mocker.patch('core.authentication.create_access_token', return_value='a')
+    mocked_refresh = mocker.patch('core.authentication.create_refresh_token', return_value='r')
+
+    auth = authentication.Authentication()
+    auth.users = mocked_table
+    auth.login({'email': 'e', 'passwd': 'p'})
+
+    mocked_access.assert_called_once_with(identity='e', additional_claims={'is_admin': True})
+    mocked_refresh.assert_called_once_with(identity='e', additional_claims={'is_admin': True})
+    assert authentication.read_is_admin('e')
+
+
+def _run_now(func, *args) -> Future:
+    future = Future()
+    future.set_result(func(*args))
+    return future
+
+
+@pytest.mark.parametrize('passwd_hash, rehashed', [
+    ('sha256$saltsaltsaltsalt$hash', True),
+    ('pbkdf2:sha256:260000$salt$hash', True),
+    ('pbkdf2:sha256:260000$saltsaltsaltsalt$hash', False)
+])
+def test_login_rehashes_outdated_hash(mocker, passwd_hash, rehashed):
+    mocked_table = MagicMock()
+    mocked_table.read.return_value = [{'passwd': passwd_hash, 'is_admin': False}]
+    mocker.patch('const.PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000')
+    mocker.patch('const.PASSWORD_SALT_LENGTH', 16)
+    mocker.patch('core.authentication.check_password_hash', return_value=True)
+    mocker.patch('core.authentication.generate_password_hash', return_value='new')
+    mocker.patch('core.authentication.create_access_token')
+    mocker.patch('core.authentication.create_refresh_token')
+    mocker.patch.object(password_hashing.pool, 'submit', side_effect=_run_now)
+
+    auth = authentication.Authentication()
+    auth.users = mocked_table
+    assert auth.login({'email': 'e', 'passwd': 'p'})[1] == 200
+
+    if rehashed:
+        mocked_table.update_passwd.assert_called_once_with('e', 'new')
+    else:
+        mocked_table.update_passwd.assert_not_called()
+
+
+def test_login_saturated(mocker):
+    mocked_table = MagicMock()
+    mocked_table.read.return_value = [{'passwd': 'a', 'is_admin': False}]
+    mocker.patch.object(password_hashing.pool, 'run', side_effect=password_hashing.PoolSaturatedError('busy'))
+
+    auth = authentication.Authentication()
+    auth.users = mocked_table
+    response, status, headers = auth.login({'email': 'e', 'passwd': 'p'})
+
+    assert (response['message'], status) == ('busy', 503)
+    assert 'Retry-After' in headers
+
+
 def test_refresh(mocker):
-    mocker.patch('core.authentication.create_access_token', return_value='a')
+    mocked_access = mocker.patch('core.authentication.create_access_token', return_value='a')
+    mocker.patch('core.authentication.read_is_admin', return_value=False)
     assert authentication.Authentication().refresh('e', 'r') == ({
         'email': 'e',
         'access_token': 'a',
         'refresh_token': 'r'
     }, 200)
+    mocked_access.assert_called_once_with('e', additional_claims={'is_admin': False})
+
+
+def test_read_is_admin_is_cached(mocker):
+    mocked_read = mocker.patch.object(authentication.users_table, 'read', return_value=[{'is_admin': True}])
+
+    assert authentication.read_is_admin('e')
+    assert authentication.read_is_admin('e')
+    mocked_read.assert_called_once()
+
+    mocked_read.return_value = []
+    assert not authentication.read_is_admin('unknown')
@@ -0,0 +1,110 @@
+from core import cache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    lru = cache.LRUCache(2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    lru.get('a')
+    lru.set('c', 3)
+
+    assert lru.get('a') == 1
+    assert lru.get('b') is None
+    assert lru.get('c') == 3
+
+
+def test_ttl_cache_expires_entries(mocker):
+    mocked_monotonic = mocker.patch('time.monotonic', return_value=100)
+    ttl_cache = cache.TTLCache(2, ttl=30)
+    ttl_cache.set('a', False)
+
+    assert ttl_cache.get('a') is False
+    mocked_monotonic.return_value = 131
+    assert ttl_cache.get('a') is None
+
+
+def test_normalize_ignores_filter_values_order():
+    first = cache.CatalogCache.normalize({'filter_values': ['b', 'a'], 'order_column': 'price'})
+    second = cache.CatalogCache.normalize({'order_column': 'price', 'filter_values': ['a', 'b']})
+    assert first == second
+    assert hash(first) == hash(second)
+
+
+def test_get_or_read_is_dropped_by_bump():
+    catalog_cache = cache.CatalogCache(8)
+    reads = []
+
+    def read():
+        reads.append(1)
+        return len(reads)
+
+    assert catalog_cache.get_or_read({'limit': 1}, read) == 1
+    assert catalog_cache.get_or_read({'limit': 1}, read) == 1
+
+    catalog_cache.bump()
+    assert catalog_cache.get_or_read({'limit': 1}, read) == 2
+    assert catalog_cache.version == 1
+
+
+def test_tag_differs_across_instances():
+    # e.g. two workers, or one process before and after a restart, both at version 0
+    first, second = cache.CatalogCache(8), cache.CatalogCache(8)
+
+    assert first.tag != second.tag
+    first.bump()
+    assert first.tag not in {second.tag, cache.CatalogCache(8).tag}
+
+
+def test_get_or_read_skips_results_read_across_a_bump():
+    catalog_cache = cache.CatalogCache(8)
+
+    def read():
+        catalog_cache.bump()
+        return 'stale'
+
+    catalog_cache.get_or_read({'limit': 1}, read)
+    assert len(catalog_cache) == 0
+
+
+def test_get_or_read_rechecks_cache_before_reading(mocker):
+    catalog_cache = cache.CatalogCache(8)
+    do = catalog_cache._reads.do
+
+    def late_flight(key, fn):
+        # the previous flight of the query ended between the miss of this caller and its own flight
+        catalog_cache.set(key, 'cached')
+        return do(key, fn)
+
+    mocker.patch.object(catalog_cache._reads, 'do', side_effect=late_flight)
+    read = mocker.Mock(return_value='read')
+
+    assert catalog_cache.get_or_read({'limit': 1}, read) == 'cached'
+    read.assert_not_called()
+
+
+def test_get_or_read_sees_bumps_of_other_instances():
+    # e.g. two workers sharing the database version
+    versions = cache.LocalVersion()
+    first, second = cache.CatalogCache(8, versions), cache.CatalogCache(8, versions)
+    reads = []
+
+    def read():
+        reads.append(1)
+        return len(reads)
+
+    assert first.get_or_read({'limit': 1}, read) == 1
+    second.bump()
+    assert first.get_or_read({'limit': 1}, read) == 2
+    assert first.tag.endswith(':1') and second.tag.endswith(':1')
+
+
+def test_sync_waits_for_check_interval(mocker):
+    versions = cache.LocalVersion()
+    catalog_cache = cache.CatalogCache(8, versions, check_interval=5)
+    monotonic = mocker.patch('time.monotonic', return_value=100)
+    catalog_cache.get_or_read({'limit': 1}, lambda: 'old')
+
+    versions.bump()
+    assert catalog_cache.get_or_read({'limit': 1}, lambda: 'new') == 'old'
+    monotonic.return_value = 105
+    assert catalog_cache.get_or_read({'limit': 1}, lambda: 'new') == 'new'
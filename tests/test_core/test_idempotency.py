@@ -0,0 +1,65 @@
+from datetime import timedelta
+
+import pytest
+
+from core import idempotency, metrics
+
+
+@pytest.fixture(autouse=True)
+def memory_store(mocker):
+    store = idempotency.MemoryStore(max_size=10)
+    mocker.patch('core.idempotency.store', store)
+    mocker.patch('core.metrics.metrics', metrics.Metrics())
+    return store
+
+
+def test_run_once_replays_stored_response(mocker):
+    run = mocker.Mock(return_value=({'cart_id': 1}, 201))
+
+    assert idempotency.run_once('a@b.com', 'k', 'f', run) == ({'cart_id': 1}, 201, {})
+    assert idempotency.run_once('a@b.com', 'k', 'f', run) == ({'cart_id': 1}, 201, {'Idempotent-Replayed': 'true'})
+    run.assert_called_once()
+    assert metrics.metrics.snapshot()['counters'] == {'idempotent_replays': 1}
+
+
+def test_run_once_keys_of_other_users_do_not_clash(mocker):
+    run = mocker.Mock(return_value=({}, 201))
+
+    idempotency.run_once('a@b.com', 'k', 'f', run)
+    idempotency.run_once('c@d.com', 'k', 'f', run)
+
+    assert run.call_count == 2
+
+
+def test_run_once_refuses_key_sent_with_another_request(mocker):
+    idempotency.run_once('a@b.com', 'k', 'f', mocker.Mock(return_value=({}, 201)))
+    run = mocker.Mock()
+
+    assert idempotency.run_once('a@b.com', 'k', 'other', run)[1] == 422
+    run.assert_not_called()
+
+
+def test_run_once_refuses_key_still_running(memory_store, mocker):
+    memory_store.claim('a@b.com', 'k', 'f')
+    run = mocker.Mock()
+
+    assert idempotency.run_once('a@b.com', 'k', 'f', run)[1] == 409
+    run.assert_not_called()
+
+
+def test_run_once_takes_over_expired_claim(memory_store, mocker):
+    mocker.patch('core.idempotency.CLAIM_TIMEOUT', timedelta(0))
+    memory_store.claim('a@b.com', 'k', 'f')
+
+    assert idempotency.run_once('a@b.com', 'k', 'f', mocker.Mock(return_value=({}, 201)))[1] == 201
+
+
+@pytest.mark.parametrize('run_kwargs', [{'return_value': ({}, 500)}, {'side_effect': RuntimeError}])
+def test_run_once_failed_request_runs_again(mocker, run_kwargs):
+    try:
+        idempotency.run_once('a@b.com', 'k', 'f', mocker.Mock(**run_kwargs))
+    except RuntimeError:
+        pass
+    run = mocker.Mock(return_value=({}, 201))
+
+    assert idempotency.run_once('a@b.com', 'k', 'f', run) == ({}, 201, {})
@@ -0,0 +1,25 @@
+from core import metrics
+
+
+def test_counters_and_summaries():
+    registry = metrics.Metrics()
+    registry.increment('runs')
+    registry.increment('runs', 2)
+    for value in (3, 1, 2):
+        registry.observe('batch_size', value)
+
+    assert registry.snapshot() == {
+        'counters': {'runs': 3},
+        'summaries': {'batch_size': {'count': 3, 'sum': 6, 'min': 1, 'max': 3, 'last': 2}}
+    }
+
+
+def test_snapshot_is_a_copy():
+    registry = metrics.Metrics()
+    registry.observe('lag', 1)
+    snapshot = registry.snapshot()
+    registry.observe('lag', 5)
+
+    assert snapshot['summaries']['lag']['max'] == 1
+    registry.clear()
+    assert registry.snapshot() == {'counters': {}, 'summaries': {}}
@@ -0,0 +1,34 @@
+import pytest
+
+from core import order_processing
+
+
+ORDER = {
+    'order_id': 3, 'email': 'e', 'price': 12.5, 'quantity': 3, 'status': 'placed', 'created_at': None,
+    'lines': [
+        {'order_id': 3, 'book_id': 1, 'quantity': 2, 'price': 5},
+        {'order_id': 3, 'book_id': 2, 'quantity': 1, 'price': 2.5}
+    ]
+}
+
+
+def test_process_order(mocker):
+    mocked_process = mocker.patch(
+        'orm.orders.Orders.process', side_effect=lambda order_id, handle: handle(dict(ORDER)) or True
+    )
+    mocked_rebalance = mocker.patch('orm.stock_shards.StockShards.rebalance', return_value={2: (0, 1)})
+    mocked_bump = mocker.patch('core.cache.catalog_cache.bump')
+
+    order_processing.process_order({'order_id': 3})
+
+    assert mocked_process.call_args.args[0] == 3
+    mocked_rebalance.assert_called_once_with([1, 2])
+    mocked_bump.assert_called_once()
+
+
+def test_requeue_placed_orders(mocker):
+    mocker.patch('orm.orders.Orders.read_ids', return_value=[1, 2])
+    mocked_submit = mocker.patch.object(order_processing.workers, 'submit', side_effect=[True, False])
+
+    assert order_processing.requeue_placed_orders() == 1
+    mocked_submit.assert_called_with('order_placed', {'order_id': 2}, key='order:2')
@@ -0,0 +1,68 @@
+import base64
+import json
+
+import pytest
+
+from core import pagination
+
+
+@pytest.mark.parametrize(
+    'book, order_column, expected_key',
+    [
+        ({'book_id': 7, 'price': 12.5}, 'price', [12.5, 7]),
+        ({'book_id': 7, 'price': 12.5}, None, [7])
+    ]
+)
+def test_cursor_round_trip(book, order_column, expected_key):
+    cursor = pagination.encode_cursor(book, order_column)
+    assert pagination.decode_cursor(cursor, order_column) == expected_key
+
+
+def test_decode_cursor_empty():
+    assert pagination.decode_cursor(None, 'price') is None
+
+
+@pytest.mark.parametrize(
+    'cursor, order_column',
+    [
+        ('not-a-cursor', None),
+        (pagination.encode_cursor({'book_id': 1, 'price': 3}, 'price'), 'year_published'),
+        (pagination.encode_cursor({'book_id': 1}, None), 'price')
+    ]
+)
+def test_decode_cursor_raises(cursor, order_column):
+    with pytest.raises(ValueError):
+        pagination.decode_cursor(cursor, order_column)
+
+
+def test_decode_cursor_checks_direction():
+    cursor = pagination.encode_cursor({'book_id': 1, 'price': 3}, 'price', descending=False)
+
+    with pytest.raises(ValueError):
+        pagination.decode_cursor(cursor, 'price', descending=True)
+    assert pagination.decode_cursor(
+        pagination.encode_cursor({'book_id': 1, 'price': 3}, 'price', descending=True), 'price', descending=True
+    ) == [3, 1]
+
+
+def _hand_made_cursor(key) -> str:
+    return base64.urlsafe_b64encode(json.dumps({'order': 'price', 'desc': False, 'key': key}).encode()).decode()
+
+
+@pytest.mark.parametrize('key', [['3', 1], [3, '1'], [3, 1.5], [True, 1], [3, None], [3, 1, 2], {'a': 1, 'b': 2}])
+def test_decode_cursor_checks_key_types(key):
+    with pytest.raises(ValueError):
+        pagination.decode_cursor(_hand_made_cursor(key), 'price')
+
+
+def test_paginate_full_page():
+    books_page = [{'book_id': 1, 'price': 3}, {'book_id': 2, 'price': 4}]
+    result = pagination.paginate(books_page, 2, 'price')
+
+    assert result[:2] == (books_page, 200)
+    assert pagination.decode_cursor(result[2][pagination.NEXT_CURSOR_HEADER], 'price') == [4, 2]
+
+
+def test_paginate_last_page():
+    books_page = [{'book_id': 1}]
+    assert pagination.paginate(books_page, 2, None) == (books_page, 200)
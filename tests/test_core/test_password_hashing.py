@@ -0,0 +1,49 @@
+import threading
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from core import password_hashing
+
+
+def test_pool_runs_function():
+    pool = password_hashing.HashingPool(workers=1, max_queued=0)
+    assert pool.run(sum, [1, 2]) == 3
+
+
+def test_saturated_pool_refuses_work():
+    pool = password_hashing.HashingPool(workers=1, max_queued=1)
+    release = threading.Event()
+    running = [pool.submit(release.wait), pool.submit(release.wait)]
+
+    with pytest.raises(password_hashing.PoolSaturatedError):
+        pool.submit(release.wait)
+    release.set()
+    for future in running:
+        future.result()
+    assert pool.run(sum, [1]) == 1
+
+
+@pytest.mark.parametrize('passwd_hash, expected', [
+    ('sha256$saltsaltsaltsalt$hash', True),
+    ('pbkdf2:sha256:1000$saltsaltsaltsalt$hash', True),
+    ('pbkdf2:sha256:260000$salt$hash', True),
+    ('pbkdf2:sha256:260000$saltsaltsaltsalt$hash', False)
+])
+def test_needs_rehash(mocker, passwd_hash, expected):
+    mocker.patch('const.PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000')
+    mocker.patch('const.PASSWORD_SALT_LENGTH', 16)
+    assert password_hashing.needs_rehash(passwd_hash) == expected
+
+
+@pytest.mark.parametrize('method, salt_length, expected', [
+    ('pbkdf2:sha256', 16, False),
+    ('pbkdf2:sha256:260000', 16, False),
+    ('pbkdf2:sha256:260000', 8, True),
+    ('pbkdf2:sha512:260000', 16, True)
+])
+def test_needs_rehash_werkzeug_hash(mocker, method, salt_length, expected):
+    passwd_hash = generate_password_hash('Passw0rd!', method=method, salt_length=salt_length)
+    mocker.patch('const.PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+    mocker.patch('const.PASSWORD_SALT_LENGTH', 16)
+    assert password_hashing.needs_rehash(passwd_hash) == expected
@@ -0,0 +1,24 @@
+from core import rate_limiting
+
+
+def test_token_buckets_refill(mocker):
+    mocked_monotonic = mocker.patch('time.monotonic', return_value=100)
+    buckets = rate_limiting.TokenBuckets(rate=2, burst=3, max_keys=10)
+
+    assert [buckets.take('a') for _ in range(3)] == [0, 0, 0]
+    assert buckets.take('a') == 0.5
+    # other clients have their own bucket
+    assert buckets.take('b') == 0
+
+    mocked_monotonic.return_value = 100.5
+    assert buckets.take('a') == 0
+    assert buckets.take('a') > 0
+
+
+def test_concurrency_limit():
+    limit = rate_limiting.ConcurrencyLimit(1)
+
+    assert limit.acquire()
+    assert not limit.acquire()
+    limit.release()
+    assert limit.acquire()
@@ -1,7 +1,8 @@
-from unittest.mock import call
+from datetime import timedelta
 
 import pytest
-from core import registered_users
+
+from core import metrics, registered_users
 
 
 def test_list_books(mocker, registered_users_service):
@@ -10,18 +11,30 @@ def test_list_books(mocker, registered_users_service):
     result = registered_users_service.list_books()
 
     mocked_read.assert_called_once()
-    assert result[1] == 200
+    assert mocked_read.call_args.kwargs['in_stock_only'] is True
+    assert result == (ret_val, 200)
 
 
 def test_add_book_to_cart(mocker, registered_users_service):
-    ret_val = {'cart_id': 3}
-    mocker.patch('microservice_apis.scheduler')
-    mocker.patch('core.registered_users.RegisteredUsers._validate_book_stock', return_value={'stock': 3})
-    mocked_create = mocker.patch.object(registered_users_service.carts, 'create', return_value=ret_val)
-    result = registered_users_service.add_book_to_cart('e', 1)
+    ret_val = {'cart_id': 3, 'email': 'e', 'book_id': 1, 'quantity': 5, 'stock': 2}
+    mocked_validate = mocker.patch('core.registered_users.RegisteredUsers._validate_book_stock')
+    mocked_add = mocker.patch.object(registered_users_service.carts, 'add_book', return_value=ret_val)
+    result = registered_users_service.add_book_to_cart('e', 1, 2)
+
+    mocked_add.assert_called_once_with('e', 1, 2)
+    mocked_validate.assert_not_called()
+    assert result == ({'email': 'e', 'cart_id': 3, 'quantity': 5, 'message': 'Book added to user cart'}, 201)
+
 
-    mocked_create.asswert_called_once()
-    assert result == ({'email': 'e', 'message': 'Book added to user cart'}, 201)
+@pytest.mark.parametrize('stock, bumped', [(1, False), (0, True), (None, False)])
+def test_add_book_to_cart_bumps_catalog_when_sold_out(mocker, registered_users_service, stock, bumped):
+    mocker.patch.object(registered_users_service.carts, 'add_book', return_value={
+        'cart_id': 3, 'email': 'e', 'book_id': 1, 'quantity': 1, 'stock': stock
+    })
+    mocked_bump = mocker.patch('core.cache.catalog_cache.bump')
+
+    assert registered_users_service.add_book_to_cart('e', 1)[1] == 201
+    assert mocked_bump.called == bumped
 
 
 @pytest.mark.parametrize(
@@ -32,84 +45,192 @@ def test_add_book_to_cart(mocker, registered_users_service):
     ]
 )
 def test_add_book_to_cart_raises(mocker, registered_users_service, error, error_text, status_code):
+    mocker.patch.object(registered_users_service.carts, 'add_book', return_value=None)
     mocked_validate = mocker.patch(
         'core.registered_users.RegisteredUsers._validate_book_stock', side_effect=error(error_text)
     )
     result = registered_users_service.add_book_to_cart('e', 1)
 
-    mocked_validate.asser_called_once()
+    mocked_validate.assert_called_once_with(1)
     assert result[1] == status_code
     assert error_text == result[0]['message']
 
 
-def test_validate_book_stock(mocker, registered_users_service):
-    mocker.patch.object(registered_users_service.books, 'read', return_value=[{'stock': 3}])
-    registered_users_service._validate_book_stock(1)
+def test_add_book_to_cart_sold_out_meanwhile(mocker, registered_users_service):
+    # the stock went up again between the failed decrement and the read that explains it
+    mocker.patch.object(registered_users_service.carts, 'add_book', return_value=None)
+    mocker.patch('core.registered_users.RegisteredUsers._validate_book_stock', return_value={'stock': 1, 'hot': False})
+    result = registered_users_service.add_book_to_cart('e', 1)
 
+    assert result[1] == 403
 
-@pytest.mark.parametrize('ret_val, error', [([], ValueError), ([{'stock': 0}], Exception)])
-def test_validate_book_stock_raises(mocker, registered_users_service, ret_val, error):
-    mocker.patch.object(registered_users_service.books, 'read', return_value=ret_val)
-    with pytest.raises(error):
-        registered_users_service._validate_book_stock(1)
 
+def test_add_book_to_cart_refused_not_hot(mocker, registered_users_service):
+    # a regular book has no shards to wait for or rebalance
+    mocked_add = mocker.patch.object(registered_users_service.carts, 'add_book', return_value=None)
+    mocker.patch('core.registered_users.RegisteredUsers._validate_book_stock', return_value={'stock': 1, 'hot': False})
+    mocked_rebalance = mocker.patch.object(registered_users_service.stock_shards, 'rebalance')
 
-def test_delete_book_from_cart(mocker, registered_users_service):
-    mocker.patch('core.registered_users.RegisteredUsers._check_if_item_is_in_the_right_cart', return_value=1)
-    mocked_delete = mocker.patch.object(registered_users_service.carts, 'delete')
-    mocker.patch('microservice_apis.scheduler')
-    mocker.patch('core.registered_users.RegisteredUsers._increase_book_stock')
+    result = registered_users_service.add_book_to_cart('e', 1)
 
-    result = registered_users_service.delete_book_from_cart('e', 1)
+    mocked_add.assert_called_once_with('e', 1, 1)
+    mocked_rebalance.assert_not_called()
+    assert result[1] == 403
 
-    mocked_delete.assert_called_once()
-    assert result == ({'email': 'e', 'message': 'Book deleted from user cart'}, 200)
 
+def test_add_book_to_cart_hot_shard_locked(mocker, registered_users_service):
+    # the only shard with enough copies was locked by another buyer: waited for, not rebalanced
+    mocked_add = mocker.patch.object(
+        registered_users_service.carts, 'add_book', side_effect=[None, {'cart_id': 3, 'quantity': 1, 'stock': None}]
+    )
+    mocked_rebalance = mocker.patch.object(registered_users_service.stock_shards, 'rebalance')
+    mocker.patch('core.registered_users.RegisteredUsers._validate_book_stock', return_value={'stock': 1, 'hot': True})
 
-@pytest.mark.parametrize(
-    'error, error_text, status_code',
-    [
-        (ValueError, 'some text', 404),
-        (RuntimeError, 'some other text', 404)
+    result = registered_users_service.add_book_to_cart('e', 1)
+
+    assert mocked_add.call_args_list == [mocker.call('e', 1, 1), mocker.call('e', 1, 1, skip_locked=False)]
+    mocked_rebalance.assert_not_called()
+    assert result[1] == 201
+
+
+def test_add_book_to_cart_hot_book_rebalanced(mocker, registered_users_service):
+    mocked_add = mocker.patch.object(registered_users_service.carts, 'add_book', side_effect=[
+        None, None, {'cart_id': 3, 'quantity': 1, 'stock': None}
+    ])
+    mocked_rebalance = mocker.patch.object(registered_users_service.stock_shards, 'rebalance', return_value={1: (5, 0)})
+    mocker.patch('core.registered_users.RegisteredUsers._validate_book_stock', return_value={'stock': 0, 'hot': True})
+
+    result = registered_users_service.add_book_to_cart('e', 1)
+
+    mocked_rebalance.assert_called_once_with([1], reserve=1)
+    assert mocked_add.call_count == 3
+    assert result[1] == 201
+
+
+def test_add_books_to_cart(mocker, registered_users_service):
+    mocker.patch.object(registered_users_service.carts, 'add_books', return_value=[
+        {'cart_id': 7, 'email': 'e', 'book_id': 2, 'quantity': 2, 'stock': 1}
+    ])
+    mocked_read = mocker.patch.object(
+        registered_users_service.books, 'read', return_value=[{'book_id': 3, 'hot': False}]
+    )
+    result = registered_users_service.add_books_to_cart('e', [2, 3, 2, 4])
+
+    mocked_read.assert_called_once_with(filter_column='book_id', filter_values=[3, 4], columns=['book_id', 'hot'])
+    # no hot book was refused: nothing to wait for or rebalance
+    registered_users_service.carts.add_books.assert_called_once()
+    registered_users_service.stock_shards.rebalance.assert_not_called()
+    assert result[1] == 201
+    assert [(i['book_id'], i.get('cart_id'), i['status']) for i in result[0]['items']] == [
+        (2, 7, 201), (3, None, 403), (2, 7, 201), (4, None, 404)
     ]
-)
-def test_delete_book_from_cart_raises(mocker, registered_users_service, error, error_text, status_code):
-    mocked_validate = mocker.patch(
-        'core.registered_users.RegisteredUsers._check_if_item_is_in_the_right_cart', side_effect=error(error_text)
+    assert result[0]['message'] == '2 of 4 books added to user cart'
+
+
+def test_add_books_to_cart_hot_shards_locked(mocker, registered_users_service):
+    mocked_add = mocker.patch.object(registered_users_service.carts, 'add_books', side_effect=[
+        [{'cart_id': 7, 'email': 'e', 'book_id': 2, 'quantity': 1, 'stock': 4}],
+        [{'cart_id': 8, 'email': 'e', 'book_id': 3, 'quantity': 2, 'stock': None}]
+    ])
+    mocked_rebalance = mocker.patch.object(registered_users_service.stock_shards, 'rebalance')
+    mocker.patch.object(registered_users_service.books, 'read', return_value=[{'book_id': 3, 'hot': True}])
+
+    result = registered_users_service.add_books_to_cart('e', [2, 3, 3])
+
+    # only the copies refused are requested again, waiting for the shards locked by other buyers
+    assert mocked_add.call_args == mocker.call('e', [3, 3], skip_locked=False)
+    mocked_rebalance.assert_not_called()
+    assert [i['status'] for i in result[0]['items']] == [201, 201, 201]
+
+
+def test_add_books_to_cart_hot_books_rebalanced(mocker, registered_users_service):
+    mocked_add = mocker.patch.object(registered_users_service.carts, 'add_books', side_effect=[
+        [{'cart_id': 7, 'email': 'e', 'book_id': 2, 'quantity': 1, 'stock': 4}],
+        [],
+        [{'cart_id': 8, 'email': 'e', 'book_id': 3, 'quantity': 2, 'stock': None}]
+    ])
+    mocked_rebalance = mocker.patch.object(
+        registered_users_service.stock_shards, 'rebalance', side_effect=[{}, {3: (10, 10)}]
     )
-    result = registered_users_service.delete_book_from_cart('e', 1)
+    mocker.patch.object(registered_users_service.books, 'read', return_value=[
+        {'book_id': 3, 'hot': True}, {'book_id': 4, 'hot': True}
+    ])
+
+    result = registered_users_service.add_books_to_cart('e', [2, 3, 3, 4])
+
+    # each book keeps as many copies in its first shard as it is requested
+    assert mocked_rebalance.call_args_list == [mocker.call([4], reserve=1), mocker.call([3], reserve=2)]
+    # only the copies of the rebalanced books are requested again
+    assert mocked_add.call_args.args == ('e', [3, 3])
+    assert [(i['book_id'], i.get('cart_id'), i['status']) for i in result[0]['items']] == [
+        (2, 7, 201), (3, 8, 201), (3, 8, 201), (4, None, 403)
+    ]
+
+
+@pytest.mark.parametrize('existing, status_code', [([], 404), ([{'book_id': 1, 'hot': False}], 403)])
+def test_add_books_to_cart_none_added(mocker, registered_users_service, existing, status_code):
+    mocker.patch.object(registered_users_service.carts, 'add_books', return_value=[])
+    mocker.patch.object(registered_users_service.books, 'read', return_value=existing)
+    result = registered_users_service.add_books_to_cart('e', [1, 2])
 
-    mocked_validate.asser_called_once()
     assert result[1] == status_code
-    assert error_text == result[0]['message']
 
 
-def test_check_if_item_is_in_the_right_cart(mocker, registered_users_service):
-    mocker.patch.object(registered_users_service.carts, 'read', return_value=[{'cart_id': 3, 'book_id': 1}])
-    registered_users_service._check_if_item_is_in_the_right_cart(3, 'e')
+@pytest.mark.parametrize('book_ids', [[], list(range(101))])
+def test_add_books_to_cart_batch_size(registered_users_service, book_ids):
+    result = registered_users_service.add_books_to_cart('e', book_ids)
+
+    assert result[1] == 400
+    registered_users_service.carts.add_books.assert_not_called()
 
 
-@pytest.mark.parametrize('ret_val, error', [([], ValueError), ([{'cart_id': 2}], RuntimeError)])
-def test_check_if_item_is_in_the_right_cart_raises(mocker, registered_users_service, ret_val, error):
-    mocker.patch.object(registered_users_service.carts, 'read', return_value=ret_val)
+def test_validate_book_stock(mocker, registered_users_service):
+    mocker.patch.object(registered_users_service.books, 'read', return_value=[{'stock': 3, 'hot': False}])
+    registered_users_service._validate_book_stock(1)
+
+
+def test_validate_book_stock_hot(mocker, registered_users_service):
+    # its shards may have copies that it does not display yet
+    mocker.patch.object(registered_users_service.books, 'read', return_value=[{'stock': 0, 'hot': True}])
+    registered_users_service._validate_book_stock(1)
+
+
+@pytest.mark.parametrize('ret_val, error', [([], ValueError), ([{'stock': 0, 'hot': False}], Exception)])
+def test_validate_book_stock_raises(mocker, registered_users_service, ret_val, error):
+    mocker.patch.object(registered_users_service.books, 'read', return_value=ret_val)
     with pytest.raises(error):
-        registered_users_service._check_if_item_is_in_the_right_cart(1, 'e')
+        registered_users_service._validate_book_stock(1)
 
 
-def test_increase_book_stock(mocker, registered_users_service):
-    mocker.patch.object(registered_users_service.books, 'read', return_value=[{'stock': 1}])
-    mocked_update = mocker.patch.object(registered_users_service.books, 'update')
+@pytest.mark.parametrize('back_in_stock', [True, False])
+def test_delete_book_from_cart(mocker, registered_users_service, back_in_stock):
+    mocked_remove = mocker.patch.object(registered_users_service.carts, 'remove', return_value=back_in_stock)
+    mocked_bump = mocker.patch('core.cache.catalog_cache.bump')
 
-    registered_users_service._increase_book_stock(7)
-    mocked_update.assert_called_once_with(
-        update_data={'stock': 2},
-        identifier=7,
-        identifier_type='book_id'
-    )
+    result = registered_users_service.delete_book_from_cart('e', 1)
+
+    mocked_remove.assert_called_once_with(1, 'e', 1)
+    # listings only change when the book was out of stock
+    assert mocked_bump.called == back_in_stock
+    registered_users_service.carts.read.assert_not_called()
+    assert result == ({'email': 'e', 'message': 'Book deleted from user cart'}, 200)
+
+
+def test_delete_book_from_cart_not_in_cart(mocker, registered_users_service):
+    mocker.patch.object(registered_users_service.carts, 'remove', return_value=None)
+    mocked_bump = mocker.patch('core.cache.catalog_cache.bump')
+
+    result = registered_users_service.delete_book_from_cart('e', 1)
+
+    mocked_bump.assert_not_called()
+    assert result[1] == 404
+    assert result[0]['message'] == 'Item with ID "1" not in cart of user "e"'
 
 
 def test_get_cart_content_empty(mocker, registered_users_service):
-    mocked = mocker.patch.object(registered_users_service.carts, 'get_cart_content', return_value=[])
+    mocked = mocker.patch.object(
+        registered_users_service.carts, 'get_cart_content', return_value={'items': [], 'price': 0, 'quantity': 0}
+    )
     result = registered_users_service.get_cart_content('e')
 
     assert result[1] == 404
@@ -117,48 +238,95 @@ def test_get_cart_content_empty(mocker, registered_users_service):
 
 
 def test_get_cart_content(mocker, registered_users_service):
+    items = [{'cart_id': 1, 'book_id': 2, 'title': 't', 'price': 1.5, 'quantity': 2}]
     mocked = mocker.patch.object(
-        registered_users_service.carts, 'get_cart_content', return_value=[{'title': 't', 'price': 1}]
+        registered_users_service.carts, 'get_cart_content', return_value={'items': items, 'price': 3, 'quantity': 2}
     )
     result = registered_users_service.get_cart_content('e')
     mocked.assert_called_once_with('e')
-    assert result == ({'email': 'e', 'price': 1, 'books': ['t']}, 200)
+    assert result == ({'email': 'e', 'price': 3, 'quantity': 2, 'books': ['t'], 'items': items}, 200)
 
 
 def test_checkout_cart_empty(mocker, registered_users_service):
-    mocked = mocker.patch.object(registered_users_service.carts, 'delete', return_value=[])
+    mocked = mocker.patch.object(registered_users_service.orders, 'place', return_value=None)
+    mocked_submit = mocker.patch('core.order_processing.submit')
     result = registered_users_service.checkout_cart('e')
 
     assert result[1] == 404
-    mocked.assert_called_once_with(identifier='e', identifier_type='email')
+    mocked.assert_called_once_with('e')
+    mocked_submit.assert_not_called()
 
 
 def test_checkout_cart(mocker, registered_users_service):
-    mocked = mocker.patch.object(registered_users_service.carts, 'delete', return_value=[{'cart_id': 1}])
-    mocker.patch('core.registered_users.RegisteredUsers._stop_cart_cleanup_jobs')
+    order = {'order_id': 9, 'email': 'e', 'price': 12.5, 'quantity': 3, 'status': 'placed', 'created_at': None}
+    mocker.patch.object(registered_users_service.orders, 'place', return_value=order)
+    mocked_submit = mocker.patch('core.order_processing.submit')
     result = registered_users_service.checkout_cart('e')
 
     assert result[1] == 200
-    mocked.assert_called_once_with(identifier='e', identifier_type='email')
-
-
-def test_stop_cart_cleanup_jobs(mocker, registered_users_service):
-    mocked_method = mocker.patch('microservice_apis.scheduler.remove_job')
-    registered_users_service._stop_cart_cleanup_jobs([1, 2, 3])
-    calls = [call(1), call(2), call(3)]
-    mocked_method.assert_has_calls(calls)
-
-
-def test_global_func(mocker):
-    mocked_carts_delete = mocker.patch('orm.carts.Carts.delete')
-    mocked_books_read = mocker.patch('orm.books.Books.read', return_value=[{'stock': 1}])
-    mocked_books_update = mocker.patch('orm.books.Books.update')
+    assert (result[0]['order_id'], result[0]['price'], result[0]['status']) == (9, 12.5, 'placed')
+    mocked_submit.assert_called_once_with(9)
+    registered_users_service.carts.delete.assert_not_called()
+
+
+def test_reap_expired_carts(mocker):
+    mocked_expire = mocker.patch('orm.carts.Carts.expire', side_effect=[
+        (2, 1, 0, timedelta(seconds=3)), (2, 2, 1, timedelta(seconds=1)), (1, 1, 0, timedelta(seconds=0.5))
+    ])
+    mocked_bump = mocker.patch('core.cache.catalog_cache.bump')
+    mocker.patch('core.metrics.metrics', metrics.Metrics())
+
+    assert registered_users.reap_expired_carts(batch_size=2) == 5
+    # the last batch was not full: nothing left to expire
+    assert mocked_expire.call_count == 3
+    mocked_bump.assert_called_once()
+    snapshot = metrics.metrics.snapshot()
+    assert snapshot['counters'] == {
+        'cart_reaper_expired_items': 5, 'cart_reaper_restocked_books': 4, 'cart_reaper_runs': 1
+    }
+    assert snapshot['summaries']['cart_reaper_batch_size']['max'] == 2
+    assert snapshot['summaries']['cart_reaper_lag_seconds']['last'] == 0.5
+
+
+def test_reap_expired_carts_nothing_due(mocker):
+    mocker.patch('orm.carts.Carts.expire', return_value=(0, 0, 0, None))
+    mocked_bump = mocker.patch('core.cache.catalog_cache.bump')
+
+    assert registered_users.reap_expired_carts() == 0
+    mocked_bump.assert_not_called()
+
+
+@pytest.mark.parametrize('max_batches', [1, 3])
+def test_reap_expired_carts_max_batches(mocker, max_batches):
+    mocked_expire = mocker.patch('orm.carts.Carts.expire', return_value=(2, 1, 0, timedelta(seconds=1)))
+    mocker.patch('core.cache.catalog_cache.bump')
+
+    assert registered_users.reap_expired_carts(batch_size=2, max_batches=max_batches) == 2 * max_batches
+    assert mocked_expire.call_count == max_batches
+
+
+@pytest.mark.parametrize('rebalanced, bumped', [
+    ({1: (10, 9), 2: (0, 0)}, False),
+    ({1: (10, 9), 2: (0, 1)}, True),
+    ({1: (10, 0), 2: (0, 0)}, True)
+])
+def test_rebalance_hot_books(mocker, rebalanced, bumped):
+    mocker.patch('orm.stock_shards.StockShards.rebalance', return_value=rebalanced)
+    mocked_bump = mocker.patch('core.cache.catalog_cache.bump')
+    mocker.patch('core.metrics.metrics', metrics.Metrics())
+
+    assert registered_users.rebalance_hot_books() == 2
+    # listings only change when a book is displayed as back in stock, or out of it
+    assert mocked_bump.called == bumped
+    snapshot = metrics.metrics.snapshot()
+    assert snapshot['counters'] == {'stock_rebalancer_runs': 1}
+    assert snapshot['summaries']['stock_rebalancer_books']['last'] == 2
+
+
+def test_list_books_sparse_fields(mocker, registered_users_service):
+    ret_val = [{'book_id': 1, 'title': 't', 'price': 2}]
+    mocked_read = mocker.patch.object(registered_users_service.books, 'read', return_value=ret_val)
+    result = registered_users_service.list_books(columns=['book_id', 'title', 'price'])
 
-    registered_users.func(1, 1)
-    mocked_carts_delete.assert_called_once()
-    mocked_books_read.assert_called_once_with(filter_column='book_id', filter_values=[1])
-    mocked_books_update.assert_called_once_with(
-        update_data={'stock': 2},
-        identifier=1,
-        identifier_type='book_id'
-    )
+    assert mocked_read.call_args.kwargs['columns'] == ['book_id', 'title', 'price']
+    assert result == (ret_val, 200)
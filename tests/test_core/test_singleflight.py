@@ -0,0 +1,56 @@
+import threading
+import time
+
+import pytest
+
+from core import singleflight
+
+
+def _concurrent_calls(flight, key, func, callers):
+    results = []
+
+    def call():
+        try:
+            results.append(flight.do(key, func))
+        except Exception as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+@pytest.mark.parametrize('outcome', ['result', 'error'])
+def test_concurrent_calls_run_once(outcome):
+    flight = singleflight.SingleFlight()
+    release = threading.Event()
+    runs = []
+    error = ValueError('failed')
+
+    def read():
+        runs.append(1)
+        release.wait()
+        if outcome == 'error':
+            raise error
+        return ['book']
+
+    threads, results = _concurrent_calls(flight, 'k', read, 5)
+    time.sleep(0.1)     # the callers are waiting on the first one
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(runs) == 1
+    assert results == [error if outcome == 'error' else ['book']] * 5
+
+
+def test_calls_after_completion_run_again():
+    flight = singleflight.SingleFlight()
+    runs = []
+
+    flight.do('k', lambda: runs.append(1))
+    flight.do('k', lambda: runs.append(1))
+    flight.do('other', lambda: runs.append(1))
+
+    assert len(runs) == 3
@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+from core import metrics, task_queue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return task_queue.TaskQueue(str(tmp_path / 'tasks.sqlite3'), claim_timeout=60)
+
+
+def test_put_claim_done(queue):
+    assert queue.put('a', {'x': 1})
+    assert queue.put('b', {'x': 2})
+
+    first = queue.claim()
+    assert (first['name'], first['payload'], first['attempts']) == ('a', {'x': 1}, 1)
+    # claimed: not handed out twice
+    assert queue.claim()['name'] == 'b'
+    assert queue.claim() is None
+
+    queue.done(first['task_id'])
+    assert queue.counts() == {'pending': 1, 'failed': 0}
+
+
+def test_put_with_key_is_not_queued_twice(queue):
+    assert queue.put('a', {}, key='k')
+    assert not queue.put('a', {}, key='k')
+
+    queue.done(queue.claim()['task_id'])
+    assert queue.put('a', {}, key='k')
+
+
+def test_expired_claim_is_claimed_again(tmp_path):
+    queue = task_queue.TaskQueue(str(tmp_path / 'tasks.sqlite3'), claim_timeout=0)
+    queue.put('a', {})
+
+    assert queue.claim()['attempts'] == 1
+    assert queue.claim()['attempts'] == 2
+
+
+def test_tasks_survive_a_new_queue(queue):
+    queue.put('a', {'x': 1})
+
+    assert task_queue.TaskQueue(queue.path, claim_timeout=60).claim()['payload'] == {'x': 1}
+
+
+@pytest.mark.parametrize('attempts, counts, counter', [
+    (1, {'pending': 1, 'failed': 0}, 'tasks_retried'),
+    (3, {'pending': 0, 'failed': 1}, 'tasks_failed')
+])
+def test_worker_pool_failed_task(mocker, queue, attempts, counts, counter):
+    mocker.patch('core.metrics.metrics', metrics.Metrics())
+    pool = task_queue.WorkerPool(
+        queue, {'a': mocker.Mock(side_effect=ValueError)}, workers=1, poll_interval=1, max_attempts=3, retry_delay=60
+    )
+    queue.put('a', {})
+    task = queue.claim()
+
+    pool.run(dict(task, attempts=attempts))
+
+    assert queue.counts() == counts
+    assert queue.claim() is None
+    assert metrics.metrics.snapshot()['counters'] == {counter: 1}
+
+
+def test_worker_pool_runs_submitted_tasks(mocker, queue):
+    mocker.patch('core.metrics.metrics', metrics.Metrics())
+    handled = threading.Event()
+    payloads = []
+
+    def handler(payload):
+        payloads.append(payload)
+        handled.set()
+
+    pool = task_queue.WorkerPool(queue, {'a': handler}, workers=2, poll_interval=0.1, max_attempts=3, retry_delay=1)
+    pool.start()
+    try:
+        pool.submit('a', {'x': 1})
+        assert handled.wait(5)
+    finally:
+        pool.stop(timeout=5)
+
+    assert payloads == [{'x': 1}]
+    assert queue.counts() == {'pending': 0, 'failed': 0}
+    assert metrics.metrics.snapshot()['counters'] == {'tasks_done': 1}
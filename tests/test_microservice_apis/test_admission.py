@@ -0,0 +1,83 @@
+import pytest
+from flask import Flask
+from flask_jwt_extended import JWTManager
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from core import rate_limiting
+
+
+@pytest.fixture
+def admission(microservice_apis, mocker):
+    # not imported by the package: main.py installs it
+    from microservice_apis import admission
+    mocker.patch.object(admission, 'rate_limits', {'anonymous': rate_limiting.TokenBuckets(1, 2, 10)})
+    mocker.patch.object(admission, 'concurrency_limit', rate_limiting.ConcurrencyLimit(1))
+    return admission
+
+
+@pytest.fixture
+def client(admission):
+    app = Flask(__name__)
+    # behind one proxy
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1)
+    app.config['JWT_SECRET_KEY'] = 'secret'
+    JWTManager(app)
+    app.before_request(admission.admit)
+    app.teardown_request(admission.release)
+
+    @app.route('/anonymous/')
+    def listing():
+        return '[]'
+
+    @app.route('/admins/busy')
+    def busy():
+        # holds the only slot while it runs
+        return str(admission.concurrency_limit.acquire())
+
+    return app.test_client()
+
+
+def test_rate_limited_client_gets_429(client):
+    codes = [client.get('/anonymous/').status_code for _ in range(3)]
+
+    assert codes == [200, 200, 429]
+    response = client.get('/anonymous/')
+    assert response.headers['Retry-After'] == '1'
+    # another client
+    assert client.get('/anonymous/', environ_base={'REMOTE_ADDR': '10.0.0.2'}).status_code == 200
+
+
+def test_slot_is_released_after_request(client):
+    # the route would get the slot if the request had not taken it
+    assert client.get('/admins/busy').data == b'False'
+    assert client.get('/admins/busy').data == b'False'
+
+
+def test_busy_server_sheds_requests(client, admission):
+    admission.concurrency_limit.acquire()
+
+    assert client.get('/admins/busy').status_code == 503
+
+
+def test_forged_forwarded_for_does_not_change_client(client):
+    # the proxy appends the address it got the request from to the one the client wrote
+    for forged in ('1.1.1.1', '2.2.2.2'):
+        client.get('/anonymous/', headers={'X-Forwarded-For': f'{forged}, 10.0.0.3'})
+
+    assert client.get('/anonymous/', headers={'X-Forwarded-For': '3.3.3.3, 10.0.0.3'}).status_code == 429
+    assert client.get('/anonymous/', headers={'X-Forwarded-For': '10.0.0.4'}).status_code == 200
+
+
+def test_busy_server_sheds_requests_before_reading_the_token(client, admission, mocker):
+    mocked_client_key = mocker.patch.object(admission, 'client_key')
+    admission.concurrency_limit.acquire()
+
+    assert client.get('/anonymous/').status_code == 503
+    mocked_client_key.assert_not_called()
+
+
+def test_rate_limited_request_frees_its_slot(client, admission):
+    for _ in range(3):
+        client.get('/anonymous/')
+
+    assert admission.concurrency_limit.acquire()
@@ -0,0 +1,59 @@
+import gzip
+
+import pytest
+from flask import Flask, Response
+
+
+@pytest.fixture
+def compression(microservice_apis):
+    microservice_apis.compression.compressed_bodies.clear()
+    return microservice_apis.compression
+
+
+@pytest.fixture
+def client(compression):
+    app = Flask(__name__)
+    app.after_request(compression.compress_response)
+
+    @app.route('/big')
+    def big():
+        return Response('[' + ','.join(['{"title": "some book"}'] * 500) + ']', mimetype='application/json',
+                        headers={'ETag': '"abc"'})
+
+    @app.route('/small')
+    def small():
+        return Response('[]', mimetype='application/json')
+
+    return app.test_client()
+
+
+def test_compresses_large_responses(client, compression):
+    response = client.get('/big', headers={'Accept-Encoding': 'gzip'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['ETag'] == '"abc-gzip"'
+    assert gzip.decompress(response.data).startswith(b'[{"title": "some book"}')
+    assert compression.compressed_bodies.get(('abc', 'gzip')) == response.data
+
+
+def test_reuses_cached_compressed_body(client, compression, mocker):
+    client.get('/big', headers={'Accept-Encoding': 'gzip'})
+    mocked_compress = mocker.patch.object(compression, 'compress')
+    response = client.get('/big', headers={'Accept-Encoding': 'gzip'})
+
+    mocked_compress.assert_not_called()
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+
+@pytest.mark.parametrize('path, headers', [('/big', {}), ('/small', {'Accept-Encoding': 'gzip'})])
+def test_does_not_compress(client, path, headers):
+    response = client.get(path, headers=headers)
+
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['Vary'] == 'Accept-Encoding'
+
+
+def test_etag_variants(compression):
+    variants = compression.etag_variants('abc')
+    assert variants[0] == 'abc'
+    assert 'abc-gzip' in variants
@@ -0,0 +1,75 @@
+import pytest
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required
+from flask_restx import Api, Namespace, Resource
+
+from core import idempotency as idempotency_core
+
+
+@pytest.fixture
+def idempotency(microservice_apis):
+    return microservice_apis.idempotency
+
+
+@pytest.fixture
+def client(idempotency, mocker):
+    mocker.patch('core.idempotency.store', idempotency_core.MemoryStore(max_size=10))
+    app = Flask(__name__)
+    app.config['JWT_SECRET_KEY'] = 'secret'
+    JWTManager(app)
+    api = Api(app)
+    namespace = Namespace('test', path='/test')
+    counter = {'runs': 0}
+
+    @namespace.route('/')
+    class Counter(Resource):
+        @jwt_required()
+        @idempotency.idempotent(namespace)
+        def post(self):
+            counter['runs'] += 1
+            return {'runs': counter['runs']}, 201
+
+    api.add_namespace(namespace)
+    with app.app_context():
+        token = create_access_token('a@b.com')
+    client = app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+    return client
+
+
+def test_retry_with_same_key_is_replayed(client):
+    first = client.post('/test/', json={'x': 1}, headers={'Idempotency-Key': 'k'})
+    retry = client.post('/test/', json={'x': 1}, headers={'Idempotency-Key': 'k'})
+
+    assert (first.status_code, first.json) == (201, {'runs': 1})
+    assert (retry.status_code, retry.json) == (201, {'runs': 1})
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert client.post('/test/', json={'x': 1}).json == {'runs': 2}
+
+
+def test_key_sent_with_another_body_is_refused(client):
+    client.post('/test/', json={'x': 1}, headers={'Idempotency-Key': 'k'})
+
+    assert client.post('/test/', json={'x': 2}, headers={'Idempotency-Key': 'k'}).status_code == 422
+
+
+def test_retry_with_same_json_differently_serialized_is_replayed(client):
+    client.post(
+        '/test/', data='{"x": 1, "y": [1, 2]}', content_type='application/json', headers={'Idempotency-Key': 'k'}
+    )
+    retry = client.post(
+        '/test/', data='{"y":[1,2],\n "x":1}', content_type='application/json', headers={'Idempotency-Key': 'k'}
+    )
+
+    assert (retry.status_code, retry.json) == (201, {'runs': 1})
+
+
+def test_key_sent_with_another_raw_body_is_refused(client):
+    client.post('/test/', data='not json', headers={'Idempotency-Key': 'k'})
+
+    assert client.post('/test/', data='not json', headers={'Idempotency-Key': 'k'}).status_code == 201
+    assert client.post('/test/', data='not json!', headers={'Idempotency-Key': 'k'}).status_code == 422
+
+
+def test_too_long_key_is_refused(client):
+    assert client.post('/test/', headers={'Idempotency-Key': 'k' * 256}).status_code == 400
@@ -0,0 +1,28 @@
+import pytest
+from flask import Flask
+
+import const
+
+from core import cache
+
+
+def test_listing_etag_differs_across_catalog_caches(microservice_apis, mocker):
+    app = Flask(__name__)
+    etags = []
+    for _ in range(2):
+        # a new process: its catalog cache starts at version 0 again, whatever the data
+        mocker.patch('core.cache.catalog_cache', cache.CatalogCache(8))
+        with app.test_request_context('/anonymous/?limit=10'):
+            etags.append(microservice_apis.listing.listing_etag())
+
+    assert etags[0] != etags[1]
+
+
+@pytest.mark.parametrize('query_string, limit', [
+    ('', const.BOOKS_PAGE_SIZE_LIMIT), ('?limit=10', 10), ('?stream=ndjson', None), ('?stream=json&limit=10', 10)
+])
+def test_listing_limit_defaults_to_a_page(microservice_apis, query_string, limit):
+    with Flask(__name__).test_request_context(f'/anonymous/{query_string}'):
+        args = microservice_apis.listing.parse_books_listing_args(microservice_apis.listing.PUBLIC_BOOKS_FILTERS)
+
+    assert args['limit'] == limit
@@ -0,0 +1,50 @@
+import json
+
+import pytest
+from flask_restx import marshal
+
+BOOKS = [
+    {
+        'book_id': 1, 'title': 'Dune', 'year_published': 1965, 'author': 'Frank Herbert', 'price': 9.99,
+        'category_id': 2, 'stock': 3
+    },
+    {'book_id': 2, 'title': 'Emma', 'year_published': 1815, 'author': 'Jane Austen', 'price': 5, 'category_id': None,
+     'stock': 0},
+    {'book_id': 3, 'title': 'Solaris', 'rank': 0.4}
+]
+
+CATEGORIES = [{'category_id': 1, 'category_name': 'Fantasy'}, {'category_id': 2}]
+
+
+@pytest.fixture
+def serialization(microservice_apis):
+    return microservice_apis.serialization
+
+
+@pytest.fixture
+def admins(microservice_apis):
+    return microservice_apis.admins
+
+
+@pytest.mark.parametrize(
+    'model_name, objects',
+    [
+        ('books_response', BOOKS),
+        ('categories_response', CATEGORIES),
+        ('books_response', [])
+    ]
+)
+def test_serializer_matches_marshal(serialization, admins, model_name, objects):
+    model = getattr(admins, model_name)
+    assert serialization.serializer(model).serialize(objects) == json.loads(json.dumps(marshal(objects, model)))
+
+
+def test_serializer_with_keys_matches_marshal(serialization, admins):
+    keys = ['book_id', 'title', 'price']
+    expected = marshal(BOOKS, {k: admins.books_response[k] for k in keys})
+    assert serialization.serializer(admins.books_response, keys).serialize(BOOKS) == expected
+
+
+def test_dumps_round_trip(serialization, admins):
+    serialized = serialization.serializer(admins.books_response).serialize(BOOKS)
+    assert json.loads(serialization.dumps(serialized)) == serialized
@@ -0,0 +1,28 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+import const
+from orm import migrations
+
+
+@pytest.fixture(scope='module')
+def migrated_engine(request):
+    """
+    Engine on an empty schema of the test module's own, migrated to the latest version
+    """
+    schema = request.module.__name__.rsplit('.', 1)[-1]
+    engine = create_engine(const.DB_CONNECTION_URL, connect_args={'options': f'-csearch_path={schema},public'})
+    try:
+        with engine.begin() as connection:
+            connection.execute(text(f'DROP SCHEMA IF EXISTS {schema} CASCADE'))
+            connection.execute(text(f'CREATE SCHEMA {schema}'))
+    except OperationalError:
+        pytest.skip('database is not reachable')
+    try:
+        migrations.upgrade(engine)
+        yield engine
+    finally:
+        with engine.begin() as connection:
+            connection.execute(text(f'DROP SCHEMA IF EXISTS {schema} CASCADE'))
+        engine.dispose()
@@ -0,0 +1,35 @@
+from unittest.mock import MagicMock
+
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+
+from orm import books, carts
+
+
+@pytest.mark.parametrize('method, args', [('add_book', ('a@b.com', 1)), ('add_books', ('a@b.com', [2, 1, 2]))])
+def test_add_locks_cart_lines_first(method, args):
+    # like `remove`, so that an add and a remove of the same cart line cannot deadlock
+    table = carts.Carts()
+    session = MagicMock()
+    session.__enter__.return_value = session
+    table.session_factory = lambda: session
+
+    getattr(table, method)(*args)
+
+    first = str(session.execute.call_args_list[0].args[0].compile(dialect=postgresql.dialect()))
+    assert 'FROM carts' in first and first.endswith('FOR UPDATE')
+    assert 'ORDER BY carts.book_id' in first
+
+
+def test_stock_crossing_zero_is_reported(migrated_engine, mocker):
+    # what the catalog cache is invalidated on
+    mocker.patch('orm.session_factory', sessionmaker(bind=migrated_engine))
+    books.Books().create({'title': 'Emma', 'year_published': 1815, 'author': 'Jane Austen', 'price': 5, 'stock': 2})
+    table = carts.Carts()
+
+    line = table.add_book('a@b.com', 1, 2)
+    assert line['stock'] == 0
+    assert table.remove(line['cart_id'], 'a@b.com') is True
+    assert table.remove(line['cart_id'], 'a@b.com') is False
+    assert [line['stock'] for line in table.add_books('a@b.com', [1])] == [1]
@@ -0,0 +1,14 @@
+from sqlalchemy.orm import sessionmaker
+
+from orm import catalog_version
+
+
+def test_bump_is_seen_by_all_instances(migrated_engine, mocker):
+    mocker.patch('orm.session_factory', sessionmaker(bind=migrated_engine))
+    first, second = catalog_version.CatalogVersion(), catalog_version.CatalogVersion()
+
+    assert first.read() == 0
+    assert first.bump() == 1
+    assert second.read() == 1
+    assert second.bump() == 2
+    assert first.read() == 2
@@ -0,0 +1,116 @@
+import json
+
+import pytest
+from sqlalchemy import text
+
+from orm import books, carts, migrations, orders, stock_shards
+
+
+def test_discover():
+    discovered = migrations.discover()
+
+    assert [m.version for m in discovered] == list(range(1, len(discovered) + 1))
+    assert all(callable(m.module.upgrade) for m in discovered)
+
+
+class ExplainingSession:
+    """
+    Stands in for the session of an orm table: records the plan of each statement instead of running it
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.plans = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, statement):
+        sql = statement.compile(dialect=self.connection.dialect, compile_kwargs={'literal_binds': True})
+        plan = self.connection.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {sql}').scalar()
+        self.plans.append(plan if isinstance(plan, list) else json.loads(plan))
+        return self
+
+    def fetchall(self):
+        return []
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return []
+
+    def __iter__(self):
+        return iter([])
+
+    def commit(self):
+        pass
+
+
+def _scans(node):
+    yield node['Node Type'], node.get('Relation Name'), node.get('Index Name')
+    for child in node.get('Plans', []):
+        yield from _scans(child)
+
+
+@pytest.fixture(scope='module')
+def migrated_connection(migrated_engine):
+    with migrated_engine.connect() as connection:
+        # tables are empty: make the planner use any index that can serve the query
+        connection.execute(text('SET enable_seqscan = off'))
+        yield connection
+
+
+def test_upgrade_is_idempotent(migrated_connection):
+    engine = migrated_connection.engine
+
+    assert migrations.upgrade(engine) == []
+    assert migrations.applied_versions(migrated_connection) == {m.version for m in migrations.discover()}
+
+
+@pytest.mark.parametrize('table_class, method, kwargs, expected_index', [
+    (carts.Carts, 'read', {'email': 'a@b.com'}, 'carts_email_book_id_key'),
+    (carts.Carts, 'get_cart_content', {'email': 'a@b.com'}, 'carts_email_book_id_key'),
+    (
+        carts.Carts, 'delete', {'identifier': 'a@b.com', 'identifier_type': carts.CartsColumns.EMAIL},
+        'carts_email_book_id_key'
+    ),
+    (books.Books, 'read', {'filter_values': ['Fantasy']}, 'books_category_id_idx'),
+    (books.Books, 'read', {'order_column': 'price', 'limit': 10}, 'books_price_idx'),
+    (books.Books, 'read', {'order_column': 'year_published', 'limit': 10}, 'books_year_published_idx'),
+    (books.Books, 'read', {'order_column': 'price', 'limit': 10, 'in_stock_only': True}, 'books_in_stock_price_idx'),
+    (books.Books, 'read', {'limit': 10, 'in_stock_only': True}, 'books_in_stock_idx'),
+    (books.Books, 'read', {'min_year': 1990, 'max_year': 1999}, 'books_year_published_idx'),
+    (books.Books, 'search', {'query': 'potter', 'limit': 10}, None),
+    (carts.Carts, 'expire', {'batch_size': 100}, 'carts_expires_at_idx'),
+    (carts.Carts, 'remove', {'cart_id': 1, 'email': 'a@b.com'}, 'carts_pkey'),
+    (stock_shards.StockShards, 'rebalance', {'book_ids': [1]}, 'book_stock_shards_pkey'),
+    (orders.Orders, 'place', {'email': 'a@b.com'}, 'carts_email_book_id_key'),
+    (orders.Orders, 'read', {'order_id': 1}, 'orders_pkey'),
+    (orders.Orders, 'read_ids', {'status': orders.OrderStatus.PLACED}, 'orders_placed_idx'),
+])
+def test_hot_queries_use_indexes(migrated_connection, table_class, method, kwargs, expected_index):
+    table = table_class()
+    session = ExplainingSession(migrated_connection)
+    table.session_factory = lambda: session
+    try:
+        getattr(table, method)(**kwargs)
+    except IndexError:
+        pass    # methods reading a result row; the plan is recorded already
+
+    assert session.plans
+    for plan in session.plans:
+        scans = list(_scans(plan[0]['Plan']))
+        assert not [s for s in scans if s[0] == 'Seq Scan'], scans
+        if expected_index:
+            assert expected_index in {s[2] for s in scans}, scans
+
+
+def test_carts_foreign_key_uses_index(migrated_connection):
+    # what postgres runs on carts for each book deleted or whose book_id changes
+    plan = migrated_connection.execute(
+        text('EXPLAIN (FORMAT JSON) SELECT 1 FROM carts WHERE book_id = 1 FOR KEY SHARE')
+    ).scalar()
+    assert 'carts_book_id_idx' in {s[2] for s in _scans(plan[0]['Plan'])}
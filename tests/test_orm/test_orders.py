@@ -0,0 +1,59 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from orm import books, carts, orders
+
+
+@pytest.mark.filterwarnings('error::sqlalchemy.exc.SAWarning')
+def test_place(migrated_engine, mocker):
+    mocker.patch('orm.session_factory', sessionmaker(bind=migrated_engine))
+    books.Books().create({'title': 'Emma', 'year_published': 1815, 'author': 'Jane Austen', 'price': 5, 'stock': 3})
+    books.Books().create({'title': 'Dune', 'year_published': 1965, 'author': 'Frank Herbert', 'price': 2, 'stock': 3})
+    carts.Carts().add_books('a@b.com', [1, 1, 2])
+
+    order = orders.Orders().place('a@b.com')
+
+    assert (order['price'], order['quantity'], order['status']) == (12, 3, orders.OrderStatus.PLACED)
+    lines = orders.Orders().read(order['order_id'])['lines']
+    assert sorted((line['book_id'], line['quantity'], line['price']) for line in lines) == [(1, 2, 5), (2, 1, 2)]
+    assert orders.Orders().place('a@b.com') is None
+
+
+@pytest.fixture
+def placed_order(migrated_engine, mocker, request):
+    mocker.patch('orm.session_factory', sessionmaker(bind=migrated_engine))
+    # book titles are unique, and the schema is shared by the tests of this module
+    books.Books().create(
+        {'title': request.node.name, 'year_published': 1922, 'author': 'James Joyce', 'price': 8, 'stock': 9}
+    )
+    book = books.Books().read(filter_column='title', filter_values=[request.node.name], columns=['book_id'])[0]
+    carts.Carts().add_book('c@d.com', book['book_id'])
+    return orders.Orders().place('c@d.com')['order_id']
+
+
+def test_process_handles_order_once(placed_order):
+    handled = []
+
+    assert orders.Orders().process(placed_order, handled.append) is True
+    assert orders.Orders().process(placed_order, handled.append) is False
+    assert [order['order_id'] for order in handled] == [placed_order]
+    assert orders.Orders().read(placed_order)['status'] == orders.OrderStatus.PROCESSED
+
+
+def test_process_skips_order_locked_by_another_worker(placed_order, migrated_engine):
+    handled = []
+    with migrated_engine.connect() as other_worker:
+        other_worker.execute(text('SELECT 1 FROM orders WHERE order_id = :id FOR UPDATE'), {'id': placed_order})
+
+        assert orders.Orders().process(placed_order, handled.append) is False
+    assert handled == []
+
+
+def test_process_leaves_order_placed_on_failure(placed_order):
+    def fail(order):
+        raise RuntimeError('receipt not sent')
+
+    with pytest.raises(RuntimeError):
+        orders.Orders().process(placed_order, fail)
+    assert orders.Orders().read(placed_order)['status'] == orders.OrderStatus.PLACED
@@ -0,0 +1,26 @@
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from core import admins, registered_users
+from orm import books, stock_shards
+
+
+@pytest.fixture
+def hot_book(migrated_engine, mocker):
+    mocker.patch('orm.session_factory', sessionmaker(bind=migrated_engine))
+    books.Books().create({'title': 'Dune', 'year_published': 1965, 'author': 'Frank Herbert', 'price': 9, 'stock': 5})
+    book_id = books.Books().read(filter_column='title', filter_values=['Dune'], columns=['book_id'])[0]['book_id']
+    stock_shards.StockShards().set_shards(book_id, 3)
+    return book_id
+
+
+def test_admin_stock_of_hot_book_survives_rebalance(hot_book):
+    result = admins.Admins().update_book({'title': 'Dune', 'stock': 50})
+    registered_users.rebalance_hot_books()
+
+    assert result[1] == 200
+    shards = stock_shards.StockShards().read(hot_book)
+    assert [s['stock'] for s in shards] == [17, 17, 16]
+    assert books.Books().read(
+        filter_column='book_id', filter_values=[hot_book], columns=['stock']
+    ) == [{'stock': 50}]